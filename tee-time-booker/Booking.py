@@ -1,9 +1,24 @@
 import DB as DB_module
-import rsa
+import asyncio
+import async_booker
+import brs_client
+import brs_responses
+import brs_transport
+import browser_pool
+import credentials
+import fire_schedule
+import job_queue
+import metrics
+import os
+import preferences
+import release_clock
+import release_rules
+import slot_allocation
 import tee_time_booker
+from dataclasses import dataclass
 from datetime import datetime, time, timedelta, date
+from typing import Optional
 import time as time_module
-import schedule
 import logging
 
 # Set up logging
@@ -11,56 +26,340 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 DB = DB_module.Database()
+VAULT = credentials.CredentialVault(DB)
+QUEUE = job_queue.JobQueue(DB)
+WORKER_ID = job_queue.worker_id()
 
-def process_bookings():
-    """Process bookings that need to be made today"""
+# How long before the release time the login (prepare) phase starts
+PREWARM_SECONDS = 30
+
+# How often the scheduler checks whether another process changed the bookings table, and
+# reloads its fire schedule if so. Bookings made through the web UI in this process are
+# added to the schedule straight away.
+RESYNC_SECONDS = float(os.getenv("FIRE_RESYNC_SECONDS", "60"))
+
+# Launch browsers during the prepare phase. They're only used when the tee sheet can't
+# be read over plain HTTP, so this can be turned off where Chrome isn't available.
+PREWARM_BROWSERS = os.getenv("PREWARM_BROWSERS", "1") == "1"
+
+# Maximum number of bookings prepared and fired at the same time. They all run on one
+# event loop, so this only bounds the requests in flight, not threads.
+MAX_CONCURRENT_BOOKINGS = int(os.getenv("BOOKING_CONCURRENCY", "32"))
+
+
+@dataclass
+class BookingOutcome:
+    """Result of a single booking attempt"""
+    booking_id: int
+    username: str
+    success: bool = False
+    outcome: Optional[str] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    fired_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+
+def next_release_datetime():
+    """The earliest release instant today that still has bookings to make, or None"""
+    rows = DB.execute_query(
+        "SELECT MIN(bookings.release_at) AS release_at FROM bookings "
+        "LEFT JOIN jobs ON jobs.booking_id = bookings.id "
+        "WHERE bookings.release_at >= ? AND bookings.release_at < ? AND (jobs.state IS NULL OR jobs.state IN (?, ?))",
+        (*release_rules.day_bounds(), job_queue.JobState.QUEUED.value, job_queue.JobState.LEASED.value))
+    release_at = rows[0]["release_at"] if rows else None
+    return datetime.fromtimestamp(release_at) if release_at is not None else None
+
+
+def get_due_bookings(release_at):
+    """Return bookings that open at release_at (epoch seconds), purging any that are out of date"""
+    # Indexed lookup on the stored release instant, rather than parsing every row
+    due_bookings = DB.execute_query("SELECT * FROM bookings WHERE release_at = ? ORDER BY id", (release_at,))
+
+    # Clean up bookings whose tee date has passed in one statement. Dates sort as stored.
+    deleted = DB.execute_update("DELETE FROM bookings WHERE date < ?",
+                                (date.today().strftime(release_rules.DATE_FORMAT),))
+    if deleted:
+        logger.info(f"Deleted {deleted} old bookings")
+    QUEUE.purge(release_rules.earliest_release_at(date.today()))
+
+    return due_bookings
+
+
+def claim_bookings(release_at, limit=None):
+    """Lease a batch of the booking jobs opening at release_at to this worker, returning their bookings"""
+    booking_ids = QUEUE.claim(WORKER_ID, release_at, release_at + 1, limit or job_queue.BATCH_SIZE)
+    if not booking_ids:
+        return []
+
+    placeholders = ",".join("?" * len(booking_ids))
+    return DB.execute_query(f"SELECT * FROM bookings WHERE id IN ({placeholders}) ORDER BY release_at, id",
+                            tuple(booking_ids))
+
+
+async def prepare_booking(booking, pool):
+    """Pre-open phase: log in with the account's unlocked password, returning a ready session"""
+    return await async_booker.prepare(pool.session(), booking["username"], VAULT.password(booking["username"]), booking["club"])
+
+
+def plan_booking(booking):
+    """Expand a booking's ranked time windows into its candidate plan, ahead of the release"""
+    booking["plan"] = preferences.candidate_plan(preferences.windows_from_booking(booking))
+    return booking
+
+
+def booking_courses(booking):
+    """Courses the booking will play, best first"""
+    courses = [course.strip() for course in (booking.get("courses") or "").split(",") if course.strip()]
+    return courses or [tee_time_booker.DEFAULT_COURSE]
+
+
+def booking_preferences(booking):
+    """Tee times the booking will accept, best first"""
+    if "plan" not in booking:
+        plan_booking(booking)
+    return booking["plan"]
+
+
+async def fire_booking(booking, prepared, slots=None):
+    """Release phase: post the booking on a prepared session
+
+    slots are the tee sheet rows allocated from a shared tee sheet. Without them the
+    booking fetches and parses the sheet itself.
+    """
+    players = booking["players"].split(",")
+
+    if slots is not None:
+        return await async_booker.fireSlots(prepared, slots, *players)
+
+    return await async_booker.fire(prepared, booking_preferences(booking), booking["date"], *players,
+                                   courses=booking_courses(booking))
+
+
+async def fetch_group_sheet(group, prepared_by_id):
+    """Fetch and parse the tee sheets for a (club, date) group once, on the first logged-in session
+
+    Every course any of the group's bookings will play is fetched, all at once.
+    """
+    (club, tee_date), bookings = group
+    prepared = next((prepared_by_id[b["id"]] for b in bookings
+                     if not isinstance(prepared_by_id[b["id"]], Exception)), None)
+    if prepared is None:
+        return None
+
+    courses = list(dict.fromkeys(course for booking in bookings for course in booking_courses(booking)))
+
+    try:
+        with metrics.span("fetchGroupSheet"):
+            return await async_booker.fetchTeeSheetIndex(prepared.session, club, tee_date, courses=courses)
+    except Exception as e:
+        logger.error(f"Error fetching the tee sheet for {club} on {tee_date}: {e}")
+        return None
+
+
+def allocate_group_slots(groups, sheets):
+    """Booking id -> allocated tee sheet rows, for every group whose sheet was read"""
+    allocation = {}
+    for ((club, tee_date), bookings), index in zip(groups, sheets):
+        if index is None:
+            logger.warning(f"No shared tee sheet for {club} on {tee_date}, bookings will fetch their own")
+            continue
+        allocation.update(slot_allocation.allocate_slots(bookings, index, booking_preferences,
+                                                         tee_time_booker.MAX_CANDIDATES, booking_courses))
+    return allocation
+
+
+async def run_fire_phase(booking, prepared, record, slots=None):
+    """Fire a prepared booking and record the outcome"""
+    outcome = BookingOutcome(booking["id"], booking["username"])
+
+    if isinstance(prepared, Exception):
+        outcome.error = f"Prepare failed: {prepared}"
+        metrics.write_run_record(record)
+        return outcome
+
+    if slots == []:
+        outcome.outcome = brs_responses.Outcome.SLOT_TAKEN.value
+        outcome.error = "None of the booking's tee times were available"
+        metrics.write_run_record(record)
+        return outcome
+
+    logger.info(f"Processing booking ID {booking['id']} for {booking['username']} on {booking['date']} at {booking['time']}")
+    outcome.fired_at = datetime.now()
+    try:
+        with metrics.bind(record), metrics.span("fire"):
+            result = await fire_booking(booking, prepared, slots)
+
+        outcome.status_code = result.status_code if result is not None else None
+        outcome.outcome = brs_responses.classify(result).value
+        outcome.success = outcome.outcome == brs_responses.Outcome.SUCCESS.value
+        logger.info(f"Booking attempt completed for {booking['username']}: {result}")
+
+    except Exception as e:
+        outcome.error = str(e)
+        logger.error(f"Error processing booking {booking['id']}: {e}")
+
+    outcome.completed_at = datetime.now()
+    metrics.write_run_record(record)
+    return outcome
+
+
+async def run_prepare_phase(booking, record, pool):
+    """Prepare a booking, returning the exception instead of raising so one failure can't stop the rest"""
+    logger.info(f"Preparing booking ID {booking['id']} for {booking['username']} on {booking['date']} at {booking['time']}")
+    try:
+        with metrics.bind(record), metrics.span("prepare"):
+            return await prepare_booking(booking, pool)
+    except Exception as e:
+        logger.error(f"Error preparing booking {booking['id']}: {e}")
+        return e
+
+
+def process_bookings(release_datetime=None, max_workers=None, batch_size=None):
+    """Process bookings that open at release_datetime (defaults to the next release today)
+
+    The due bookings are queued as jobs, then claimed in batches shared with any
+    other workers on the same database. Each batch runs ahead of the release time:
+    every booking is logged in first, then the sheet fetch and booking POST are
+    fired exactly at the release time. Both phases run concurrently on one event
+    loop, up to max_workers bookings at a time, each account with its own cookies on
+    a shared pool of keep-alive connections. Bookings for the same club and date
+    share one tee sheet fetch and are given distinct slots. Returns a BookingOutcome
+    per booking this worker processed.
+    """
+    release_datetime = release_datetime or next_release_datetime()
+    if release_datetime is None:
+        logger.info("No bookings open today")
+        return []
+    release_at = int(release_datetime.timestamp())
+
+    try:
+        QUEUE.enqueue(get_due_bookings(release_at))
+    except Exception as e:
+        logger.error(f"Error queueing due bookings: {e}")
+
+    outcomes = []
+    while True:
+        try:
+            bookings = claim_bookings(release_at, batch_size)
+        except Exception as e:
+            logger.error(f"Error claiming booking jobs: {e}")
+            break
+        if not bookings:
+            break
+
+        logger.info(f"Worker {WORKER_ID} claimed {len(bookings)} bookings")
+        with QUEUE.leased(WORKER_ID, [booking["id"] for booking in bookings]):
+            batch = asyncio.run(process_bookings_async(bookings, release_datetime, max_workers))
+
+        # A batch that failed as a whole comes back with an errored outcome per booking, so its
+        # jobs are marked failed (and left to the cancellation watcher) rather than sitting leased
+        for outcome in batch:
+            QUEUE.complete(WORKER_ID, outcome.booking_id, outcome.success, outcome.outcome, outcome.error)
+        outcomes.extend(batch)
+
+    return outcomes
+
+
+def reclaim_expired_jobs():
+    """Process the jobs of today's releases that were left leased by a worker that died
+
+    Their leases only run out LEASE_SECONDS after the worker stopped renewing them, when
+    every other worker has finished with that release, so nothing would claim them again.
+    Jobs on their last attempt are marked failed by the claim instead, for the
+    cancellation watcher to pick up.
+    """
+    for release_at in QUEUE.expired(*release_rules.day_bounds()):
+        release_datetime = datetime.fromtimestamp(release_at)
+        logger.info(f"Reclaiming booking jobs with expired leases from the {release_datetime} release")
+        process_bookings(release_datetime)
+
+
+async def gather_bounded(limit, coroutines):
+    """Run coroutines concurrently, at most limit at a time, keeping their order"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(bounded(coroutine) for coroutine in coroutines))
+
+
+async def process_bookings_async(bookings, release_datetime, max_workers=None):
+    """Prepare and fire a batch of bookings on the running event loop"""
     current_time = datetime.now()
+    max_workers = max_workers or MAX_CONCURRENT_BOOKINGS
     logger.info(f"Processing bookings at exactly {current_time.strftime('%H:%M:%S.%f')[:-3]}")
     
     try:
-        data = DB.execute_query("SELECT * FROM bookings")
-        processed_bookings = []
-        
-        for booking in data:
-            booking_date = datetime.strptime(booking["date"], "%Y/%m/%d").date()
-            booking_open_date = booking_date - timedelta(days=8)
-            
-            # Check if booking opens today
-            if booking_open_date == date.today():
-                logger.info(f"Processing booking ID {booking['id']} for {booking['username']} on {booking['date']} at {booking['time']}")
-                
-                try:
-                    # Decrypt password and run booking
-                    decrypted_password = rsa.decrypt(
-                        bytes.fromhex(booking["password"]), 
-                        rsa.PrivateKey.load_pkcs1(booking["private_key"].encode())
-                    ).decode()
-                    
-                    result = tee_time_booker.run(
-                        booking["username"], 
-                        decrypted_password, 
-                        booking["club"], 
-                        [booking["time"]], 
-                        booking["date"], 
-                        *booking["players"].split(",")
-                    )
-                    
-                    logger.info(f"Booking attempt completed for {booking['username']}: {result}")
-                    processed_bookings.append(booking['id'])
-                    
-                except Exception as e:
-                    logger.error(f"Error processing booking {booking['id']}: {e}")
-            
-            # Clean up old bookings (older than 8 days ago)
-            elif booking_date < date.today() - timedelta(days=8):
-                logger.info(f"Deleting old booking ID {booking['id']} for date {booking['date']}")
-                DB.execute_update("DELETE FROM bookings WHERE id = ?", (booking["id"],))
-        
-        return processed_bookings
+        due_bookings = [plan_booking(booking) for booking in bookings]
+        if not due_bookings:
+            return []
+
+        workers = min(max_workers, len(due_bookings))
+
+        # Launch and pre-navigate one browser per concurrent booking (capped by the pool's memory
+        # budget). Chrome start-up blocks, so it runs off the loop.
+        if PREWARM_BROWSERS:
+            pool = browser_pool.getPool(workers)
+            for i, booking in enumerate(due_bookings[:workers]):
+                await asyncio.to_thread(pool.start, f"{tee_time_booker.BRS_MEMBERS_URL}/{booking['club']}", count=i + 1)
+
+        # One timing record per booking, covering both phases
+        records = [metrics.RunRecord(booking["id"], booking["club"]) for booking in due_bookings]
+
+        # Decrypt each account's password once, well before the release time
+        VAULT.unlock(booking["username"] for booking in due_bookings)
+
+        async with brs_client.ConnectionPool() as connections:
+            # Prepare phase - everything that can happen before the sheet opens
+            prepared = await gather_bounded(workers, (run_prepare_phase(booking, record, connections)
+                                                      for booking, record in zip(due_bookings, records)))
+
+            # Calibrate against the BRS server clock while we wait. The Date header
+            # doesn't need a login, so this uses its own blocking session off the loop,
+            # on a WarmAdapter so its HEADs come out of the host's request budget.
+            with brs_transport.session() as calibration:
+                clock = await asyncio.to_thread(release_clock.estimate_offset, calibration,
+                                                f"{tee_time_booker.BRS_MEMBERS_URL}/")
+
+            # Sockets for the fire phase, opened (and through TLS) ahead of time and pinged
+            # until just before the release so they aren't dropped as idle
+            await connections.keep_warm(tee_time_booker.BRS_MEMBERS_URL, workers,
+                                        release_datetime.timestamp() - clock.offset)
+
+            # Fire phase - only the critical path at the release time. The wait blocks
+            # the loop on purpose: nothing else should run in the last few milliseconds.
+            firing_error = release_clock.wait_for_release(release_datetime, clock)
+            logger.info(f"Fired {firing_error * 1000:.3f}ms after target "
+                        f"(server offset {clock.offset * 1000:+.1f}ms ±{clock.uncertainty * 1000:.1f}ms, "
+                        f"lead {release_clock.FIRE_LEAD_SECONDS * 1000:.1f}ms)")
+
+            # One sheet request per (club, date), then distinct slots for each of our bookings
+            groups = list(slot_allocation.group_bookings(due_bookings).items())
+            prepared_by_id = {booking["id"]: p for booking, p in zip(due_bookings, prepared)}
+            sheets = await gather_bounded(workers, (fetch_group_sheet(group, prepared_by_id) for group in groups))
+            allocation = allocate_group_slots(groups, sheets)
+
+            outcomes = await gather_bounded(workers, (
+                run_fire_phase(booking, p, record, allocation.get(booking["id"]))
+                for booking, p, record in zip(due_bookings, prepared, records)))
+
+        succeeded = sum(outcome.success for outcome in outcomes)
+        logger.info(f"Processed {len(outcomes)} bookings, {succeeded} succeeded")
+
+        return outcomes
         
     except Exception as e:
         logger.error(f"Error in process_bookings: {e}")
-        return []
+        return [BookingOutcome(booking["id"], booking["username"], error=f"Batch failed: {e}") for booking in bookings]
+
+    finally:
+        # Browsers and decrypted passwords are only needed around the release time
+        browser_pool.closePool()
+        VAULT.forget()
+
 
 def wait_for_exact_time():
     """Wait until exactly 7:30:00 AM, then execute bookings"""
@@ -78,28 +377,73 @@ def wait_for_exact_time():
     logger.info(f"Target time: {target_time.strftime('%H:%M:%S.%f')[:-3]}")
     logger.info(f"Sleeping for {sleep_duration:.3f} seconds")
     
-    # Sleep until exactly the target time
-    time_module.sleep(sleep_duration)
+    # Sleep until the prepare phase, process_bookings fires at exactly 7:30:00 AM
+    time_module.sleep(max(sleep_duration - PREWARM_SECONDS, 0))
     
     # Execute bookings at exactly 7:30:00 AM
-    process_bookings()
+    process_bookings(target_time)
+
+def apply_release_rules():
+    """Bring the stored release instants of upcoming bookings up to date with the club release rules
+
+    The rules are read once at startup, so this only has to run when the scheduler starts
+    for a changed rule to apply to bookings made before it.
+    """
+    bookings = DB.execute_query("SELECT id, club, date, release_at FROM bookings WHERE date >= ?",
+                                (date.today().strftime(release_rules.DATE_FORMAT),))
+    moved = []
+    for booking in bookings:
+        try:
+            release_at = release_rules.release_at(booking["date"], booking["club"])
+        except ValueError:
+            continue
+        if release_at != booking["release_at"]:
+            moved.append((release_at, booking["id"]))
+    if moved:
+        with DB.get_connection() as conn:
+            conn.executemany("UPDATE bookings SET release_at = ? WHERE id = ?", moved)
+            conn.commit()
+        logger.info(f"Moved {len(moved)} bookings to their club's release time")
+
+
+def load_fire_schedule():
+    """Build the fire schedule from the bookings that open from today on
+
+    Returns the bookings table version the schedule was built from.
+    """
+    version = DB.table_version("bookings")
+    fire_schedule.FIRES.load(DB.execute_query("SELECT id, release_at FROM bookings WHERE release_at >= ?",
+                                              (release_rules.day_bounds()[0],)))
+    return version
+
 
 def run_booking_scheduler():
-    """Continuous booking scheduler that runs at exactly 7:30:00 AM every day"""
-    logger.info("Booking scheduler started - will run at exactly 7:30:00 AM daily")
-    
-    # Schedule the booking to run at exactly 7:30:00 AM every day
-    schedule.every().day.at("07:30:00").do(process_bookings)
-    
+    """Continuous booking scheduler that wakes at each release instant on the fire schedule"""
+    apply_release_rules()
+    version = load_fire_schedule()
+    logger.info(f"Booking scheduler started with {len(fire_schedule.FIRES)} release times to fire")
+
     while True:
         try:
-            # Check if it's time to run any scheduled jobs
-            schedule.run_pending()
-            
-            # Sleep for a longer time to reduce CPU usage and be more responsive to interrupts
-            # Using 1 second instead of 0.1 for better performance
-            time_module.sleep(1)
-            
+            # Sleeps until the prepare phase of the earliest release, PREWARM_SECONDS
+            # ahead of it. process_bookings times the fire phase itself against the
+            # server clock.
+            release_at = fire_schedule.FIRES.wait_for_next(PREWARM_SECONDS, RESYNC_SECONDS)
+            if release_at is not None:
+                fire_schedule.FIRES.pop(release_at)
+                process_bookings(datetime.fromtimestamp(release_at))
+                continue
+
+            # Between releases, pick up the jobs of any worker that died mid-release
+            reclaim_expired_jobs()
+
+            # Bookings made by other processes only show up in the table. Reloading
+            # puts back today's fired release times too, which fire again but only
+            # pick up bookings added since.
+            latest = DB.table_version("bookings")
+            if latest != version:
+                version = load_fire_schedule()
+
         except KeyboardInterrupt:
             logger.info("Booking scheduler stopped by user")
             break
@@ -109,8 +453,10 @@ def run_booking_scheduler():
 
 def main():
     """Main entry point - starts the precise booking scheduler"""
-    logger.info("Starting precise booking scheduler - executes exactly at 7:30:00 AM daily")
-    logger.info("Bookings will be processed exactly 8 days before the tee time")
+    default = release_rules.DEFAULT_RULE
+    logger.info(f"Starting precise booking scheduler - bookings are processed at {default.release_time} "
+                f"{default.timezone or 'local time'}, {default.days_ahead} days before the tee time, "
+                f"unless their club has its own release rule ({len(release_rules.CLUB_RULES)} configured)")
     
     try:
         run_booking_scheduler()
@@ -154,10 +500,10 @@ def main_legacy():
             wait_until_time(target_time)
             
             logger.info("It's 7:30 AM - processing bookings...")
-            processed = process_bookings()
+            outcomes = process_bookings()
             
-            if processed:
-                logger.info(f"Processed {len(processed)} bookings")
+            if outcomes:
+                logger.info(f"Processed {len(outcomes)} bookings, {sum(o.success for o in outcomes)} succeeded")
             else:
                 logger.info("No bookings to process today")
             
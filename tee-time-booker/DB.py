@@ -1,13 +1,22 @@
 import sqlite3
 import logging
+import threading
 from contextlib import contextmanager
 from typing import Optional, List, Dict, Any
+import booking_display
+import release_rules
+
+# Current time as epoch seconds with a fractional part, in SQL
+EPOCH_NOW = "(julianday('now') - 2440587.5) * 86400.0"
 
 class Database:
     def __init__(self, db_path: str = "database.db"):
         self.db_path = db_path
+        # One long-lived connection per thread - sqlite3 connections can't be shared
+        # between threads, and the Flask UI and the scheduler run on different ones
+        self._local = threading.local()
         self.init_database()
-    
+
     def init_database(self):
         """Initialize the database with required tables"""
         with self.get_connection() as conn:
@@ -21,40 +30,162 @@ class Database:
                     date TEXT NOT NULL,
                     time TEXT NOT NULL,
                     players TEXT NOT NULL,
-                    password TEXT NOT NULL,
-                    private_key TEXT NOT NULL
+                    release_at INTEGER,
+                    time_windows TEXT
+                )
+            """)
+            # Encrypted BRS passwords, one row per account (see credentials.CredentialVault)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS credentials (
+                    username TEXT PRIMARY KEY,
+                    password TEXT NOT NULL
                 )
             """)
+            # Account settings and player roster for the web UI (see settings.SettingsStore)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS players (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL UNIQUE
+                )
+            """)
+            # One job per booking for the booking workers (see job_queue.JobQueue)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    booking_id INTEGER PRIMARY KEY,
+                    release_at INTEGER NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    outcome TEXT,
+                    error TEXT,
+                    updated_at REAL
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state_release_at ON jobs (state, release_at)")
+            # Change counter per table, bumped by triggers, for the API's ETag/Last-Modified
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS table_versions (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    modified_at REAL NOT NULL
+                )
+            """)
+            self._version_table(cursor, "bookings")
+            # Keyed digest of each stored password, so saving an unchanged one skips the write
+            self._add_column(cursor, "credentials", "digest", "TEXT")
+            self._migrate_release_at(cursor)
+            self._add_column(cursor, "bookings", "time_windows", "TEXT")
+            # Comma separated courses the booking will play, best first
+            self._add_column(cursor, "bookings", "courses", "TEXT NOT NULL DEFAULT '1'")
+            self._migrate_display_fields(cursor)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_release_at ON bookings (release_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_date_time ON bookings (date, time, id)")
             conn.commit()
-    
+
+    def _migrate_release_at(self, cursor):
+        """Add and backfill the release_at column on databases created before it existed"""
+        columns = [row["name"] for row in cursor.execute("PRAGMA table_info(bookings)")]
+        if "release_at" not in columns:
+            cursor.execute("ALTER TABLE bookings ADD COLUMN release_at INTEGER")
+
+        rows = cursor.execute("SELECT id, club, date FROM bookings WHERE release_at IS NULL").fetchall()
+        for row in rows:
+            try:
+                cursor.execute("UPDATE bookings SET release_at = ? WHERE id = ?",
+                               (release_rules.release_at(row["date"], row["club"]), row["id"]))
+            except ValueError:
+                logging.warning(f"Booking {row['id']} has an invalid date: {row['date']}")
+
+    def _migrate_display_fields(self, cursor):
+        """Add the stored display columns and fill them in for existing bookings"""
+        for column in ("formatted_date", "day_name", "time_label", "backup_times"):
+            self._add_column(cursor, "bookings", column, "TEXT")
+
+        rows = cursor.execute("SELECT * FROM bookings WHERE time_label IS NULL").fetchall()
+        for row in rows:
+            fields = booking_display.booking_display_fields(dict(row))
+            cursor.execute("UPDATE bookings SET formatted_date = ?, day_name = ?, time_label = ?, backup_times = ? "
+                           "WHERE id = ?", (*fields.values(), row["id"]))
+
+    def _version_table(self, cursor, table):
+        """Bump table_versions for table on every insert, update and delete"""
+        cursor.execute(f"INSERT OR IGNORE INTO table_versions (name, modified_at) VALUES (?, {EPOCH_NOW})", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1, modified_at = {EPOCH_NOW}
+                    WHERE name = '{table}';
+                END
+            """)
+
+    def table_version(self, table: str) -> Optional[Dict[str, Any]]:
+        """Change counter and last modification time (epoch seconds) of a versioned table"""
+        rows = self.execute_query("SELECT version, modified_at FROM table_versions WHERE name = ?", (table,))
+        return rows[0] if rows else None
+
+    def _add_column(self, cursor, table, column, definition):
+        """Add a column to a table created before it existed"""
+        columns = [row["name"] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.row_factory = sqlite3.Row
+        # WAL lets the UI read while the scheduler writes (and vice versa)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
     @contextmanager
     def get_connection(self):
-        """Context manager for database connections"""
-        conn = None
+        """Context manager for this thread's database connection"""
+        conn = getattr(self._local, "conn", None)
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
+            if conn is None:
+                conn = self._local.conn = self._connect()
             yield conn
         except sqlite3.Error as e:
             if conn:
                 conn.rollback()
             logging.error(f"Database error: {e}")
             raise
-        finally:
-            if conn:
-                conn.close()
-    
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
     def execute_query(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
         """Execute a SELECT query and return results"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(query, params)
             return [dict(row) for row in cursor.fetchall()]
-    
+
+    def execute_insert(self, query: str, params: tuple = ()) -> int:
+        """Execute an INSERT query and return the new row's id"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            conn.commit()
+            return cursor.lastrowid
+
     def execute_update(self, query: str, params: tuple = ()) -> int:
         """Execute INSERT, UPDATE, or DELETE query and return affected rows"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(query, params)
             conn.commit()
-            return cursor.rowcount
\ No newline at end of file
+            return cursor.rowcount
@@ -1,13 +1,30 @@
+import base64
+import hashlib
+import json
 import os
 import signal
 import sys
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, url_for, redirect, flash
+from flask import Flask, Response, jsonify, render_template, request, url_for, redirect, flash
+from werkzeug.http import is_resource_modified
 import DB
-import rsa
+import booking_display
+import credentials
+import fire_schedule
+import metrics
+import preferences
+import release_rules
+import settings
 
 # Create database instance
 DB = DB.Database()
+VAULT = credentials.CredentialVault(DB)
+SETTINGS = settings.SettingsStore(DB)
+
+# .env is read once at startup, to carry over an existing install's account and players
+load_dotenv()
+SETTINGS.import_env(VAULT)
 
 # Function to handle graceful shutdown
 def signal_handler(sig, frame):
@@ -22,45 +39,19 @@ if __name__ == "__main__":
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 
-def update_env_players(players):
-    lines = []
-    if os.path.exists(".env"):
-        with open(".env", "r") as f:
-            lines = f.readlines()
-
-    new_lines = []
-    found = False
-    for line in lines:
-        if line.startswith("PLAYERS="):
-            new_lines.append(f"PLAYERS={','.join(players)}\n")
-            found = True
-        else:
-            new_lines.append(line)
-
-    if not found:
-        new_lines.append(f"PLAYERS={','.join(players)}\n")
-
-    with open(".env", "w") as f:
-        f.writelines(new_lines)
-
-
 @app.route("/booking", methods=["GET", "POST"])
 def booking():
-    load_dotenv(override=True)  # <<< force refresh
-    club = os.getenv("CLUB_NAME")
-    username = os.getenv("BRS_USERNAME")
-    password = os.getenv("BRS_PASSWORD")
-    players = os.getenv("PLAYERS", "")
-    players = players.split(",") if players else []
+    club = SETTINGS.get("club")
+    username = SETTINGS.get("username")
+    if not username or not club:
+        return redirect(url_for("index"))
 
     if request.method == "POST":
         # Add player form
         if "player" in request.form:
             new_player = request.form.get("player", "").strip()
             if new_player:
-                if new_player not in players:
-                    players.append(new_player)
-                    update_env_players(players)
+                if SETTINGS.add_player(new_player):
                     flash(f"Added player: {new_player}", "success")
                 else:
                     flash("Player already exists.", "warning")
@@ -71,9 +62,7 @@ def booking():
         # Remove player form
         if "remove_player" in request.form:
             player_to_remove = request.form.get("remove_player", "").strip()
-            if player_to_remove in players:
-                players.remove(player_to_remove)
-                update_env_players(players)
+            if SETTINGS.remove_player(player_to_remove):
                 flash(f"Removed player: {player_to_remove}", "success")
             else:
                 flash("Player not found.", "error")
@@ -85,6 +74,7 @@ def booking():
             try:
                 result = DB.execute_update("DELETE FROM bookings WHERE id = ?", (booking_id,))
                 if result > 0:
+                    fire_schedule.FIRES.remove(int(booking_id))
                     flash("Booking deleted successfully.", "success")
                 else:
                     flash("Booking not found.", "error")
@@ -94,7 +84,18 @@ def booking():
 
         # Booking form
         date_str = request.form.get("date")
-        time = [request.form.get("time")]
+        try:
+            # Ranked best first: the slider time, then any backups added on the form
+            windows = preferences.windows_from_form(request.form.getlist("time"),
+                                                    request.form.getlist("earliest"),
+                                                    request.form.getlist("latest"))
+            courses = preferences.courses_from_form(request.form.get("courses"))
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for("booking"))
+        if not windows:
+            flash("Please choose a tee time.", "error")
+            return redirect(url_for("booking"))
         selected_players = request.form.getlist("selected_players")
 
         # Validate date is in the future
@@ -117,35 +118,24 @@ def booking():
             return redirect(url_for("booking"))
 
         #result = tee_time_booker.run(username, password, club, time, date, *selected_players)
-        publicKey, privateKey = rsa.newkeys(512)
-        DB.execute_update("INSERT INTO bookings (username, club, date, time, players, password, private_key) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (username, club, date, time[0], ",".join(selected_players), rsa.encrypt(password.encode(), publicKey).hex(), privateKey.save_pkcs1().decode('utf-8')))
+        display = booking_display.display_fields(date, windows)
+        release_at = release_rules.release_at(date, club)
+        booking_id = DB.execute_insert("INSERT INTO bookings (username, club, date, time, players, courses, release_at, time_windows, "
+                          "formatted_date, day_name, time_label, backup_times) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (username, club, date, windows[0].time, ",".join(selected_players), ",".join(courses),
+                 release_at, preferences.windows_to_json(windows), *display.values()))
+        # Wakes the scheduler if it runs in this process and this booking opens first
+        fire_schedule.FIRES.add(booking_id, release_at)
 
 
         flash("Booking submitted.", "success")
         return redirect(url_for("booking"))
 
-    load_dotenv(override=True)  # <<< force reload after changes
-    players = os.getenv("PLAYERS", "")
-    players = players.split(",") if players else []
+    players = SETTINGS.players()
 
-    # Get current bookings from database
+    # Get current bookings from database, display columns only (formatted when saved)
     try:
-        current_bookings = DB.execute_query("SELECT * FROM bookings ORDER BY date ASC, time ASC")
-        # Format the bookings for display
-        for booking in current_bookings:
-            # Convert date format from YYYY/MM/DD to DD/MM/YYYY for display
-            try:
-                from datetime import datetime
-                date_obj = datetime.strptime(booking['date'], "%Y/%m/%d")
-                booking['formatted_date'] = date_obj.strftime("%d/%m/%Y")
-                booking['day_name'] = date_obj.strftime("%A")
-            except:
-                booking['formatted_date'] = booking['date']
-                booking['day_name'] = ''
-            
-            # Format players list
-            booking['players_list'] = booking['players'].split(',') if booking['players'] else []
+        current_bookings = [booking_display.for_display(row) for row in query_bookings()[0]]
     except Exception as e:
         current_bookings = []
         flash(f"Error loading bookings: {str(e)}", "error")
@@ -155,8 +145,7 @@ def booking():
 
 @app.route("/", methods=["GET", "POST"])
 def index():
-    load_dotenv(override=True)
-    if all(os.getenv(k) for k in ("BRS_USERNAME", "BRS_PASSWORD", "CLUB_NAME")):
+    if SETTINGS.get("username") and SETTINGS.get("club"):
         return redirect(url_for("booking"))
 
     if request.method == "POST":
@@ -168,10 +157,8 @@ def index():
             flash("All fields are required.", "error")
             return render_template("login.html")
 
-        with open(".env", "w") as f:
-            f.write(f"BRS_USERNAME={username}\n")
-            f.write(f"BRS_PASSWORD={password}\n")
-            f.write(f"CLUB_NAME={club}\n")
+        VAULT.store(username, password)
+        SETTINGS.update(username=username, club=club)
 
         flash("Login successful!", "success")
         return redirect(url_for("booking"))
@@ -179,6 +166,118 @@ def index():
     return render_template("login.html")
 
 
+# Page size for /api/bookings
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row["date"], row["time"], row["id"]]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        tee_date, tee_time, booking_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(tee_date), str(tee_time), int(booking_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def query_bookings(date_from=None, date_to=None, club=None, cursor=None, limit=None):
+    """Display rows in date and time order, and the cursor for the next page (None on the last page)
+
+    Dates are YYYY/MM/DD and inclusive. Pages are keyed on (date, time, id), which the
+    idx_bookings_date_time index covers, so later pages cost the same as the first.
+    """
+    where, params = [], []
+    if date_from:
+        where.append("date >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("date <= ?")
+        params.append(date_to)
+    if club:
+        where.append("club = ?")
+        params.append(club)
+    if cursor:
+        where.append("(date, time, id) > (?, ?, ?)")
+        params.extend(decode_cursor(cursor))
+
+    sql = f"SELECT {', '.join(booking_display.DISPLAY_COLUMNS)} FROM bookings"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY date, time, id"
+    if limit:
+        # One extra row tells us whether there's another page
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+
+    rows = DB.execute_query(sql, tuple(params))
+    if limit and len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+
+def api_date(value):
+    """YYYY-MM-DD query parameter to the stored YYYY/MM/DD"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime(release_rules.DATE_FORMAT)
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+
+
+@app.route("/api/bookings")
+def api_bookings():
+    """Bookings as JSON, filtered by ?from=&to= (YYYY-MM-DD) and ?club=, paged with ?cursor=&limit=
+
+    The ETag and Last-Modified come from the bookings table's change counter, so an
+    unchanged If-None-Match or If-Modified-Since is answered with a 304 before any
+    bookings are read.
+    """
+    try:
+        date_from = api_date(request.args.get("from"))
+        date_to = api_date(request.args.get("to"))
+        limit = min(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        cursor = request.args.get("cursor")
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    version = DB.table_version("bookings")
+    query = json.dumps(sorted(request.args.items()))
+    etag = f"{version['version']}-{hashlib.sha1(query.encode()).hexdigest()[:16]}"
+    last_modified = datetime.fromtimestamp(version["modified_at"], timezone.utc).replace(microsecond=0)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        rows, next_cursor = query_bookings(date_from, date_to, request.args.get("club"), cursor, limit)
+        bookings = []
+        for row in rows:
+            row = booking_display.for_display(row)
+            row["players"] = row.pop("players_list")
+            row["courses"] = row.pop("courses_list")
+            bookings.append(row)
+        response = jsonify(bookings=bookings, next_cursor=next_cursor)
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Cache, but always check back with the validators
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Aggregated from booking runs in this process (run_app.py runs the scheduler alongside the UI)
+    return Response(metrics.REGISTRY.prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template("404.html"), 404
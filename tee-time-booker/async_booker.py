@@ -0,0 +1,477 @@
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime
+
+import requests
+
+import brs_responses
+import metrics
+import rate_limiter
+import tee_time_booker
+from tee_time_booker import PreparedSession, SlotAttempt, SubmissionReport
+
+# The booking flow, written once on asyncio and run over either transport. Sessions from
+# a brs_client.ConnectionPool let one event loop drive many accounts on the same warm
+# connections. Blocking sessions - the requests session the Lambda keeps warm between
+# invocations (tee_time_booker.prepare) or a brs_capture.ReplaySession - have each request
+# run on a worker thread. tee_time_booker holds the parsing and request building, and
+# blocking wrappers of the entry points. URLs are read from tee_time_booker at call time
+# so overriding BRS_MEMBERS_URL there points every flow at the same server.
+
+# Times a tee sheet whose rows have no booking links yet is fetched again before trying
+# the browser. A few polls cover firing a little early without hammering a sheet that's
+# fully booked.
+NOT_OPEN_SHEET_POLLS = int(os.getenv("TEE_SHEET_NOT_OPEN_POLLS", "3"))
+
+
+class RequestError(Exception):
+    """A request that got no response, on either transport"""
+
+
+# aiohttp is only imported where its sessions are made, so the Lambda never loads it
+def isAiohttpSession(session):
+    aiohttp = sys.modules.get('aiohttp')
+    return aiohttp is not None and isinstance(session, aiohttp.ClientSession)
+
+
+async def request(session, method, url, **kwargs):
+
+    if isAiohttpSession(session):
+        import brs_client
+        try:
+            return await brs_client.request(session, method, url, **kwargs)
+        except brs_client.RequestError as e:
+            raise RequestError(f"{type(e).__name__}: {e}") from e
+
+    try:
+        return await asyncio.to_thread(session.request, method, url, **kwargs)
+    except requests.exceptions.RequestException as e:
+        raise RequestError(f"{type(e).__name__}: {e}") from e
+
+
+@metrics.timed("getPHPSessionID")
+async def getPHPSessionID(session, url):
+
+    await request(session, 'GET', url)
+
+
+@metrics.timed("getOtherCookies")
+async def getOtherCookies(session, url):
+
+    await request(session, 'GET', url)
+
+
+@metrics.timed("getCSRFToken")
+async def getCSRFToken(session, url):
+
+    response = await request(session, 'GET', url)
+
+    return tee_time_booker.loginFormToken(response.content)
+
+
+@metrics.timed("getTimeSheet")
+async def getTimeSheet(session, club_name, username, password, csrf_token):
+
+    login_url, headers, payload = tee_time_booker.loginRequest(club_name, username, password, csrf_token)
+
+    try:
+        response = await request(session, 'POST', login_url, headers=headers, data=payload)
+    except RequestError as e:
+        logging.warning("An error occurred during login for %s: %s", username, e)
+        return False
+
+    if response.status_code == 200:
+        logging.info("Login successful for %s", username)
+        return True
+
+    logging.warning("Login failed for %s: %s %s", username, response.status_code, response.reason)
+    return False
+
+
+# Fetches the tee sheet without a browser. While BRS rate limits us or errors the fetch
+# is retried on the policy's schedule. Rows without booking links are fetched again up
+# to NOT_OPEN_SHEET_POLLS times, for when we fired a little early, and then left to the
+# browser, since the links may be injected by JavaScript. Returns the HTML to parse, or
+# None and whether the browser is worth a try: for no tee sheet markup at all (but not
+# the login page) or rows that never got links.
+@metrics.timed("getStaticHTML")
+async def getStaticHTML(session, club_name, date, policy=None, course=tee_time_booker.DEFAULT_COURSE):
+
+    Outcome = brs_responses.Outcome
+    url = tee_time_booker.teeSheetURL(club_name, date, course)
+    policy = policy or brs_responses.RetryPolicy()
+    errors = 0
+    polls = 0
+
+    while True:
+        try:
+            response = await request(session, 'GET', url)
+        except RequestError as e:
+            logging.warning("Tee sheet fetch failed for %s: %s", url, e)
+            response = None
+
+        if response is not None and response.status_code < 400:
+            page_source, has_rows = tee_time_booker.staticTeeSheet(response.text, club_name)
+            if page_source is not None:
+                return page_source, False
+            if not has_rows:
+                # The login page, which the browser would be shown as well
+                if brs_responses.classify(response) is Outcome.SESSION_EXPIRED:
+                    logging.warning("Tee sheet fetch for %s landed on the login page", url)
+                    return None, False
+                return None, True
+            if polls >= NOT_OPEN_SHEET_POLLS:
+                logging.info("Tee sheet rows at %s still have no booking links", url)
+                return None, True
+            outcome = Outcome.NOT_OPEN
+            polls += 1
+        elif response is not None and not rate_limiter.throttled(response.status_code):
+            # Any other client error, e.g. no sheet for the date, won't change on a retry
+            logging.warning("Tee sheet fetch failed for %s: %s %s", url, response.status_code, response.reason)
+            return None, False
+        else:
+            # No response, a 429 or a 5xx - back off, for as long as a Retry-After asks
+            outcome = brs_responses.classify(response)
+            errors += 1
+
+        delay = policy.delay(outcome, response, errors)
+        if delay is None:
+            logging.warning("Gave up on the tee sheet at %s: %s", url, outcome.name)
+            return None, outcome is Outcome.NOT_OPEN
+        await asyncio.sleep(delay)
+
+
+# Selenium is blocking, so the fallback runs on a worker thread, with a copy of the cookies
+# of an aiohttp session
+async def getTeeSheetHTML(session, club_name, date, pool=None, policy=None, course=tee_time_booker.DEFAULT_COURSE):
+
+    page_source, browser = await getStaticHTML(session, club_name, date, policy, course)
+
+    if page_source is None and browser:
+        logging.info("No tee sheet markup in the static tee sheet, falling back to Selenium")
+        if isAiohttpSession(session):
+            import brs_client
+            session = brs_client.requestsSession(session)
+        page_source = await asyncio.to_thread(tee_time_booker.getDynamicHTML, session, club_name, date, pool, course)
+
+    return page_source
+
+
+@metrics.timed("fetchSlotForm")
+async def fetchSlotForm(session, href):
+
+    url = f'{tee_time_booker.BRS_MEMBERS_URL}{href}'
+
+    try:
+        response = await request(session, 'GET', url)
+    except RequestError as e:
+        logging.warning("An error occurred while fetching tokens for %s: %s", url, e)
+        return brs_responses.Outcome.ERROR, None, None
+
+    return tee_time_booker.slotFormTokens(response, url)
+
+
+async def fetchSlotTokens(session, href):
+
+    outcome, tokens, _ = await fetchSlotForm(session, href)
+    if tokens is None:
+        logging.info("No tokens for %s: %s", href, outcome.name)
+
+    return tokens
+
+
+@metrics.timed("bookingSlotTokens")
+async def bookingSlotTokens(session, available_tee_times_hrefs):
+
+    tokens_array = await asyncio.gather(*(fetchSlotTokens(session, href) for href in available_tee_times_hrefs))
+
+    # The tokens themselves are single-use form secrets, so only how many came back is logged
+    logging.info("Fetched tokens for %d of %d slots", sum(tokens is not None for tokens in tokens_array),
+                 len(tokens_array))
+
+    return list(tokens_array)
+
+
+@metrics.timed("bookTeeTime")
+async def postBooking(session, club_name, slot, tokens, player_1, player_2="", player_3="", player_4=""):
+
+    url, payload = tee_time_booker.bookingRequest(club_name, slot.course, slot.href, tokens,
+                                                  player_1, player_2, player_3, player_4)
+
+    logging.info("Sending POST request for %s", url)
+
+    return await request(session, 'POST', url, data=payload)
+
+
+# Retry engine for a single slot, a tee sheet row. Each response is classified: slots that aren't open yet
+# (we fired a few ms early) are retried on a tight, jittered schedule until the policy's
+# deadline, an expired session is logged back in with relogin() and the form tokens are
+# fetched again, rate limiting backs off, and a slot that's already taken is given up
+# straight away. tokens may be None, in which case the booking form is fetched first.
+# Once stop is set (another slot was booked) no further POST goes out and retry waits
+# end early, and the slot is given up as NOT_OPEN.
+async def submitSlot(session, club_name, slot, tokens, players, policy, relogin=None, stop=None):
+
+    Outcome = brs_responses.Outcome
+    href = slot.href
+    errors = 0
+
+    stopped = lambda: stop is not None and stop.is_set()
+
+    while not stopped():
+        response = None
+        if tokens is None:
+            outcome, tokens, response = await fetchSlotForm(session, href)
+
+        if tokens is not None:
+            if stopped():
+                break
+            try:
+                response = await postBooking(session, club_name, slot, tokens, *players)
+                outcome = brs_responses.classify(response)
+            except RequestError as e:
+                logging.warning("An error occurred during the booking attempt: %s", e)
+                outcome = Outcome.ERROR
+                response = None
+
+            # Tokens are single use unless the server never got to them
+            if outcome is Outcome.ERROR and response is not None:
+                tokens = None
+
+        logging.info("Slot %s: %s", href, outcome.name)
+
+        if outcome in (Outcome.SUCCESS, Outcome.SLOT_TAKEN):
+            return outcome, response
+
+        if outcome is Outcome.SESSION_EXPIRED:
+            if relogin is None or not policy.claim_relogin():
+                return outcome, response
+            if not await relogin():
+                return outcome, response
+            tokens = None
+            continue
+
+        if outcome in (Outcome.ERROR, Outcome.RATE_LIMITED):
+            errors += 1
+
+        delay = policy.delay(outcome, response, errors)
+        if delay is None:
+            return outcome, response
+        if stop is None:
+            await asyncio.sleep(delay)
+            continue
+        try:
+            await asyncio.wait_for(stop.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    return Outcome.NOT_OPEN, None
+
+
+async def bookTeeTime(session, club_name, slots, tokens, player_1, player_2="", player_3="", player_4="", policy=None, relogin=None):
+
+    outcome = None
+    response = None
+    policy = policy or brs_responses.RetryPolicy()
+    players = (player_1, player_2, player_3, player_4)
+
+    # Best slot first, then the next if it can't be booked, through every candidate hrefParser returned
+    for slot, slot_tokens in zip(slots, tokens):
+        outcome, slot_response = await submitSlot(session, club_name, slot, slot_tokens, players, policy, relogin)
+        response = slot_response if slot_response is not None else response
+        if outcome is brs_responses.Outcome.SUCCESS:
+            break
+
+    return response
+
+
+# Hedged submission: the top ranked slot is posted straight away and, if it hasn't been
+# confirmed within hedge_delay seconds (or has already failed), the next candidate is posted
+# alongside it, and so on. The first confirmed booking wins: it sets a stop event that keeps
+# the other attempts from posting again, and those still running are cancelled. A hedged
+# POST already on the wire can still go through, so keep hedge_delay above the usual POST
+# round trip if double bookings matter.
+async def raceTeeTime(session, club_name, slots, tokens, hedge_delay, player_1, player_2="", player_3="", player_4="", policy=None, relogin=None):
+
+    report = SubmissionReport()
+    candidates = list(zip(slots, tokens))
+    policy = policy or brs_responses.RetryPolicy()
+    players = (player_1, player_2, player_3, player_4)
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+
+    if not candidates:
+        return report
+
+    async def attempt(slot, slot_tokens):
+        slot_attempt = SlotAttempt(slot.href)
+        report.attempts.append(slot_attempt)
+        start = loop.time()
+        try:
+            slot_attempt.outcome, response = await submitSlot(session, club_name, slot, slot_tokens, players, policy,
+                                                              relogin, stop)
+            if slot_attempt.outcome is brs_responses.Outcome.SUCCESS:
+                stop.set()
+            slot_attempt.status_code = response.status_code if response is not None else None
+            return slot_attempt.outcome, response
+        except Exception as e:
+            slot_attempt.error = str(e)
+            return brs_responses.Outcome.ERROR, None
+        finally:
+            slot_attempt.latency = loop.time() - start
+
+    pending = {}
+    next_candidate = 0
+
+    try:
+        while next_candidate < len(candidates) or pending:
+            # Launch the next candidate if it's the first, or if nothing is left in flight
+            if next_candidate < len(candidates) and (next_candidate == 0 or not pending):
+                slot, slot_tokens = candidates[next_candidate]
+                pending[asyncio.ensure_future(attempt(slot, slot_tokens))] = slot.href
+                next_candidate += 1
+
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                href = pending.pop(task)
+                outcome, response = task.result()
+                if response is not None:
+                    report.response = report.response or response
+                    if outcome is brs_responses.Outcome.SUCCESS:
+                        stop.set()
+                        report.winner = href
+                        report.response = response
+                        return report
+
+            # Hedge delay passed without a confirmation - fire the next candidate too
+            if not done and next_candidate < len(candidates):
+                slot, slot_tokens = candidates[next_candidate]
+                pending[asyncio.ensure_future(attempt(slot, slot_tokens))] = slot.href
+                next_candidate += 1
+
+        return report
+
+    finally:
+        for task in pending:
+            task.cancel()
+        for slot_attempt in list(report.attempts):
+            logging.info("Slot attempt %s: status=%s outcome=%s latency=%s error=%s", slot_attempt.href,
+                         slot_attempt.status_code,
+                         slot_attempt.outcome.name if slot_attempt.outcome else None,
+                         f"{slot_attempt.latency:.3f}s" if slot_attempt.latency is not None else "in flight",
+                         slot_attempt.error)
+        logging.info("Winning slot: %s", report.winner)
+
+
+# The booking is split into two phases. prepare() does all of the round trips that
+# don't depend on the tee sheet being open (cookies, CSRF token and login) and can run
+# well before the release time. fire() is the critical path at release: fetch the sheet,
+# pull the slot tokens and post the booking. session is a new session of either transport.
+async def prepare(session, username, password, club_name):
+    logging.info("Preparing session for %s at %s", username, datetime.now())
+
+    prepared = PreparedSession(session, club_name, username, password)
+
+    await getPHPSessionID(session, f'{tee_time_booker.BRS_URL}/{club_name}')
+    await getOtherCookies(session, f'{tee_time_booker.BRS_MEMBERS_URL}/')
+
+    if not await login(prepared):
+        logging.warning("Login failed while preparing session for %s", username)
+
+    return prepared
+
+
+async def login(prepared):
+
+    club_login_brs_url = f'{tee_time_booker.BRS_MEMBERS_URL}/{prepared.club_name}/login'
+
+    try:
+        csrf_token = await getCSRFToken(prepared.session, club_login_brs_url)
+    except (RequestError, TypeError) as e:
+        # TypeError - no login form on the page
+        logging.warning("Could not get a login CSRF token for %s: %s", prepared.username, e)
+        prepared.logged_in = False
+        return False
+
+    prepared.logged_in = await getTimeSheet(prepared.session, prepared.club_name, prepared.username, prepared.password, csrf_token)
+
+    return prepared.logged_in
+
+
+async def fire(prepared, tee_time_preferences, tee_time_date, player_1, player_2="", player_3="", player_4="", hedge_delay=None, courses=None):
+    logging.info("Firing booking for %s at %s", prepared.username, datetime.now())
+
+    # One retry deadline for the whole booking, starting now
+    policy = brs_responses.RetryPolicy()
+    courses = courses or [tee_time_booker.DEFAULT_COURSE]
+
+    tee_sheet_index = await fetchTeeSheetIndex(prepared.session, prepared.club_name, tee_time_date, policy=policy, courses=courses)
+    available_tee_times = tee_time_booker.hrefParser(None, tee_time_preferences, tee_sheet_index or {}, courses=courses)
+
+    return await fireSlots(prepared, available_tee_times, player_1, player_2, player_3, player_4,
+                           hedge_delay=hedge_delay, policy=policy)
+
+
+# Fetches and parses the tee sheet of every course once so it can be shared by several
+# bookings for the same club and date. The courses are fetched at once, so each extra
+# course costs no more round trips than the first. Returns the merged index, or None if
+# no sheet could be read.
+async def fetchTeeSheetIndex(session, club_name, tee_time_date, pool=None, policy=None, courses=None):
+
+    courses = courses or [tee_time_booker.DEFAULT_COURSE]
+    policy = policy or brs_responses.RetryPolicy()
+
+    async def fetchCourse(course):
+        dynamic_html = await getTeeSheetHTML(session, club_name, tee_time_date, pool, policy, course)
+        return tee_time_booker.parseTeeSheet(dynamic_html, course) if dynamic_html else None
+
+    indexes = [index for index in await asyncio.gather(*(fetchCourse(course) for course in courses))
+               if index is not None]
+    if not indexes:
+        return None
+
+    return tee_time_booker.mergeTeeSheets(indexes)
+
+
+# Books one of the given tee sheet rows, best first, when the tee sheet has already been read
+async def fireSlots(prepared, available_tee_times, player_1, player_2="", player_3="", player_4="", hedge_delay=None, policy=None):
+
+    session = prepared.session
+    club_name = prepared.club_name
+    policy = policy or brs_responses.RetryPolicy()
+    relogin = lambda: login(prepared)
+
+    booking_tokens = await bookingSlotTokens(session, [slot.href for slot in available_tee_times])
+
+    hedge_delay = tee_time_booker.HEDGE_DELAY if hedge_delay is None else hedge_delay
+    if hedge_delay is not None:
+        report = await raceTeeTime(session, club_name, available_tee_times, booking_tokens, hedge_delay,
+                                   player_1, player_2, player_3, player_4, policy=policy, relogin=relogin)
+        return report.response
+
+    return await bookTeeTime(session, club_name, available_tee_times, booking_tokens,
+                             player_1, player_2, player_3, player_4, policy=policy, relogin=relogin)
+
+
+async def run(username, password, club_name, tee_time_preferences, tee_time_date, player_1, player_2="", player_3="", player_4="", pool=None, courses=None):
+
+    import brs_client
+
+    own_pool = pool is None
+    pool = pool or brs_client.ConnectionPool()
+
+    try:
+        with metrics.bind(metrics.RunRecord(club=club_name)) as record:
+            prepared = await prepare(pool.session(), username, password, club_name)
+            response = await fire(prepared, tee_time_preferences, tee_time_date, player_1, player_2, player_3, player_4,
+                                  courses=courses)
+    finally:
+        if own_pool:
+            await pool.close()
+
+    metrics.write_run_record(record)
+
+    return response
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+End-to-end booking latency benchmark against the local BRS stand-in
+
+Runs N simulated member accounts through Booking.process_bookings against
+benchmarks/mock_brs.py and reports time-to-first-POST, time-to-confirmation
+(both measured by the server, relative to the release instant) and success rate.
+
+Usage: python benchmarks/bench_booking.py --accounts 20 --latency-ms 40 --concurrency 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# Booking and tee_time_booker write database.db/logfile.log into the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="bench_booking_"))
+
+import Booking
+import DB as DB_module
+import credentials
+import job_queue
+import preferences as time_preferences
+import release_rules
+import tee_time_booker
+from mock_brs import MockBRSConfig, MockBRSServer
+from tee_sheet_fixtures import tee_times
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile, None for no values"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+def ms(value):
+    return f"{value * 1000:8.1f}" if value is not None else "     n/a"
+
+
+def insert_bookings(database, vault, accounts, club, tee_date, preferences, window=0, courses=1):
+    for i in range(accounts):
+        tee_time = preferences[i % len(preferences)]
+        minutes = time_preferences.to_minutes(tee_time)
+        windows = [time_preferences.TimeWindow(tee_time, time_preferences.from_minutes(max(minutes - window, 0)),
+                                               time_preferences.from_minutes(minutes + window))]
+        vault.store(f"member{i:03d}", "password")
+        database.execute_update(
+            "INSERT INTO bookings (username, club, date, time, players, courses, release_at, time_windows) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (f"member{i:03d}", club, tee_date, tee_time, f"{1000 + i}", ",".join(str(c) for c in range(1, courses + 1)),
+             release_rules.release_at(tee_date, club), time_preferences.windows_to_json(windows)))
+
+
+def run(args):
+    config = MockBRSConfig(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                           tee_time_count=args.tee_times, competitor_rate=args.competitor_rate, courses=args.courses)
+    Booking.DB = DB_module.Database(os.path.join(os.getcwd(), "bench.db"))
+    Booking.VAULT = credentials.CredentialVault(Booking.DB, os.path.join(os.getcwd(), "bench.key"))
+    Booking.QUEUE = job_queue.JobQueue(Booking.DB)
+    Booking.PREWARM_BROWSERS = False
+
+    tee_date = (date.today() + timedelta(days=release_rules.BOOKING_DAYS_AHEAD)).strftime("%Y/%m/%d")
+    sheet_times = tee_times(config.first_tee_time, config.interval, config.tee_time_count)
+    preferences = sheet_times[:1] if args.same_time else sheet_times
+    insert_bookings(Booking.DB, Booking.VAULT, args.accounts, config.club, tee_date, preferences, args.window,
+                    args.courses)
+
+    # The bookings open args.lead seconds after setup rather than at their club's release time
+    release_datetime = datetime.now().replace(microsecond=0) + timedelta(seconds=args.lead)
+    config.release_at = release_datetime.timestamp()
+    Booking.DB.execute_update("UPDATE bookings SET release_at = ?", (int(config.release_at),))
+
+    with MockBRSServer(config) as server:
+        tee_time_booker.BRS_URL = tee_time_booker.BRS_MEMBERS_URL = server.url
+        outcomes = Booking.process_bookings(release_datetime, max_workers=args.concurrency, batch_size=args.batch_size)
+        accounts = dict(server.state.accounts)
+
+    first_posts = [stats.first_post for stats in accounts.values() if stats.first_post is not None]
+    confirmations = [stats.confirmed for stats in accounts.values() if stats.confirmed is not None]
+
+    print()
+    print(f"accounts={args.accounts} concurrency={args.concurrency} latency={args.latency_ms}ms "
+          f"jitter={args.jitter_ms}ms competitors={args.competitor_rate}/s same_time={args.same_time} "
+          f"window=±{args.window}min courses={args.courses}")
+    print(f"{'':<24}{'p50 ms':>8}{'p99 ms':>9}")
+    print(f"{'time-to-first-POST':<24}{ms(percentile(first_posts, 50))}{ms(percentile(first_posts, 99))}")
+    print(f"{'time-to-confirmation':<24}{ms(percentile(confirmations, 50))}{ms(percentile(confirmations, 99))}")
+    print(f"success rate            {len(confirmations)}/{args.accounts} "
+          f"({100 * len(confirmations) / args.accounts:.1f}%), "
+          f"client reported {sum(outcome.success for outcome in outcomes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=Booking.MAX_CONCURRENT_BOOKINGS)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--tee-times", type=int, default=60)
+    parser.add_argument("--competitor-rate", type=float, default=0, help="competing bookings per second after release")
+    parser.add_argument("--same-time", action="store_true", help="every account wants the same tee time")
+    parser.add_argument("--batch-size", type=int, default=job_queue.BATCH_SIZE, help="jobs claimed per batch")
+    parser.add_argument("--window", type=int, default=0, help="minutes either side of each account's tee time it will accept")
+    parser.add_argument("--courses", type=int, default=1, help="courses on the sheet, all acceptable to every account")
+    parser.add_argument("--lead", type=float, default=5, help="seconds from start until the sheet opens")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
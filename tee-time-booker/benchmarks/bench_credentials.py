@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark booking creation and per-booking password decryption, before and after the credential vault
+
+Before: every booking POST generated a 512-bit RSA key pair and stored it with the
+encrypted password, and process_bookings loaded that key and decrypted it inside the
+release window. After: one persisted key, one encrypted password per account, decrypted
+in bulk before the release time.
+
+Usage: python benchmarks/bench_credentials.py [--iterations 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app creates database.db/vault.key in the working directory
+os.chdir(tempfile.mkdtemp(prefix="bench_credentials_"))
+os.environ.update(BRS_USERNAME="member001", CLUB_NAME="club", PLAYERS="1001,1002")
+
+import rsa
+import app
+
+
+def timed(func, iterations):
+    """Run func iterations times, returning per-call durations in milliseconds"""
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(label, durations):
+    print(f"{label:<44}{statistics.median(durations):>10.3f}{max(durations):>10.3f}")
+
+
+def main(iterations):
+    password = "correct-horse-battery"
+    db = app.DB
+    db.execute_update("CREATE TABLE legacy_bookings (id INTEGER PRIMARY KEY, username TEXT, password TEXT, private_key TEXT)")
+
+    def legacy_store(i):
+        public_key, private_key = rsa.newkeys(512)
+        db.execute_update("INSERT INTO legacy_bookings (username, password, private_key) VALUES (?, ?, ?)",
+                          ("member001", rsa.encrypt(password.encode(), public_key).hex(),
+                           private_key.save_pkcs1().decode("utf-8")))
+
+    legacy_rows = []
+
+    def legacy_decrypt(i):
+        row = legacy_rows[i % len(legacy_rows)]
+        rsa.decrypt(bytes.fromhex(row["password"]), rsa.PrivateKey.load_pkcs1(row["private_key"].encode())).decode()
+
+    # One-off cost of generating the persisted key, paid once per install
+    start = time.perf_counter()
+    app.VAULT.store("member001", password)
+    key_setup = (time.perf_counter() - start) * 1000
+
+    client = app.app.test_client()
+
+    def post_booking(i):
+        response = client.post("/booking", data={"date": "2099-01-01", "time": "12:00", "selected_players": ["1001"]})
+        assert response.status_code == 302
+
+    def vault_store(i):
+        # A different account each time so every call does the encryption and write
+        app.VAULT.store(f"member{i:03d}", password)
+
+    print(f"{'':<44}{'p50 ms':>10}{'max ms':>10}")
+    print("Booking creation")
+    report("  before: keygen + encrypt + insert", timed(legacy_store, iterations))
+    report("  after: vault store, new account", timed(vault_store, iterations))
+    report("  after: full POST /booking, stored account", timed(post_booking, iterations))
+
+    legacy_rows.extend(db.execute_query("SELECT * FROM legacy_bookings"))
+    usernames = [f"member{i:03d}" for i in range(iterations)]
+
+    def unlock(i):
+        app.VAULT.forget()
+        app.VAULT.unlock([usernames[i]])
+
+    print("Per-booking decrypt")
+    report("  before: load key + decrypt in window", timed(legacy_decrypt, iterations))
+    report("  after: unlock before release", timed(unlock, iterations))
+    app.VAULT.unlock(usernames)
+    report("  after: lookup in fire phase", timed(lambda i: app.VAULT.password(usernames[i]), iterations))
+
+    print(f"\nOne-off key generation: {key_setup:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    main(parser.parse_args().iterations)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Fire schedule benchmark: building and updating the release heap, and how close to each
+release instant the scheduler wakes
+
+Bookings for many clubs with different release rules are written to a scratch database.
+The heap is built from it once, then timed for the single-booking adds and removes the
+web UI makes. Wake lateness is measured for the heap's wait_for_next() against the one
+second polling loop the scheduler used before, over a run of release instants at random
+sub-second phases, and for a booking added while the scheduler sleeps on a later one.
+
+Usage: python benchmarks/bench_fire_schedule.py [--bookings 50000] [--clubs 200] [--wakes 8]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, time as day_time, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import DB as DB_module
+import fire_schedule
+import release_rules
+
+TIMEZONES = (None, "Europe/London", "Europe/Dublin", "America/New_York", "Australia/Sydney")
+
+
+def insert_bookings(database, bookings, clubs):
+    rules = {f"club{c:03d}": release_rules.ReleaseRule(random.randint(5, 14), day_time(random.randint(6, 20), 30),
+                                                       random.choice(TIMEZONES)) for c in range(clubs)}
+    rows = []
+    for i in range(bookings):
+        club = random.choice(list(rules))
+        tee_date = (date.today() + timedelta(days=random.randint(1, 20))).strftime(release_rules.DATE_FORMAT)
+        rows.append((f"member{i % 500:03d}", club, tee_date, "08:00", "1001", rules[club].release_at(tee_date)))
+    with database.get_connection() as conn:
+        conn.executemany("INSERT INTO bookings (username, club, date, time, players, release_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def heap_costs(database, schedule):
+    today_start = release_rules.day_bounds()[0]
+
+    def build():
+        schedule.load(database.execute_query("SELECT id, release_at FROM bookings WHERE release_at >= ?",
+                                             (today_start,)))
+
+    build_seconds = timed(build, 3)
+    next_seconds = timed(schedule.next, 10000)
+    instants = len(schedule)
+
+    ids = iter(range(10 ** 9, 10 ** 9 + 20000))
+    added = []
+
+    def add():
+        booking_id = next(ids)
+        added.append(booking_id)
+        schedule.add(booking_id, today_start + random.randint(0, 30 * 86400))
+
+    add_seconds = timed(add, 10000)
+    remove_seconds = timed(lambda: schedule.remove(added.pop()), 10000)
+
+    # What each tick costs a scheduler that finds the next release by querying the table
+    scan_seconds = timed(lambda: database.execute_query(
+        "SELECT MIN(release_at) AS release_at FROM bookings WHERE release_at >= ?", (int(time.time()),)), 200)
+    return build_seconds, instants, next_seconds, add_seconds, remove_seconds, scan_seconds
+
+
+def heap_lateness(instants):
+    schedule = fire_schedule.FireSchedule()
+    schedule.load({"id": i, "release_at": instant} for i, instant in enumerate(instants))
+    lateness = []
+    for _ in instants:
+        release_at = schedule.wait_for_next(0, 60)
+        lateness.append(time.time() - release_at)
+        schedule.pop(release_at)
+    return lateness
+
+
+def polling_lateness(instants):
+    """The old loop: check for due jobs, then sleep a second"""
+    lateness = []
+    pending = list(instants)
+    while pending:
+        now = time.time()
+        while pending and now >= pending[0]:
+            lateness.append(now - pending.pop(0))
+        time.sleep(1)
+    return lateness
+
+
+def wake_on_add(trials):
+    """A booking added for an earlier instant while the scheduler sleeps on a later one"""
+    lateness = []
+    for i in range(trials):
+        schedule = fire_schedule.FireSchedule()
+        schedule.add(0, time.time() + 3600)
+        woke = []
+        thread = threading.Thread(target=lambda: woke.append((schedule.wait_for_next(0, 60), time.time())))
+        thread.start()
+        time.sleep(0.05)
+        schedule.add(1, time.time() + 0.02)
+        thread.join()
+        release_at, at = woke[0]
+        lateness.append(at - release_at)
+    return lateness
+
+
+def report(label, values):
+    values = [value * 1000 for value in values]
+    print(f"{label:<36}{statistics.median(values):>10.2f}{max(values):>10.2f}")
+
+
+def main(bookings, clubs, wakes):
+    random.seed(1)
+    workdir = tempfile.mkdtemp(prefix="bench_fire_schedule_")
+    database = DB_module.Database(os.path.join(workdir, "bench.db"))
+    insert_bookings(database, bookings, clubs)
+
+    build, instants, peek, add, remove, scan = heap_costs(database, fire_schedule.FireSchedule())
+    print(f"bookings={bookings} clubs={clubs} release instants from today={instants}")
+    print(f"build heap from the table       {build * 1000:10.1f} ms (once at startup and on resync)")
+    print(f"next release (heap peek)        {peek * 1e6:10.2f} us")
+    print(f"add booking                     {add * 1e6:10.2f} us")
+    print(f"remove booking                  {remove * 1e6:10.2f} us")
+    print(f"next release by table query     {scan * 1e6:10.2f} us")
+
+    start = time.time() + 0.5
+    instants = sorted(start + i * 1.3 + random.random() for i in range(wakes))
+    heap = heap_lateness(instants)
+    start = time.time() + 0.5
+    instants = sorted(start + i * 1.3 + random.random() for i in range(wakes))
+    polled = polling_lateness(instants)
+
+    print(f"\nwake lateness over {wakes} release instants")
+    print(f"{'':<36}{'p50 ms':>10}{'max ms':>10}")
+    report("fire heap wait_for_next()", heap)
+    report("1s polling loop (before)", polled)
+    report("heap, earlier booking added", wake_on_add(wakes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=50000)
+    parser.add_argument("--clubs", type=int, default=200)
+    parser.add_argument("--wakes", type=int, default=8)
+    args = parser.parse_args()
+    main(args.bookings, args.clubs, args.wakes)
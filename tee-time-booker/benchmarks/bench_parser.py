@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark the indexed tee sheet parser against the original BeautifulSoup hrefParser
+
+Usage: python benchmarks/bench_parser.py [saved_sheet.html ...]
+
+With no arguments the small/medium/large fixtures in benchmarks/fixtures are used.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+import tee_time_booker
+from tee_sheet_fixtures import FIXTURE_SIZES, load_fixture
+
+
+def legacy_href_parser(dynamic_html, tee_time_preferences):
+    """hrefParser as it was before the indexed parser - O(preferences x rows x subtree)"""
+    soup = BeautifulSoup(dynamic_html, "html.parser")
+    tr_elements = soup.find_all("tr", class_="bg-white even:bg-grey-faded")
+    available_tee_times_hrefs = []
+
+    for time in tee_time_preferences:
+        for tr_element in tr_elements:
+            tee_time_available = True
+            if time in tr_element.text:
+                for div_element in tr_element.find_all("div"):
+                    if 'Holes' in div_element.text:
+                        tee_time_available = False
+                if tee_time_available:
+                    anchor_tag = tr_element.find('a')
+                    if anchor_tag and 'href' in anchor_tag.attrs:
+                        available_tee_times_hrefs.append(anchor_tag['href'])
+
+    return available_tee_times_hrefs
+
+
+def bench(label, func, repeat=5):
+    """Return the best per-call time in milliseconds"""
+    number = 3
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    return best * 1000
+
+
+def main(paths):
+    sheets = [(os.path.basename(path), open(path).read()) for path in paths] or \
+             [(name, load_fixture(name)) for name in FIXTURE_SIZES]
+
+    print(f"{'sheet':<16}{'rows':>6}{'prefs':>7}{'legacy ms':>12}{'soup ms':>10}{'lxml ms':>10}{'speed-up':>10}")
+
+    for name, html in sheets:
+        index = tee_time_booker.parseTeeSheetSoup(html)
+        times = sorted(index)
+        # Ask for a spread of preferences across the day, like a real booking
+        preferences = times[::max(1, len(times) // 5)][:5]
+
+        expected = legacy_href_parser(html, preferences)
+        if [row.href for row in tee_time_booker.hrefParser(html, preferences)] != expected:
+            print(f"warning: {name} results differ from the legacy parser")
+
+        legacy = bench("legacy", lambda: legacy_href_parser(html, preferences))
+        soup = bench("soup", lambda: tee_time_booker.hrefParser(None, preferences, tee_time_booker.parseTeeSheetSoup(html)))
+        fast = float("nan")
+        if tee_time_booker.lxml is not None:
+            fast = bench("lxml", lambda: tee_time_booker.hrefParser(None, preferences, tee_time_booker.parseTeeSheetLxml(html)))
+
+        best = min(soup, fast) if fast == fast else soup
+        print(f"{name:<16}{len(index):>6}{len(preferences):>7}{legacy:>12.2f}{soup:>10.2f}{fast:>10.2f}{legacy / best:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
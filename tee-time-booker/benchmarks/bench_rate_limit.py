@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Rate limiter benchmark: a fleet of accounts firing at one club that throttles them
+
+Runs --accounts bookings through Booking.process_bookings against benchmarks/mock_brs.py,
+which answers 429 to anything beyond --site-rate requests per second (after a burst of
+--site-burst), once with rate_limiter off (before) and once with it on, starting at
+--rate. Reports bookings confirmed, 429s served, where the limiter's rate ended up,
+time-to-first-POST and time-to-confirmation at p50/p99 (measured by the server,
+relative to the release instant), and how long booking POSTs and sheet/token fetches
+queued for the budget.
+
+Usage: python benchmarks/bench_rate_limit.py [--accounts 60] [--site-rate 40] [--site-burst 20]
+                                           [--rate 50] [--burst 50] [--latency-ms 30] [--lead 20]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# Booking and tee_time_booker write database.db/logfile.log into the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="bench_rate_limit_"))
+
+import Booking
+import DB as DB_module
+import credentials
+import job_queue
+import metrics
+import rate_limiter
+import release_rules
+import tee_time_booker
+from bench_booking import insert_bookings, ms, percentile
+from mock_brs import MockBRSConfig, MockBRSServer
+from tee_sheet_fixtures import tee_times
+
+MODES = ("no limiter", "limiter")
+
+
+def queue_quantile(stage, club, q):
+    """A rate limiter wait quantile for the club's bookings from the /metrics text, None if nothing queued"""
+    match = re.search(rf'booking_stage_seconds{{stage="{stage}",club="{club}",quantile="{q}"}} (\S+)',
+                      metrics.REGISTRY.prometheus())
+    return float(match.group(1)) if match else None
+
+
+def run_once(args, mode, workdir):
+    config = MockBRSConfig(latency=args.latency_ms / 1000, jitter=args.latency_ms / 3000,
+                           tee_time_count=max(60, args.accounts), throttle_rate=args.site_rate,
+                           throttle_burst=args.site_burst)
+    Booking.DB = DB_module.Database(os.path.join(workdir, f"{mode.replace(' ', '_')}.db"))
+    Booking.VAULT = credentials.CredentialVault(Booking.DB, os.path.join(workdir, f"{mode.replace(' ', '_')}.key"))
+    Booking.QUEUE = job_queue.JobQueue(Booking.DB)
+    Booking.PREWARM_BROWSERS = False
+    metrics.REGISTRY = metrics.MetricsRegistry()
+    limiter = rate_limiter.RateLimiter(rate=args.rate if mode == "limiter" else 0, burst=args.burst)
+    rate_limiter.LIMITER = limiter
+
+    tee_date = (date.today() + timedelta(days=release_rules.BOOKING_DAYS_AHEAD)).strftime("%Y/%m/%d")
+    sheet_times = tee_times(config.first_tee_time, config.interval, config.tee_time_count)
+    insert_bookings(Booking.DB, Booking.VAULT, args.accounts, config.club, tee_date, sheet_times)
+
+    # The bookings open args.lead seconds after setup rather than at their club's release time
+    release_datetime = datetime.now().replace(microsecond=0) + timedelta(seconds=args.lead)
+    config.release_at = release_datetime.timestamp()
+    Booking.DB.execute_update("UPDATE bookings SET release_at = ?", (int(config.release_at),))
+
+    with MockBRSServer(config) as server:
+        tee_time_booker.BRS_URL = tee_time_booker.BRS_MEMBERS_URL = server.url
+        Booking.process_bookings(release_datetime, max_workers=args.accounts, batch_size=args.accounts)
+        accounts = dict(server.state.accounts)
+        bucket = limiter.bucket(server.url)
+
+    return {
+        "booked": sum(stats.confirmed is not None for stats in accounts.values()),
+        "throttled": server.state.throttled,
+        "rate": bucket.rate if bucket else None,
+        "first_posts": [stats.first_post for stats in accounts.values() if stats.first_post is not None],
+        "confirmations": [stats.confirmed for stats in accounts.values() if stats.confirmed is not None],
+        "booking_queue": tuple(queue_quantile("rateLimitBooking", config.club, q) for q in (0.5, 0.99)),
+        "fetch_queue": tuple(queue_quantile("rateLimitFetch", config.club, q) for q in (0.5, 0.99)),
+    }
+
+
+def main(args):
+    workdir = os.getcwd()
+    results = {mode: run_once(args, mode, workdir) for mode in MODES}
+
+    print()
+    print(f"accounts={args.accounts} site tolerates {args.site_rate:g}/s (burst {args.site_burst:g}) "
+          f"limiter starts at {args.rate:g}/s (burst {args.burst:g}) latency={args.latency_ms}ms")
+    print(f"{'':<12}{'booked':>8}{'429s':>6}{'end rate':>10}{'first POST p50/p99 ms':>24}"
+          f"{'confirmed p50/p99 ms':>24}{'POST queue p50/p99 ms':>24}{'fetch queue p50/p99 ms':>24}")
+    for mode, result in results.items():
+        rate = f"{result['rate']:.1f}/s" if result["rate"] is not None else "-"
+        print(f"{mode:<12}{result['booked']:>5}/{args.accounts:<2}{result['throttled']:>6}{rate:>10}"
+              f"{ms(percentile(result['first_posts'], 50))}{ms(percentile(result['first_posts'], 99)):>16}"
+              f"{ms(percentile(result['confirmations'], 50))}{ms(percentile(result['confirmations'], 99)):>16}"
+              f"{ms(result['booking_queue'][0])}{ms(result['booking_queue'][1]):>16}"
+              f"{ms(result['fetch_queue'][0])}{ms(result['fetch_queue'][1]):>16}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=60)
+    parser.add_argument("--site-rate", type=float, default=40, help="requests per second the mock serves before 429s")
+    parser.add_argument("--site-burst", type=float, default=20)
+    parser.add_argument("--rate", type=float, default=rate_limiter.RATE_LIMIT, help="limiter's starting requests per second")
+    parser.add_argument("--burst", type=float, default=rate_limiter.BURST)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--lead", type=float, default=20, help="seconds from setup until the sheet opens")
+    main(parser.parse_args())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Lambda cold start benchmark: import time and first/warm request latency of tee_time_booker.lambda_handler
+
+Each run is a fresh interpreter, like a new Lambda container. It imports tee_time_booker,
+then invokes lambda_handler twice against benchmarks/mock_brs.py: the cold invocation logs
+in, the warm one reuses the session kept from the first. "eager imports" repeats the
+import with bs4, selenium and dotenv loaded up front, as tee_time_booker used to.
+
+Usage: python benchmarks/bench_startup.py [--runs 10] [--latency-ms 30]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from mock_brs import MockBRSConfig, MockBRSServer
+from tee_sheet_fixtures import tee_times
+
+CHILD = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+eager = {eager!r}
+start = time.perf_counter()
+if eager:
+    import bs4, dotenv, browser_pool
+import tee_time_booker
+imported = time.perf_counter()
+
+event = {{"username": "member001", "password": "password", "club": {club!r}, "date": {date!r}, "players": ["1001"]}}
+timings = {{"import": imported - start, "heavy_loaded": [m for m in ("bs4", "selenium", "dotenv", "aiohttp") if m in sys.modules]}}
+for name, tee_time in (("cold", {times[0]!r}), ("warm", {times[1]!r})):
+    start = time.perf_counter()
+    result = tee_time_booker.lambda_handler(dict(event, times=[tee_time]), None)
+    timings[name] = time.perf_counter() - start
+    timings[name + "_booked"] = result["booked"]
+print(json.dumps(timings))
+"""
+
+
+def run_child(server, config, tee_date, times, eager, workdir):
+    env = dict(os.environ, BRS_URL=server.url, BRS_MEMBERS_URL=server.url, AWS_LAMBDA_FUNCTION_NAME="bench")
+    code = CHILD.format(root=os.path.dirname(BENCH_DIR), eager=eager, club=config.club, date=tee_date, times=times)
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=workdir, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def report(label, values):
+    values = [value * 1000 for value in values]
+    print(f"{label:<34}{statistics.median(values):>10.1f}{max(values):>10.1f}")
+
+
+def main(runs, latency_ms):
+    config = MockBRSConfig(latency=latency_ms / 1000, release_at=time.time() - 1, tee_time_count=4 * runs + 4)
+    slots = tee_times(config.first_tee_time, config.interval, config.tee_time_count)
+    tee_date = "2099/01/01"
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+
+    results = {False: [], True: []}
+    with MockBRSServer(config) as server:
+        for i in range(runs):
+            for eager in (False, True):
+                offset = 4 * i + (2 if eager else 0)
+                results[eager].append(run_child(server, config, tee_date, slots[offset:offset + 2], eager, workdir))
+
+    print(f"runs={runs} latency={latency_ms}ms")
+    print(f"{'':<34}{'p50 ms':>10}{'max ms':>10}")
+    report("import (lazy, current)", [r["import"] for r in results[False]])
+    report("import (eager imports)", [r["import"] for r in results[True]])
+    report("cold invocation (login + book)", [r["cold"] for r in results[False]])
+    report("warm invocation (reused session)", [r["warm"] for r in results[False]])
+
+    lazy = results[False]
+    print(f"\nheavy modules loaded by the import: {sorted(set(m for r in lazy for m in r['heavy_loaded'])) or 'none'}")
+    print(f"booked: cold {sum(r['cold_booked'] for r in lazy)}/{runs}, warm {sum(r['warm_booked'] for r in lazy)}/{runs}")
+    print(f"files written to the working directory: {os.listdir(workdir) or 'none'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    args = parser.parse_args()
+    main(args.runs, args.latency_ms)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Transport warm-up benchmark: whether the fire requests go out on warm connections, and what it saves
+
+Each run logs one account in with tee_time_booker.prepare, waits for a release instant
+--lead seconds away and then fires, as lambda_handler does, against benchmarks/mock_brs.py
+serving HTTPS with keep-alive. The mock closes connections idle for --idle-timeout
+seconds, as a load balancer would, and adds --connect-latency-ms to every new connection
+for the round trips of connection setup over a real network.
+
+  login only   the login's connections, gone idle by the release (before)
+  warm once    brs_transport.warm() right after login, also idle by the release
+  kept alive   brs_transport.keptAlive() pinging until just before the release
+
+Usage: python benchmarks/bench_transport.py [--runs 5] [--lead 4] [--idle-timeout 2]
+                                          [--connect-latency-ms 20] [--latency-ms 10] [--no-tls]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import brs_transport
+import release_clock
+import tee_time_booker
+from mock_brs import MockBRSConfig, MockBRSServer
+from tee_sheet_fixtures import tee_times
+
+MODES = ("login only", "warm once", "kept alive")
+
+
+def run_once(config, url, mode, account, tee_time, lead, ping_interval):
+    prepared = tee_time_booker.prepare(account, "password", config.club)
+    release_at = time.time() + lead
+    config.release_at = release_at
+
+    if mode == "warm once":
+        brs_transport.warm(prepared.session, url)
+    if mode == "kept alive":
+        with brs_transport.keptAlive(prepared.session, url, release_at, interval=ping_interval):
+            release_clock.wait_for_release(datetime.fromtimestamp(release_at))
+    else:
+        release_clock.wait_for_release(datetime.fromtimestamp(release_at))
+
+    fired = time.monotonic()
+    response = tee_time_booker.fire(prepared, [tee_time], "2099/01/01", "1001")
+    elapsed = time.monotonic() - fired
+
+    timings = brs_transport.timings(prepared.session, url, since=fired)
+    return {
+        "booked": response is not None and "confirmed" in response.text,
+        "fire": elapsed,
+        "first": timings[0] if timings else None,
+        "requests": len(timings),
+        "new": sum(timing.new_connection for timing in timings),
+    }
+
+
+def main(args):
+    config = MockBRSConfig(latency=args.latency_ms / 1000, keep_alive=True, idle_timeout=args.idle_timeout,
+                           tls=not args.no_tls, connect_latency=args.connect_latency_ms / 1000,
+                           tee_time_count=len(MODES) * args.runs + 1)
+    slots = iter(tee_times(config.first_tee_time, config.interval, config.tee_time_count))
+
+    results = {mode: [] for mode in MODES}
+    with MockBRSServer(config) as server:
+        if server.certificate:
+            os.environ["REQUESTS_CA_BUNDLE"] = server.certificate[0]
+        # The certificate is for localhost, and a name gives the DNS lookup something to skip
+        url = server.url.replace("127.0.0.1", "localhost")
+        tee_time_booker.BRS_URL = tee_time_booker.BRS_MEMBERS_URL = url
+
+        for i in range(args.runs):
+            for mode in MODES:
+                account = f"member{len(results[mode]) + 100 * MODES.index(mode):03d}"
+                results[mode].append(run_once(config, url, mode, account, next(slots), args.lead,
+                                              args.idle_timeout / 2))
+
+    print(f"runs={args.runs} lead={args.lead}s idle_timeout={args.idle_timeout}s "
+          f"connect_latency={args.connect_latency_ms}ms latency={args.latency_ms}ms tls={not args.no_tls}")
+    print(f"{'':<12}{'booked':>8}{'new conns':>11}{'first req connect+TLS ms':>26}"
+          f"{'first byte ms':>15}{'fire p50 ms':>13}{'fire max ms':>13}")
+    for mode, runs in results.items():
+        firsts = [run["first"] for run in runs if run["first"] is not None]
+        setup = [(first.connect or 0) + (first.handshake or 0) for first in firsts]
+        fires = [run["fire"] * 1000 for run in runs]
+        print(f"{mode:<12}{sum(run['booked'] for run in runs):>5}/{len(runs):<2}"
+              f"{sum(run['new'] for run in runs):>6}/{sum(run['requests'] for run in runs):<4}"
+              f"{statistics.median(setup) * 1000:>26.1f}"
+              f"{statistics.median(first.first_byte for first in firsts) * 1000:>15.1f}"
+              f"{statistics.median(fires):>13.1f}{max(fires):>13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--lead", type=float, default=4, help="seconds from login to the release")
+    parser.add_argument("--idle-timeout", type=float, default=2)
+    parser.add_argument("--connect-latency-ms", type=float, default=20)
+    parser.add_argument("--latency-ms", type=float, default=10)
+    parser.add_argument("--no-tls", action="store_true")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Cancellation watcher benchmark against the local BRS stand-in
+
+Fills every slot on a number of tee sheets, gives each sheet some unfilled bookings
+and runs cancellation_watcher.CancellationWatcher while slots the bookings want are
+cancelled at random. Reports how long each freed slot took to be booked (measured by
+the server from the cancellation) and the watcher's per-poll CPU and bandwidth, next
+to what re-parsing the whole sheet with hrefParser on every poll would cost.
+
+Usage: python benchmarks/bench_watch.py --sheets 50 --bookings-per-sheet 2 --duration 20 [--no-etags]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import replace
+from datetime import date, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# Booking and tee_time_booker write database.db/logfile.log into the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="bench_watch_"))
+
+import Booking
+import DB as DB_module
+import cancellation_watcher
+import credentials
+import job_queue
+import release_rules
+import tee_time_booker
+from mock_brs import MockBRSConfig, MockBRSServer
+from tee_sheet_fixtures import render_tee_sheet, tee_times
+
+
+def insert_unfilled(database, vault, queue, club, dates, wanted):
+    """One failed booking per wanted (date, tee time)"""
+    bookings = []
+    for i, (tee_date, tee_time) in enumerate(wanted):
+        username = f"member{i:03d}"
+        vault.store(username, "password")
+        database.execute_update(
+            "INSERT INTO bookings (username, club, date, time, players, release_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (username, club, tee_date, tee_time, f"{1000 + i}", release_rules.release_at(tee_date, club)))
+    bookings = database.execute_query("SELECT id, release_at FROM bookings")
+    queue.enqueue(bookings)
+    database.execute_update("UPDATE jobs SET state = ?", (job_queue.JobState.FAILED.value,))
+
+
+def cancel_slots(server, wanted, rate, stop, cancelled, watcher, warmup, baseline):
+    """Free the wanted slots one at a time in random order, rate per second
+
+    Waits out the warm-up first, so the watcher's first full read of every sheet is
+    left out of the per-poll numbers.
+    """
+    if stop.wait(warmup):
+        return
+    baseline.append(replace(watcher.stats))
+
+    order = list(wanted)
+    random.shuffle(order)
+    for tee_date, tee_time in order:
+        if stop.wait(random.expovariate(rate)):
+            return
+        cancelled[(tee_date, tee_time)] = time.time()
+        server.book(tee_date, tee_time, None)
+
+
+def full_parse_ms(club, tee_date, sheet_times, preferences):
+    """CPU per poll of reading the whole sheet through staticTeeSheet and hrefParser"""
+    page = render_tee_sheet(club, tee_date, [(tee_time, ["competitor"]) for tee_time in sheet_times])
+    start = time.thread_time()
+    for _ in range(20):
+        tee_time_booker.staticTeeSheet(page, club)
+        tee_time_booker.hrefParser(page, preferences)
+    return (time.thread_time() - start) / 20 * 1000, len(page)
+
+
+def run(args):
+    config = MockBRSConfig(latency=args.latency_ms / 1000, tee_time_count=args.tee_times,
+                           release_at=time.time() - 1, etags=not args.no_etags)
+    Booking.DB = DB_module.Database(os.path.join(os.getcwd(), "bench.db"))
+    Booking.VAULT = credentials.CredentialVault(Booking.DB, os.path.join(os.getcwd(), "bench.key"))
+    Booking.QUEUE = job_queue.JobQueue(Booking.DB)
+    cancellation_watcher.WATCH_MIN_INTERVAL = args.min_interval
+    cancellation_watcher.WATCH_MAX_INTERVAL = args.max_interval
+    cancellation_watcher.WATCH_REFRESH_SECONDS = args.duration
+
+    sheet_times = tee_times(config.first_tee_time, config.interval, config.tee_time_count)
+    dates = [(date.today() + timedelta(days=1 + i % 7)).strftime("%Y/%m/%d") for i in range(args.sheets)]
+    dates = sorted(set(dates)) if args.sheets <= 7 else [
+        f"{2100 + i // 7}/01/{1 + i % 7:02d}" for i in range(args.sheets)]
+    wanted = [(tee_date, sheet_times[j * len(sheet_times) // args.bookings_per_sheet])
+              for tee_date in dates for j in range(args.bookings_per_sheet)]
+
+    insert_unfilled(Booking.DB, Booking.VAULT, Booking.QUEUE, config.club, dates, wanted)
+    if args.sheets > 7:
+        # Dates far ahead keep the sheets distinct, so let them count as released
+        Booking.DB.execute_update("UPDATE jobs SET release_at = ?", (int(time.time()) - 60,))
+
+    with MockBRSServer(config) as server:
+        tee_time_booker.BRS_URL = tee_time_booker.BRS_MEMBERS_URL = server.url
+        for tee_date in dates:
+            for tee_time in sheet_times:
+                server.book(tee_date, tee_time, "competitor")
+        parse_ms, page_bytes = full_parse_ms(config.club, dates[0], sheet_times, [tee_time for _, tee_time in wanted[:1]])
+
+        watcher = cancellation_watcher.CancellationWatcher()
+        stop, cancelled, baseline = threading.Event(), {}, []
+        canceller = threading.Thread(target=cancel_slots, daemon=True, args=(
+            server, wanted, args.cancel_rate, stop, cancelled, watcher, args.warmup, baseline))
+        canceller.start()
+        stats = asyncio.run(watcher.run(args.warmup + args.duration))
+        stop.set()
+        accounts = dict(server.state.accounts)
+
+    latencies = []
+    for i, key in enumerate(wanted):
+        account = accounts.get(f"member{i:03d}")
+        if key in cancelled and account and account.confirmed is not None:
+            latencies.append((config.release_at + account.confirmed - cancelled[key]) * 1000)
+
+    start = baseline[0] if baseline else cancellation_watcher.WatchStats()
+    polls = max(stats.polls - start.polls, 1)
+    print()
+    print(f"sheets={len(dates)} bookings={len(wanted)} duration={args.duration}s etags={not args.no_etags} "
+          f"interval={args.min_interval}-{args.max_interval}s latency={args.latency_ms}ms")
+    print(f"slots freed {len(cancelled)}, booked {len(latencies)}, watcher booked {stats.booked}")
+    if latencies:
+        print(f"cancel-to-booked p50 {statistics.median(latencies):.0f}ms, max {max(latencies):.0f}ms")
+    not_modified = stats.not_modified - start.not_modified
+    print(f"polls after warm-up {polls}, {not_modified} not modified ({100 * not_modified / polls:.0f}%)")
+    print(f"per poll: {(stats.bytes - start.bytes) / polls / 1024:.1f}KB received, "
+          f"{(stats.cpu - start.cpu) / polls * 1000:.3f}ms CPU, {(stats.rows_parsed - start.rows_parsed) / polls:.2f} rows parsed")
+    print(f"full re-parse per poll: {page_bytes / 1024:.1f}KB received, {parse_ms:.3f}ms CPU, "
+          f"{len(sheet_times)} rows parsed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sheets", type=int, default=50)
+    parser.add_argument("--bookings-per-sheet", type=int, default=2)
+    parser.add_argument("--tee-times", type=int, default=60)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of cancellations, after the warm-up")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds for the watcher's first read of every sheet")
+    parser.add_argument("--cancel-rate", type=float, default=2, help="cancellations per second")
+    parser.add_argument("--min-interval", type=float, default=1)
+    parser.add_argument("--max-interval", type=float, default=5)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--no-etags", action="store_true", help="serve sheets without ETags, so every poll is diffed")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Local stand-in for the BRS Golf endpoints used by tee_time_booker
+
+Serves the brsgolf.com landing page, the members login with its CSRF token, a tee
+sheet per course, the booking form with its member_booking_form tokens and bookings/store, with
+configurable latency, release-time gating, slot contention and throttling. Point the booker at it
+with BRS_URL/BRS_MEMBERS_URL (or tee_time_booker.BRS_URL/BRS_MEMBERS_URL).
+"""
+import os
+import random
+import secrets
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from flask import Flask, abort, make_response, redirect, request
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from werkzeug.serving import make_server
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer
+
+from tee_sheet_fixtures import render_tee_sheet, tee_times
+
+SESSION_COOKIE = "PHPSESSID"
+
+# Response bodies the booker sees for each store outcome
+NOT_OPEN_MESSAGE = "Bookings for this date are not yet open"
+SLOT_TAKEN_MESSAGE = "Sorry, this tee time is no longer available"
+SUCCESS_MESSAGE = "Your booking has been confirmed"
+
+
+@dataclass
+class AccountStats:
+    """Server side timings for one member, relative to the release instant"""
+    first_post: Optional[float] = None
+    confirmed: Optional[float] = None
+    posts: int = 0
+    slot: Optional[str] = None
+
+
+@dataclass
+class MockBRSConfig:
+    club: str = "club"
+    latency: float = 0.0
+    jitter: float = 0.0
+    release_at: float = 0.0
+    first_tee_time: str = "07:00"
+    interval: int = 10
+    tee_time_count: int = 60
+    # Courses numbered from 1, each with its own sheet of the same tee times
+    courses: int = 1
+    # Answer conditional tee sheet requests with 304s. Without them every sheet carries
+    # a fresh CSRF token, as Laravel pages do, so no two responses are byte-identical.
+    etags: bool = True
+    # Competing (non-simulated) members booking random free slots per second after release
+    competitor_rate: float = 0.0
+    # Keep connections open between requests (HTTP/1.1), closing ones idle for
+    # idle_timeout seconds as a load balancer would. Off, every response closes its connection.
+    keep_alive: bool = False
+    idle_timeout: Optional[float] = None
+    # Serve HTTPS with a self-signed certificate for localhost (needs the openssl command)
+    tls: bool = False
+    # Extra delay on each new connection before any TLS handshake, standing in for the
+    # round trips of connection setup over a real network. Needs keep_alive or tls.
+    connect_latency: float = 0.0
+    # Answer 429 to requests beyond throttle_rate per second (after a burst of
+    # throttle_burst), as a site protecting itself would, with a Retry-After of
+    # retry_after seconds when set. Off at 0.
+    throttle_rate: float = 0.0
+    throttle_burst: float = 10.0
+    retry_after: Optional[float] = None
+
+
+@dataclass
+class MockBRSState:
+    sessions: Dict[str, Optional[str]] = field(default_factory=dict)
+    form_tokens: Dict[tuple, tuple] = field(default_factory=dict)
+    slots: Dict[str, Dict[str, Optional[str]]] = field(default_factory=dict)
+    accounts: Dict[str, AccountStats] = field(default_factory=dict)
+    # Token bucket behind throttle_rate, and the requests it turned away
+    throttle_tokens: Optional[float] = None
+    throttle_updated: float = 0.0
+    throttled: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def create_app(config: MockBRSConfig, state: MockBRSState) -> Flask:
+    app = Flask(__name__)
+
+    def is_open():
+        return time.time() >= config.release_at
+
+    def sheet(date, course):
+        # tee time -> member who holds it (None when free)
+        if not 1 <= int(course) <= config.courses:
+            abort(404)
+        with state.lock:
+            return state.slots.setdefault(
+                (course, date), {t: None for t in tee_times(config.first_tee_time, config.interval, config.tee_time_count)})
+
+    def current_user():
+        return state.sessions.get(request.cookies.get(SESSION_COOKIE, ""))
+
+    def with_session(response):
+        if request.cookies.get(SESSION_COOKIE) not in state.sessions:
+            sid = secrets.token_hex(16)
+            state.sessions[sid] = None
+            response.set_cookie(SESSION_COOKIE, sid)
+        return response
+
+    @app.before_request
+    def throttle():
+        if config.throttle_rate <= 0:
+            return None
+        with state.lock:
+            now = time.monotonic()
+            if state.throttle_tokens is None:
+                state.throttle_tokens = config.throttle_burst
+            state.throttle_tokens = min(config.throttle_burst, state.throttle_tokens
+                                        + (now - state.throttle_updated) * config.throttle_rate)
+            state.throttle_updated = now
+            if state.throttle_tokens >= 1:
+                state.throttle_tokens -= 1
+                return None
+            state.throttled += 1
+        headers = {"Retry-After": f"{config.retry_after:g}"} if config.retry_after else {}
+        return "Too Many Requests", 429, headers
+
+    @app.before_request
+    def simulate_latency():
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    @app.route("/")
+    def members_root():
+        return with_session(make_response("<html><body>BRS Golf Members</body></html>"))
+
+    @app.route("/<club>")
+    def landing(club):
+        return with_session(make_response(f"<html><body>{club} - BRS Golf</body></html>"))
+
+    @app.route("/<club>/login", methods=["GET", "POST"])
+    def login(club):
+        sid = request.cookies.get(SESSION_COOKIE, "")
+
+        if request.method == "GET":
+            csrf = secrets.token_hex(8)
+            state.form_tokens[("login", sid)] = (csrf,)
+            return with_session(make_response(
+                f'<form method="post"><input name="login_form[username]"><input name="login_form[password]">'
+                f'<input type="hidden" name="login_form[_token]" value="{csrf}"></form>'))
+
+        expected = state.form_tokens.pop(("login", sid), (None,))[0]
+        if sid not in state.sessions or request.form.get("login_form[_token]") != expected:
+            return "Invalid CSRF token", 400
+
+        state.sessions[sid] = request.form.get("login_form[username]")
+        return f"<html><body>Welcome {state.sessions[sid]}</body></html>"
+
+    @app.route("/<club>/tee-sheet/<course>/<path:date>")
+    def tee_sheet(club, course, date):
+        if current_user() is None:
+            return redirect(f"/{club}/login")
+
+        date = date.replace("/", "")
+        date = f"{date[:4]}/{date[4:6]}/{date[6:]}"
+        rows = []
+        for tee_time, holder in sheet(date, course).items():
+            if holder is None and not is_open():
+                # Before release every slot shows but nothing is bookable
+                rows.append((tee_time, ["Not yet open"]))
+            else:
+                rows.append((tee_time, [holder] if holder else []))
+
+        page = render_tee_sheet(club, date, rows, course)
+        if not config.etags:
+            return page.replace("</head>", f'<meta name="csrf-token" content="{secrets.token_hex(20)}"></head>')
+
+        response = make_response(page)
+        response.add_etag()
+        return response.make_conditional(request)
+
+    @app.route("/<club>/bookings/book/<course>/<date>/<tee_time>")
+    def booking_form(club, course, date, tee_time):
+        if current_user() is None:
+            return redirect(f"/{club}/login")
+        if not is_open():
+            return NOT_OPEN_MESSAGE, 403
+
+        token, csrf = secrets.token_hex(8), secrets.token_hex(8)
+        state.form_tokens[(request.cookies[SESSION_COOKIE], course, date, tee_time)] = (token, csrf)
+        return (
+            f'<form method="post" action="/{club}/bookings/store/{course}/{date}/{tee_time}">'
+            f'<input type="hidden" name="member_booking_form[token]" value="{token}">'
+            f'<input type="hidden" name="member_booking_form[_token]" value="{csrf}"></form>'
+        )
+
+    @app.route("/<club>/bookings/store/<course>/<date>/<tee_time>", methods=["POST"])
+    def store(club, course, date, tee_time):
+        received = time.time() - config.release_at
+        username = current_user()
+        if username is None:
+            return redirect(f"/{club}/login")
+
+        with state.lock:
+            stats = state.accounts.setdefault(username, AccountStats())
+            stats.posts += 1
+            if stats.first_post is None:
+                stats.first_post = received
+
+        if not is_open():
+            return NOT_OPEN_MESSAGE, 403
+
+        expected = state.form_tokens.get((request.cookies[SESSION_COOKIE], course, date, tee_time))
+        submitted = (request.form.get("member_booking_form[token]"), request.form.get("member_booking_form[_token]"))
+        if expected != submitted:
+            return "Invalid booking form token", 400
+
+        slot_time = f"{tee_time[:2]}:{tee_time[2:]}"
+        slots = sheet(f"{date[:4]}/{date[4:6]}/{date[6:]}", course)
+        with state.lock:
+            if slot_time not in slots:
+                abort(404)
+            if slots[slot_time] is not None:
+                return SLOT_TAKEN_MESSAGE, 409
+            slots[slot_time] = username
+            stats.slot = slot_time if course == "1" else f"{slot_time} (course {course})"
+            stats.confirmed = time.time() - config.release_at
+
+        return f"<html><body>{SUCCESS_MESSAGE} for {slot_time}</body></html>"
+
+    return app
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    """wsgiref handler that serves any number of requests per connection
+
+    werkzeug closes every connection after one response, so keep-alive and TLS are
+    served by this instead. The mock's routes read every request body, so the next
+    request line is always where the loop expects it.
+    """
+    config: MockBRSConfig = None
+
+    def setup(self):
+        # Standing in for the network round trips of connection setup, then TLS
+        if self.config.connect_latency:
+            time.sleep(self.config.connect_latency)
+        # Headers and body are written separately, which Nagle would hold back on a reused connection
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.server.ssl_context is not None:
+            self.request = self.server.ssl_context.wrap_socket(self.request, server_side=True)
+        self.timeout = self.config.idle_timeout
+        super().setup()
+
+    def handle(self):
+        BaseHTTPRequestHandler.handle(self)
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except OSError:
+            # Idle past the timeout, or the client went away
+            self.close_connection = True
+            return
+        if not self.raw_requestline or not self.parse_request():
+            self.close_connection = True
+            return
+        handler = ServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(), multithread=True)
+        handler.http_version = self.protocol_version.split("/")[1]
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+    def log_message(self, *args):
+        pass
+
+
+class KeepAliveServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    ssl_context = None
+
+
+def keep_alive_server(host, port, app, config: MockBRSConfig, certificate=None):
+    handler = type("Handler", (KeepAliveHandler,), {
+        "config": config, "protocol_version": "HTTP/1.1" if config.keep_alive else "HTTP/1.0"})
+    server = KeepAliveServer((host, port), handler)
+    server.set_app(app)
+    if certificate:
+        server.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server.ssl_context.load_cert_chain(*certificate)
+    return server
+
+
+def self_signed_certificate():
+    """Write a certificate and key for localhost, returning their paths. Trust the certificate with REQUESTS_CA_BUNDLE."""
+    directory = tempfile.mkdtemp(prefix="mock_brs_tls_")
+    certificate, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+                    "-keyout", key, "-out", certificate], check=True, capture_output=True)
+    return certificate, key
+
+
+class MockBRSServer:
+    """Runs the mock BRS app on a local port in a background thread"""
+
+    def __init__(self, config: MockBRSConfig, host="127.0.0.1", port=0):
+        self.config = config
+        self.state = MockBRSState()
+        self.app = create_app(config, self.state)
+        self.certificate = self_signed_certificate() if config.tls else None
+        if config.keep_alive or config.tls:
+            self._server = keep_alive_server(host, port, self.app, config, self.certificate)
+        else:
+            self._server = make_server(host, port, self.app, threaded=True)
+        self.url = f"{'https' if config.tls else 'http'}://{host}:{self._server.server_port}"
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+
+    def book(self, date, tee_time, holder, course="1"):
+        """Give a slot to someone outside the simulation, or free it with holder None"""
+        key = (course, date)
+        with self.state.lock:
+            slots = self.state.slots.setdefault(key, {t: None for t in tee_times(
+                self.config.first_tee_time, self.config.interval, self.config.tee_time_count)})
+            slots[tee_time] = holder
+
+    def _competitors(self):
+        # Other members grabbing random free slots once the sheet opens
+        while not self._stopping.is_set() and time.time() < self.config.release_at:
+            time.sleep(0.001)
+        while not self._stopping.wait(1 / self.config.competitor_rate):
+            with self.state.lock:
+                for slots in self.state.slots.values():
+                    free = [t for t, holder in slots.items() if holder is None]
+                    if free:
+                        slots[random.choice(free)] = "competitor"
+
+    def start(self):
+        self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True))
+        if self.config.competitor_rate > 0:
+            self._threads.append(threading.Thread(target=self._competitors, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._server.shutdown()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
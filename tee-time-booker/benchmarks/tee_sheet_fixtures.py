@@ -0,0 +1,81 @@
+"""
+Synthetic BRS tee sheets in the same markup as the live site's rendered tee sheet
+"""
+import os
+import random
+from datetime import datetime, timedelta
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Fixture name -> (first tee time, minutes between tee times, number of tee times)
+FIXTURE_SIZES = {
+    "small": ("07:00", 10, 30),
+    "medium": ("06:00", 8, 105),
+    "large": ("06:00", 3, 300),
+}
+
+ROW_CLASS = "bg-white even:bg-grey-faded"
+
+
+def tee_times(first="06:00", interval=8, count=105):
+    """Return count tee times as HH:MM strings, interval minutes apart"""
+    start = datetime.strptime(first, "%H:%M")
+    return [(start + timedelta(minutes=interval * i)).strftime("%H:%M") for i in range(count)]
+
+
+def booking_href(club, date, tee_time, course="1"):
+    """Href of the booking form for a slot, e.g. /club/bookings/book/1/20230724/1250"""
+    return f"/{club}/bookings/book/{course}/{date.replace('/', '')}/{tee_time.replace(':', '')}"
+
+
+def render_row(club, date, tee_time, booked_players=(), course="1"):
+    """Render a single tee sheet row, with a booking link only when nobody is booked"""
+    if booked_players:
+        players = "".join(f'<div class="player">{name}</div>' for name in booked_players)
+        return (
+            f'<tr class="{ROW_CLASS}">'
+            f'<td class="px-2"><div class="font-bold">{tee_time}</div><div class="text-xs">18 Holes</div></td>'
+            f'<td colspan="4"><div class="flex">{players}</div></td>'
+            f'</tr>'
+        )
+
+    return (
+        f'<tr class="{ROW_CLASS}">'
+        f'<td class="px-2"><div class="font-bold">{tee_time}</div></td>'
+        f'<td colspan="4"><div class="flex"><a class="btn" href="{booking_href(club, date, tee_time, course)}">Book</a></div></td>'
+        f'</tr>'
+    )
+
+
+def render_tee_sheet(club, date, rows, course="1"):
+    """Render a tee sheet page. rows is a list of (tee_time, booked_players)"""
+    body = "".join(render_row(club, date, tee_time, players, course) for tee_time, players in rows)
+    return (
+        "<!DOCTYPE html><html><head><title>Tee Sheet</title></head><body>"
+        '<nav class="bg-primary"><div>Menu</div><div>Account</div></nav>'
+        f'<main><h1>Tee Sheet {date}</h1><table class="w-full"><thead><tr><th>Time</th><th colspan="4">Players</th></tr></thead>'
+        f"<tbody>{body}</tbody></table></main></body></html>"
+    )
+
+
+def generate_fixture(name, club="club", date="2023/07/24", booked_ratio=0.6, seed=1):
+    """Render a named fixture with a deterministic mix of booked and free rows"""
+    first, interval, count = FIXTURE_SIZES[name]
+    rng = random.Random(seed)
+    rows = []
+    for tee_time in tee_times(first, interval, count):
+        booked = rng.random() < booked_ratio
+        rows.append((tee_time, [f"Player {rng.randint(1, 900)}" for _ in range(rng.randint(1, 4))] if booked else []))
+    return render_tee_sheet(club, date, rows)
+
+
+def load_fixture(name):
+    """Load a saved fixture, generating and saving it on first use"""
+    path = os.path.join(FIXTURES_DIR, f"{name}.html")
+    if not os.path.exists(path):
+        os.makedirs(FIXTURES_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(generate_fixture(name))
+
+    with open(path) as f:
+        return f.read()
@@ -0,0 +1,41 @@
+import json
+from datetime import datetime
+
+import preferences
+import release_rules
+
+# Columns the UI and /api/bookings show, so neither has to load whole rows
+DISPLAY_COLUMNS = ("id", "username", "club", "date", "time", "players", "courses",
+                   "formatted_date", "day_name", "time_label", "backup_times")
+
+
+def display_fields(tee_date, windows):
+    """Display columns for a booking, computed once when it's saved"""
+    try:
+        date_obj = datetime.strptime(tee_date, release_rules.DATE_FORMAT)
+        formatted_date, day_name = date_obj.strftime("%d/%m/%Y"), date_obj.strftime("%A")
+    except ValueError:
+        formatted_date, day_name = tee_date, ""
+
+    # First choice in the badge, backups listed underneath
+    labels = [window.label() for window in windows]
+    return {
+        "formatted_date": formatted_date,
+        "day_name": day_name,
+        "time_label": labels[0] if labels else "",
+        "backup_times": json.dumps(labels[1:]),
+    }
+
+
+def booking_display_fields(booking):
+    """display_fields() for a stored booking row"""
+    return display_fields(booking["date"], preferences.windows_from_booking(booking))
+
+
+def for_display(row):
+    """Unpack the stored list columns of a display row"""
+    row = dict(row)
+    row["players_list"] = row["players"].split(",") if row["players"] else []
+    row["courses_list"] = row["courses"].split(",") if row["courses"] else []
+    row["backup_times"] = json.loads(row["backup_times"] or "[]")
+    return row
@@ -0,0 +1,225 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+logger = logging.getLogger(__name__)
+
+# Total memory the pool is allowed to use across every Chrome instance, and a rough
+# per-instance estimate for a headless tab on the tee sheet. The pool never launches
+# more drivers than the budget allows, whatever size is asked for.
+MAX_BROWSER_MEMORY_MB = int(os.getenv("MAX_BROWSER_MEMORY_MB", "1024"))
+BROWSER_MEMORY_ESTIMATE_MB = 256
+
+# Cap on the V8 heap of each renderer so one page can't blow the budget on its own
+BROWSER_JS_HEAP_MB = 128
+
+# How long to wait for the tee sheet table to render before taking the page as is
+TEE_SHEET_READY_TIMEOUT = 10
+
+# How long to wait for a driver when every one in the pool is borrowed
+DRIVER_WAIT_TIMEOUT = float(os.getenv("BROWSER_WAIT_TIMEOUT", "30"))
+
+# Tee sheet rows - the full class is "bg-white even:bg-grey-faded"
+TEE_SHEET_ROW_SELECTOR = "table tr.bg-white"
+
+
+def browserOptions():
+    """Headless Chrome options tuned for fast start-up and low memory use"""
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--renderer-process-limit=1")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_argument(f"--js-flags=--max-old-space-size={BROWSER_JS_HEAP_MB}")
+
+    # Don't wait on images/stylesheets, the readiness wait below covers the table
+    options.page_load_strategy = "eager"
+
+    return options
+
+
+def seleniumCookies(session):
+    """Convert a requests CookieJar into Selenium's cookie dictionaries"""
+    cookies = []
+
+    for cookie in session.cookies:
+        selenium_cookie = {
+            'name': cookie.name,
+            'value': cookie.value,
+            'path': cookie.path,
+            'domain': cookie.domain,
+            'secure': cookie.secure
+        }
+        # Omit cookie expiry property if the cookie is a session cookie
+        if cookie.expires is not None:
+            selenium_cookie['expiry'] = cookie.expires
+
+        cookies.append(selenium_cookie)
+
+    return cookies
+
+
+class BrowserPool:
+    """Pool of headless Chrome drivers that are launched ahead of the release time"""
+
+    def __init__(self, size=1, max_memory_mb=MAX_BROWSER_MEMORY_MB):
+        self.max_memory_mb = max_memory_mb
+        self.size = self._capped(size)
+        self._idle = queue.Queue()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    def _capped(self, size):
+        capped = max(1, min(size, self.max_memory_mb // BROWSER_MEMORY_ESTIMATE_MB))
+        if capped < size:
+            logger.warning(f"Browser pool capped at {capped} drivers by the {self.max_memory_mb}MB memory budget")
+        return capped
+
+    def resize(self, size):
+        """Change how many drivers the pool may hold, quitting idle ones beyond it"""
+        with self._lock:
+            self.size = self._capped(size)
+            surplus = len(self._drivers) - self.size
+
+        for _ in range(surplus):
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def _launch(self, warm_url=None):
+        driver = webdriver.Chrome(options=browserOptions())
+        with self._lock:
+            self._drivers.append(driver)
+
+        # Pre-navigate so cookies can be injected for the club domain straight away
+        if warm_url:
+            driver.get(warm_url)
+
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except WebDriverException as e:
+            logger.warning(f"Error quitting browser: {e}")
+
+    def start(self, warm_url, count=None):
+        """Launch drivers up to the pool size and point them at warm_url"""
+        count = min(count or self.size, self.size)
+        while len(self._drivers) < count:
+            try:
+                self._idle.put(self._launch(warm_url))
+            except WebDriverException as e:
+                logger.error(f"Failed to launch browser: {e}")
+                break
+
+    @contextmanager
+    def driver(self, timeout=DRIVER_WAIT_TIMEOUT):
+        """Borrow a driver, launching one if the pool hasn't reached its size yet
+
+        Raises TimeoutError if every driver stays borrowed for timeout seconds.
+        """
+        try:
+            driver = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_launch = len(self._drivers) < self.size
+            if can_launch:
+                driver = self._launch()
+            else:
+                try:
+                    driver = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No browser free in the pool of {self.size} within {timeout}s") from None
+
+        healthy = False
+        try:
+            yield driver
+            healthy = True
+        finally:
+            # A driver that raised may be in any state, so it is never reused, and
+            # nor is one the pool has since been shrunk below
+            if healthy and len(self._drivers) <= self.size:
+                self._idle.put(driver)
+            else:
+                self._discard(driver)
+
+    def close(self):
+        """Quit every driver in the pool"""
+        with self._lock:
+            drivers = list(self._drivers)
+        for driver in drivers:
+            self._discard(driver)
+
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def getPool(size=None):
+    """Return the shared browser pool, creating it on first use and resizing it to size if given"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(size or 1)
+        elif size is not None and size != _pool.size:
+            _pool.resize(size)
+        return _pool
+
+
+def closePool():
+    """Tear down the shared browser pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+# Never leak Chrome processes from the long-running app
+atexit.register(closePool)
+
+
+def fetchPageSource(pool, session, url, timeout=TEE_SHEET_READY_TIMEOUT):
+    """Load url in a pooled browser with the session's cookies and return the rendered HTML"""
+    with pool.driver() as driver:
+        # The driver has to be on the cookie's domain before cookies can be added
+        if not driver.current_url.startswith(url.split('/tee-sheet')[0]):
+            driver.get(url)
+
+        driver.delete_all_cookies()
+        for cookie in seleniumCookies(session):
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException as e:
+                logger.debug(f"Skipping cookie {cookie['name']}: {e}")
+
+        driver.get(url)
+
+        # Wait for the tee sheet rows rather than a fixed sleep
+        try:
+            WebDriverWait(driver, timeout).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, TEE_SHEET_ROW_SELECTOR))
+            )
+        except TimeoutException:
+            logger.warning(f"Tee sheet rows did not appear within {timeout}s for {url}")
+
+        return driver.page_source
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Record and replay of BRS traffic for offline profiling of booking runs
+
+A capture records every request and response of a booking run, with when it started
+and how long it took, plus the page source of any Selenium fallback. Passwords, form
+tokens and cookies are redacted before anything is written. Replaying a capture runs
+its tee sheets back through hrefParser, bookingSlotTokens and bookTeeTime against the
+recorded responses, with no network, so parsing and processing can be profiled
+repeatably on real production sheets.
+
+Usage: python brs_capture.py captures/<capture>.json [--repeat 20] [--realtime] [--profile]
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time as time_module
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_VERSION = 1
+
+REDACTED = "[redacted]"
+
+# Form fields and headers whose values never go into a capture
+SECRET_FIELD = re.compile(r"password|token", re.IGNORECASE)
+SECRET_HEADERS = ("cookie", "set-cookie", "authorization")
+
+# Hidden inputs in a page, e.g. the login and booking form tokens
+INPUT_TAG = re.compile(r"<input\b[^>]*>", re.IGNORECASE)
+INPUT_NAME = re.compile(r"""\bname\s*=\s*["']([^"']*)["']""", re.IGNORECASE)
+INPUT_VALUE = re.compile(r"""(\bvalue\s*=\s*)(["'])[^"']*\2""", re.IGNORECASE)
+
+TEE_SHEET_COURSE = re.compile(r"/tee-sheet/([^/]+)/")
+
+
+def redact_headers(headers) -> List[List[str]]:
+    """Header pairs with cookie and authorization values redacted"""
+    return [[name, REDACTED if name.lower() in SECRET_HEADERS else str(value)]
+            for name, value in (headers.items() if hasattr(headers, "items") else headers)]
+
+
+def redact_form(data) -> Optional[Dict[str, str]]:
+    """Form fields with passwords and tokens redacted"""
+    if data is None:
+        return None
+    if isinstance(data, (bytes, str)):
+        data = parse_qsl(data.decode() if isinstance(data, bytes) else data, keep_blank_values=True)
+    items = data.items() if hasattr(data, "items") else data
+    return {name: REDACTED if SECRET_FIELD.search(name) else str(value) for name, value in items}
+
+
+def redact_html(html: str) -> str:
+    """A page with the values of its password and token inputs redacted"""
+    def redact_input(match):
+        tag = match.group(0)
+        name = INPUT_NAME.search(tag)
+        if name and SECRET_FIELD.search(name.group(1)):
+            return INPUT_VALUE.sub(lambda value: f"{value.group(1)}{value.group(2)}{REDACTED}{value.group(2)}", tag)
+        return tag
+
+    return INPUT_TAG.sub(redact_input, html)
+
+
+@dataclass
+class Exchange:
+    """One recorded request and its response, or a Selenium page load when kind is "page_source"
+
+    started is seconds from the start of the capture, elapsed the time to the full response.
+    """
+    kind: str
+    method: str
+    url: str
+    started: float
+    elapsed: float
+    request_headers: List[List[str]] = field(default_factory=list)
+    request_form: Optional[Dict[str, str]] = None
+    status_code: Optional[int] = None
+    reason: str = ""
+    response_url: str = ""
+    response_headers: List[List[str]] = field(default_factory=list)
+    body: str = ""
+    encoding: str = "utf-8"
+    error: Optional[str] = None
+
+
+class Capture:
+    """Exchanges recorded during one booking run, and the booking they were made for"""
+
+    def __init__(self, booking: Optional[dict] = None, started_at: Optional[str] = None, exchanges=None):
+        self.booking = booking or {}
+        self.started_at = started_at or datetime.now().isoformat()
+        self.exchanges: List[Exchange] = list(exchanges or [])
+        self.origin = time_module.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, exchange: Exchange):
+        with self._lock:
+            self.exchanges.append(exchange)
+
+    def tee_sheets(self) -> Dict[str, str]:
+        """Course -> the tee sheet HTML the run parsed for it
+
+        That's the last Selenium page for the course, else its last bookable static sheet.
+        """
+        import tee_time_booker
+
+        sheets = {}
+        for exchange in reversed(self.exchanges):
+            course = TEE_SHEET_COURSE.search(exchange.url)
+            if exchange.kind == "page_source" and course and exchange.body:
+                sheets.setdefault(course.group(1), exchange.body)
+
+        for exchange in reversed(self.exchanges):
+            course = TEE_SHEET_COURSE.search(exchange.url)
+            if exchange.kind == "http" and exchange.method == "GET" and course and exchange.body \
+                    and course.group(1) not in sheets:
+                page_source, _ = tee_time_booker.staticTeeSheet(exchange.body, self.booking.get("club", ""))
+                if page_source is not None:
+                    sheets[course.group(1)] = page_source
+
+        return sheets
+
+    def to_dict(self):
+        with self._lock:
+            exchanges = [asdict(exchange) for exchange in self.exchanges]
+        return {"version": CAPTURE_VERSION, "started_at": self.started_at, "booking": self.booking,
+                "exchanges": exchanges}
+
+    def save(self, directory: str) -> str:
+        """Write the capture to a new file in directory and return its path"""
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.fromisoformat(self.started_at).strftime("%Y%m%dT%H%M%S%f")
+        date = str(self.booking.get("date", "")).replace("/", "-")
+        path = os.path.join(directory, f"{self.booking.get('club', 'brs')}_{date}_{stamp}.json")
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "Capture":
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != CAPTURE_VERSION:
+            raise ValueError(f"Unsupported capture version {data.get('version')} in {path}")
+        return cls(data["booking"], data["started_at"], [Exchange(**exchange) for exchange in data["exchanges"]])
+
+
+_current_capture = contextvars.ContextVar("current_capture", default=None)
+
+
+@contextmanager
+def bind(capture: Capture):
+    """Record requests made in this context (and contexts copied from it) into capture"""
+    token = _current_capture.set(capture)
+    try:
+        yield capture
+    finally:
+        _current_capture.reset(token)
+
+
+def current() -> Optional[Capture]:
+    return _current_capture.get()
+
+
+def record_response(method, url, headers, data, response, started, error=None):
+    """Record a finished request into the bound capture, if there is one
+
+    response needs status_code, reason, url, headers, content and encoding, as both
+    requests and brs_client responses have. started is on the monotonic clock.
+    """
+    capture = current()
+    if capture is None:
+        return
+
+    exchange = Exchange("http", method.upper(), url, started - capture.origin, time_module.monotonic() - started,
+                        redact_headers(headers or {}), redact_form(data), error=error)
+    if response is not None:
+        encoding = response.encoding or "utf-8"
+        exchange.status_code = response.status_code
+        exchange.reason = response.reason or ""
+        exchange.response_url = str(response.url)
+        exchange.response_headers = redact_headers(response.headers)
+        exchange.body = redact_html(response.content.decode(encoding, errors="replace"))
+        exchange.encoding = encoding
+    capture.add(exchange)
+
+
+def record_page_source(url, page_source, started):
+    """Record the HTML Selenium rendered for url into the bound capture, if there is one"""
+    capture = current()
+    if capture is None:
+        return
+    capture.add(Exchange("page_source", "GET", url, started - capture.origin, time_module.monotonic() - started,
+                         body=redact_html(page_source or "")))
+
+
+def watch(session):
+    """Record every response a requests session gets while a capture is bound"""
+    def hook(response, *args, **kwargs):
+        request = response.request
+        started = time_module.monotonic() - response.elapsed.total_seconds()
+        form = request.body if request.body and "urlencoded" in request.headers.get("Content-Type", "") else None
+        record_response(request.method, request.url, request.headers, form, response, started)
+
+    session.hooks["response"].append(hook)
+    return session
+
+
+def request_key(method, url):
+    # Matched on path so a capture replays whichever BRS host it was taken against
+    parts = urlsplit(url)
+    return method.upper(), parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+class ReplaySession:
+    """Stands in for a requests session, answering every request from a capture
+
+    Each request gets the next recorded response for its method and path, and the last
+    one again once they've all been used, so extra retries still get an answer.
+    Requests the capture never saw fail as connection errors. With realtime, every
+    response takes as long as it did when it was recorded.
+    """
+
+    def __init__(self, capture: Capture, realtime: bool = False):
+        import requests
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.realtime = realtime
+        self._responses = defaultdict(deque)
+        self._last = {}
+        self._lock = threading.Lock()
+        for exchange in capture.exchanges:
+            if exchange.kind == "http":
+                self._responses[request_key(exchange.method, exchange.url)].append(exchange)
+
+    def request(self, method, url, **kwargs):
+        import brs_client
+        import requests
+        from multidict import CIMultiDict
+
+        key = request_key(method, url)
+        with self._lock:
+            queue = self._responses.get(key)
+            exchange = queue.popleft() if queue else self._last.get(key)
+            self._last[key] = exchange
+
+        if exchange is None:
+            raise requests.exceptions.ConnectionError(f"No captured response for {method} {url}")
+        if self.realtime:
+            time_module.sleep(exchange.elapsed)
+        if exchange.error is not None:
+            raise requests.exceptions.ConnectionError(exchange.error)
+
+        return brs_client.Response(exchange.status_code, exchange.reason, exchange.response_url or url,
+                                   CIMultiDict(exchange.response_headers), exchange.body.encode(exchange.encoding),
+                                   exchange.encoding)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+@dataclass
+class ReplayResult:
+    hrefs: List[str]
+    tokens: list
+    response: object
+    record: object
+
+
+def replay(capture: Capture, realtime: bool = False) -> ReplayResult:
+    """Run a captured booking's parse, token fetch and booking offline against its responses"""
+    import asyncio
+
+    import async_booker
+    import metrics
+    import tee_time_booker
+
+    booking = capture.booking
+    session = ReplaySession(capture, realtime)
+
+    courses = booking.get("courses") or [tee_time_booker.DEFAULT_COURSE]
+
+    with metrics.bind(metrics.RunRecord(club=booking.get("club"))) as record:
+        with metrics.span("staticTeeSheet"):
+            sheets = capture.tee_sheets()
+        with metrics.span("parseTeeSheet"):
+            index = tee_time_booker.mergeTeeSheets(
+                tee_time_booker.parseTeeSheet(sheets[course], course) for course in courses if course in sheets)
+        slots = tee_time_booker.hrefParser(None, booking.get("preferences", []), index, courses=courses)
+        hrefs = [slot.href for slot in slots]
+        tokens = asyncio.run(async_booker.bookingSlotTokens(session, hrefs))
+        response = asyncio.run(async_booker.bookTeeTime(session, booking.get("club"), slots, tokens,
+                                                        *(booking.get("players") or [""])[:4]))
+
+    return ReplayResult(hrefs, tokens, response, record)
+
+
+def main(path, repeat, realtime, profile):
+    import statistics
+
+    import brs_responses
+
+    capture = Capture.load(path)
+    print(f"{path}: {len(capture.exchanges)} exchanges captured at {capture.started_at} "
+          f"for {capture.booking.get('club')} on {capture.booking.get('date')}")
+
+    # The first replay also pays for the flow's lazy imports, so it isn't counted
+    replay(capture)
+
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    results = [replay(capture, realtime) for _ in range(repeat)]
+
+    if profiler is not None:
+        import pstats
+        profiler.disable()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+    last = results[-1]
+    print(f"hrefs: {last.hrefs}")
+    print(f"outcome: {brs_responses.classify(last.response).name}")
+
+    durations = defaultdict(list)
+    for result in results:
+        for span in result.record.spans:
+            durations[span.stage].append(span.duration * 1000)
+
+    print(f"\n{'stage':<22}{'calls':>8}{'p50 ms':>10}{'max ms':>10}")
+    for stage, values in durations.items():
+        print(f"{stage:<22}{len(values):>8}{statistics.median(values):>10.3f}{max(values):>10.3f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="capture file written by a run with BOOKING_CAPTURE_DIR set")
+    parser.add_argument("--repeat", type=int, default=1, help="replay this many times")
+    parser.add_argument("--realtime", action="store_true", help="wait out each response's recorded latency")
+    parser.add_argument("--profile", action="store_true", help="print a cProfile of the replays")
+    args = parser.parse_args()
+    main(args.capture, args.repeat, args.realtime, args.profile)
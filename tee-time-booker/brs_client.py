@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import time as time_module
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import aiohttp
+import requests
+from multidict import CIMultiDict
+
+import brs_capture
+import brs_responses
+import brs_transport
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Most connections kept open to BRS, shared by every account's booking flow
+POOL_SIZE = int(os.getenv("BRS_POOL_SIZE", "100"))
+
+# Idle pooled connections are kept alive this long between requests
+KEEPALIVE_SECONDS = float(os.getenv("BRS_KEEPALIVE_SECONDS", "75"))
+
+# Upper bound on a single request, connect through to the last byte of the body
+REQUEST_TIMEOUT = float(os.getenv("BRS_REQUEST_TIMEOUT", "30"))
+
+# Raised by request() for network failures and timeouts
+RequestError = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+@dataclass
+class Response:
+    """A fully read BRS response, with the requests.Response attributes the flow relies on"""
+    status_code: int
+    reason: str
+    url: str
+    headers: CIMultiDict = field(default_factory=CIMultiDict)
+    content: bytes = b""
+    encoding: str = "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def __repr__(self):
+        return f"<Response [{self.status_code}]>"
+
+
+class ConnectionPool:
+    """Keep-alive connections to BRS shared by many accounts on one event loop
+
+    Every account gets its own ClientSession, so cookies stay separate, but all of them
+    borrow connections from one connector. warm() opens connections ahead of the release
+    time so the critical requests go out on sockets that have already done TLS.
+    Must be created and used inside a running event loop.
+    """
+
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self.connector = aiohttp.TCPConnector(limit=size, limit_per_host=size,
+                                              keepalive_timeout=KEEPALIVE_SECONDS, ttl_dns_cache=None)
+        self.timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        self._sessions = []
+
+    def session(self) -> aiohttp.ClientSession:
+        """A new session with its own cookie jar on the shared connections"""
+        # unsafe=True keeps cookies from IP address hosts, e.g. a local BRS stand-in
+        session = aiohttp.ClientSession(connector=self.connector, connector_owner=False, timeout=self.timeout,
+                                        cookie_jar=aiohttp.CookieJar(unsafe=True))
+        self._sessions.append(session)
+        return session
+
+    async def warm(self, url: str, count: int):
+        """Open up to count connections to url's host and leave them idle in the pool"""
+        count = min(count, self.size)
+        origin = f"{urlparse(url).scheme}://{urlparse(url).netloc}/"
+
+        async def touch(session):
+            try:
+                await _request(session, 'HEAD', origin, allow_redirects=False)
+            except RequestError as e:
+                logger.warning(f"Could not open a connection to {origin}: {e}")
+
+        # Concurrent requests force the connector to open count sockets instead of reusing one
+        async with aiohttp.ClientSession(connector=self.connector, connector_owner=False,
+                                         timeout=self.timeout) as session:
+            await asyncio.gather(*(touch(session) for _ in range(count)))
+        logger.debug(f"Warmed {count} connections to {origin}")
+
+    async def keep_warm(self, url: str, count: int, until: float,
+                        interval: float = brs_transport.PING_INTERVAL, quiet: float = brs_transport.PING_QUIET_SECONDS):
+        """warm() now, then again every interval, the last time finishing quiet seconds before until (epoch seconds)
+
+        Returns after the last ping, leaving the caller to wait out the quiet window. The
+        connector caches DNS for good, so the addresses resolved by the first warm()
+        are the ones connected to at release. Pings come out of the host's request
+        budget, so no more connections are kept than the budget lets out at once, and
+        the quiet window is stretched until the budget has earned the pings back.
+        """
+        count = rate_limiter.LIMITER.warm_connections(url, count)
+        pings = 0
+        while True:
+            start = time_module.time()
+            await self.warm(url, count)
+            pings += 1
+            last_ping = time_module.time() - start
+
+            settle = max(quiet, rate_limiter.LIMITER.refill_seconds(url, count))
+            next_ping = start + interval
+            if next_ping + last_ping > until - settle:
+                next_ping = until - settle - last_ping
+                if next_ping <= time_module.time():
+                    break
+            await asyncio.sleep(next_ping - time_module.time())
+        logger.info(f"Kept {count} connections to {urlparse(url).netloc} warm with {pings} pings, "
+                    f"last one {last_ping * 1000:.1f}ms")
+
+    async def close(self):
+        for session in self._sessions:
+            await session.close()
+        self._sessions.clear()
+        await self.connector.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+async def request(session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> Response:
+    """Make a request and read the whole body before the connection goes back to the pool
+
+    The request first waits for its host's budget in rate_limiter.LIMITER.
+    """
+    if brs_capture.current() is None:
+        return await _request(session, method, url, **kwargs)
+
+    started = time_module.monotonic()
+    try:
+        response = await _request(session, method, url, **kwargs)
+    except RequestError as e:
+        brs_capture.record_response(method, url, kwargs.get("headers"), kwargs.get("data"), None, started,
+                                    error=f"{type(e).__name__}: {e}")
+        raise
+    brs_capture.record_response(method, url, kwargs.get("headers"), kwargs.get("data"), response, started)
+    return response
+
+
+async def _request(session, method, url, **kwargs):
+    sent = await rate_limiter.LIMITER.acquire_async(method, url)
+    async with session.request(method, url, **kwargs) as response:
+        content = await response.read()
+        result = Response(response.status, response.reason or "", str(response.url), CIMultiDict(response.headers),
+                          content, response.get_encoding() if content else "utf-8")
+    rate_limiter.LIMITER.observe(url, result.status_code, brs_responses.retry_after(result), sent)
+    return result
+
+
+def requestsSession(session: aiohttp.ClientSession) -> requests.Session:
+    """A requests session carrying an aiohttp session's cookies, for the Selenium fallback"""
+    copy = requests.Session()
+    for cookie in session.cookie_jar:
+        copy.cookies.set(cookie.key, cookie.value, domain=cookie["domain"], path=cookie["path"] or "/",
+                         secure=bool(cookie["secure"]))
+    return copy
@@ -0,0 +1,120 @@
+import os
+import random
+import threading
+import time as time_module
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from enum import Enum
+from typing import Optional
+
+# How long after firing a booking keeps retrying slots that aren't open yet
+RETRY_WINDOW_SECONDS = float(os.getenv("BOOKING_RETRY_WINDOW", "10"))
+
+# Retry spacing for "not open yet" and transient errors - tight, with jitter so many
+# accounts don't retry in lockstep
+RETRY_INTERVAL = 0.02
+RETRY_JITTER = 0.02
+
+# Back-off when BRS rate limits us without saying for how long
+RATE_LIMIT_BACKOFF = 0.25
+RATE_LIMIT_MAX_BACKOFF = 2.0
+
+# Lower-cased text BRS shows for each outcome
+NOT_OPEN_MARKERS = ("not yet open", "not open for booking", "bookings open at", "booking opens", "not yet available")
+SLOT_TAKEN_MARKERS = ("no longer available", "already been booked", "already booked", "slot is full", "fully booked")
+LOGIN_MARKERS = ("login_form[_token]",)
+
+
+class Outcome(Enum):
+    SUCCESS = "success"
+    NOT_OPEN = "not_open"
+    SLOT_TAKEN = "slot_taken"
+    SESSION_EXPIRED = "session_expired"
+    RATE_LIMITED = "rate_limited"
+    ERROR = "error"
+
+
+def classify(response) -> Outcome:
+    """Work out what a BRS response means for the booking, None being a network failure"""
+    if response is None:
+        return Outcome.ERROR
+
+    if response.status_code == 429 or (response.status_code == 503 and "Retry-After" in response.headers):
+        return Outcome.RATE_LIMITED
+
+    text = response.text.lower()
+
+    # Redirected to (or served) the login page, or Laravel's expired CSRF status
+    if response.status_code in (401, 419) or response.url.rstrip("/").endswith("/login") \
+            or any(marker in text for marker in LOGIN_MARKERS):
+        return Outcome.SESSION_EXPIRED
+
+    if any(marker in text for marker in NOT_OPEN_MARKERS):
+        return Outcome.NOT_OPEN
+
+    if response.status_code == 409 or any(marker in text for marker in SLOT_TAKEN_MARKERS):
+        return Outcome.SLOT_TAKEN
+
+    if 200 <= response.status_code < 300:
+        return Outcome.SUCCESS
+
+    return Outcome.ERROR
+
+
+def retry_after(response) -> Optional[float]:
+    """Seconds from a Retry-After header, either delta-seconds or an HTTP date"""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time_module.time())
+        except (TypeError, ValueError):
+            return None
+
+
+@dataclass
+class RetryPolicy:
+    """Deadline-bounded retry schedule shared by every slot in one booking"""
+    window: float = RETRY_WINDOW_SECONDS
+    interval: float = RETRY_INTERVAL
+    jitter: float = RETRY_JITTER
+    max_errors: int = 3
+    max_relogins: int = 2
+    deadline: float = field(init=False)
+    relogins: int = field(init=False, default=0)
+    _lock: threading.Lock = field(init=False, default_factory=threading.Lock, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.deadline = time_module.monotonic() + self.window
+
+    def claim_relogin(self):
+        """Count a log in again against max_relogins, False if they're used up"""
+        with self._lock:
+            if self.relogins >= self.max_relogins:
+                return False
+            self.relogins += 1
+            return True
+
+    def remaining(self):
+        return self.deadline - time_module.monotonic()
+
+    def delay(self, outcome, response=None, errors=0):
+        """Seconds to wait before retrying, or None to give up on the slot"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            return None
+
+        if outcome is Outcome.RATE_LIMITED:
+            delay = retry_after(response)
+            if delay is None:
+                delay = min(RATE_LIMIT_BACKOFF * 2 ** errors, RATE_LIMIT_MAX_BACKOFF)
+        elif outcome is Outcome.ERROR and errors >= self.max_errors:
+            return None
+        else:
+            delay = self.interval + random.uniform(0, self.jitter)
+
+        # No point sleeping past the deadline
+        return delay if delay < remaining else None
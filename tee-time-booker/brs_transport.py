@@ -0,0 +1,271 @@
+import logging
+import os
+import socket
+import threading
+import time as time_module
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+import brs_responses
+import metrics
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Connections kept per host by a session, enough for every request the fire phase
+# sends at once (one sheet per course, hedged booking POSTs)
+POOL_SIZE = int(os.getenv("BRS_SESSION_POOL_SIZE", "10"))
+
+# Connections opened ahead of the release and kept alive until it
+WARM_CONNECTIONS = int(os.getenv("BRS_WARM_CONNECTIONS", "4"))
+
+# Warm connections are pinged this often, well inside the server's idle timeout, and
+# not at all in the last BRS_PING_QUIET_MS before the release so that no ping is still
+# holding a connection when the release request goes out
+PING_INTERVAL = float(os.getenv("BRS_PING_INTERVAL", "5"))
+PING_QUIET_SECONDS = float(os.getenv("BRS_PING_QUIET_MS", "250")) / 1000
+
+# Request timings kept per session for after-the-fact checks
+TIMINGS_KEPT = 200
+
+# Addresses resolved ahead of time by pin(), by host, for every session in the process
+_pinned: Dict[str, List[str]] = {}
+
+# Timing of the last request made on this thread, handed from the connection to the adapter
+_local = threading.local()
+
+
+@dataclass
+class RequestTiming:
+    """Transport timings of one request, to tell requests on warm connections from ones that opened their own"""
+    method: str
+    host: str
+    path: str
+    started: float
+    new_connection: bool
+    connect: Optional[float] = None
+    handshake: Optional[float] = None
+    first_byte: Optional[float] = None
+
+    def describe(self):
+        if not self.new_connection:
+            return f"warm connection, first byte {self.first_byte * 1000:.1f}ms"
+        handshake = f", TLS {self.handshake * 1000:.1f}ms" if self.handshake is not None else ""
+        return f"new connection (connect {self.connect * 1000:.1f}ms{handshake}), first byte {self.first_byte * 1000:.1f}ms"
+
+
+def pin(url) -> List[str]:
+    """Resolve url's host now, and connect to these addresses from then on without DNS lookups"""
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    with metrics.span("dnsLookup"):
+        infos = socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+    addresses = list(dict.fromkeys(info[4][0] for info in infos))
+    _pinned[parsed.hostname] = addresses
+    return addresses
+
+
+class TimedConnection:
+    """Connection mixin that connects to pinned addresses and times the connect, TLS handshake and first byte"""
+
+    _opened = None
+
+    def _new_conn(self):
+        sock = self._open_socket()
+        self._connected_at = time_module.monotonic()
+        return sock
+
+    def _open_socket(self):
+        host = self._dns_host
+        addresses = _pinned.get(host)
+        if not addresses:
+            return super()._new_conn()
+
+        try:
+            self._dns_host = addresses[0]
+            return super()._new_conn()
+        except (NewConnectionError, ConnectTimeoutError) as e:
+            # The pinned address stopped answering, go back to DNS for this host
+            logger.warning(f"Pinned address {addresses[0]} for {host} failed, resolving again: {e}")
+            _pinned.pop(host, None)
+            self._dns_host = host
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+    def connect(self):
+        start = time_module.monotonic()
+        super().connect()
+        total = time_module.monotonic() - start
+
+        # The socket is connected by _new_conn() and any TLS handshake follows it in connect()
+        connected = self._connected_at - start
+        handshake = total - connected if isinstance(self, HTTPSConnection) else None
+        metrics.record("tcpConnect", start, connected)
+        if handshake is not None:
+            metrics.record("tlsHandshake", start + connected, handshake)
+        self._opened = (start, connected, handshake)
+
+    def request(self, method, url, *args, **kwargs):
+        start = time_module.monotonic()
+        super().request(method, url, *args, **kwargs)
+        # Opened by this request, or just before it by the pool
+        opened, self._opened = self._opened, None
+        self._request = (method, url, opened[0] if opened else start, opened)
+        self._sent = time_module.monotonic()
+
+    def getresponse(self):
+        response = super().getresponse()
+        first_byte = time_module.monotonic() - self._sent
+        metrics.record("firstByte", self._sent, first_byte)
+
+        method, url, started, opened = self._request
+        _local.timing = RequestTiming(method, self.host, url, started, opened is not None,
+                                      opened[1] if opened else None, opened[2] if opened else None, first_byte)
+        return response
+
+
+class TimedHTTPConnection(TimedConnection, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnection, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class WarmAdapter(HTTPAdapter):
+    """Transport adapter whose connections use pinned addresses and record a RequestTiming per request
+
+    Every request waits for its host's budget in rate_limiter.LIMITER first, and its
+    response status is fed back to it.
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE):
+        self.timings = deque(maxlen=TIMINGS_KEPT)
+        super().__init__(pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool,
+                                                   "https": TimedHTTPSConnectionPool}
+
+    def send(self, request, **kwargs):
+        sent = rate_limiter.LIMITER.acquire(request.method, request.url)
+        _local.timing = None
+        response = super().send(request, **kwargs)
+        rate_limiter.LIMITER.observe(request.url, response.status_code, brs_responses.retry_after(response), sent)
+        if _local.timing is not None:
+            self.timings.append(_local.timing)
+        return response
+
+
+def session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """A requests session on a WarmAdapter, ready for warm() and keptAlive()"""
+    new_session = requests.Session()
+    adapter = WarmAdapter(pool_size)
+    new_session.mount("http://", adapter)
+    new_session.mount("https://", adapter)
+    return new_session
+
+
+def timings(session, url, since: float = 0.0) -> List[RequestTiming]:
+    """Timings of the session's requests to url's host that started at or after since (monotonic)"""
+    adapter = session.get_adapter(url)
+    if not isinstance(adapter, WarmAdapter):
+        return []
+    host = urlparse(url).hostname
+    return [timing for timing in list(adapter.timings) if timing.started >= since and timing.host == host]
+
+
+def warm(session, url, count: int = WARM_CONNECTIONS) -> int:
+    """Open count connections to url's host and leave them idle in the session's pool
+
+    Each request holds its connection until all of them are answered, so they can't
+    share one. Connections already open are reused, so calling it again pings them and
+    replaces any the server dropped. Returns how many connections answered.
+    """
+    origin = f"{urlparse(url).scheme}://{urlparse(url).netloc}/"
+
+    def touch(_):
+        try:
+            return session.head(origin, allow_redirects=False, stream=True)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not open a connection to {origin}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        responses = list(executor.map(touch, range(count)))
+
+    # Reading the (empty) body hands each connection back to the pool open
+    for response in responses:
+        if response is not None:
+            response.content
+    return sum(response is not None for response in responses)
+
+
+@contextmanager
+def keptAlive(session, url, until: float, count: int = WARM_CONNECTIONS,
+              interval: float = PING_INTERVAL, quiet: float = PING_QUIET_SECONDS):
+    """Keep count connections to url's host warm until until (epoch seconds), e.g. the release time
+
+    Pins the host's addresses and opens the connections straight away, then pings them
+    every interval from a background thread. The last ping is timed to finish quiet
+    seconds before until, so the connections have only just been used when the release
+    request goes out and none is still held by a ping. The pings come out of the host's
+    request budget like any other request, so quiet is stretched to give the budget
+    time to earn them back. Leaving the block stops the pings without waiting for one
+    in flight.
+    """
+    try:
+        pin(url)
+    except OSError as e:
+        logger.warning(f"Could not resolve {url} ahead of time: {e}")
+
+    count = rate_limiter.LIMITER.warm_connections(url, count)
+    stop = threading.Event()
+
+    def ping():
+        pings = 0
+        last_ping = 0.0
+        while not stop.is_set():
+            start = time_module.time()
+            warm(session, url, count)
+            pings += 1
+            last_ping = time_module.time() - start
+
+            # The next ping, or the last one, finishing as the quiet window starts
+            settle = max(quiet, rate_limiter.LIMITER.refill_seconds(url, count))
+            next_ping = start + interval
+            if next_ping + last_ping > until - settle:
+                next_ping = until - settle - last_ping
+                if next_ping <= time_module.time():
+                    break
+            if stop.wait(next_ping - time_module.time()):
+                break
+        logger.info(f"Kept {count} connections to {urlparse(url).netloc} warm with {pings} pings, "
+                    f"last one {last_ping * 1000:.1f}ms")
+
+    thread = threading.Thread(target=ping, daemon=True, name="KeepAlive")
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
@@ -0,0 +1,368 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import time as time_module
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import Booking
+import async_booker
+import brs_client
+import brs_responses
+import metrics
+import release_rules
+import slot_allocation
+import tee_time_booker
+
+logger = logging.getLogger(__name__)
+
+# Seconds between polls of a sheet. A sheet that changed is polled again after the
+# minimum, and every poll that finds nothing new stretches the wait by WATCH_BACKOFF up
+# to the maximum, so quiet sheets cost almost nothing and busy ones are watched closely.
+WATCH_MIN_INTERVAL = float(os.getenv("WATCH_MIN_INTERVAL", "20"))
+WATCH_MAX_INTERVAL = float(os.getenv("WATCH_MAX_INTERVAL", "300"))
+WATCH_BACKOFF = 1.5
+
+# Polls are spread by up to this fraction of their interval so sheets don't line up
+WATCH_JITTER = 0.1
+
+# How often the list of unfilled bookings is read again from the database
+WATCH_REFRESH_SECONDS = float(os.getenv("WATCH_REFRESH_SECONDS", "60"))
+
+# Sheet requests in flight at once across every watched sheet
+WATCH_CONCURRENCY = int(os.getenv("WATCH_CONCURRENCY", "16"))
+
+# Booking outcomes that say nothing about the slot itself, so a freed slot whose booking
+# ended in one is tried again on the next poll while the sheet still shows it free
+RETRY_OUTCOMES = (brs_responses.Outcome.ERROR, brs_responses.Outcome.RATE_LIMITED,
+                  brs_responses.Outcome.SESSION_EXPIRED)
+
+# One tee sheet row, as split out of the page without parsing it
+ROW_PATTERN = re.compile(r'<tr\b[^>]*\bbg-white\b[^>]*>.*?</tr>', re.IGNORECASE | re.DOTALL)
+
+
+def digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+class SheetSnapshot:
+    """The last seen state of one course's tee sheet, kept up to date by diffing rows
+
+    Each poll splits the page into rows with a regex and hashes them. Only rows whose
+    hash wasn't on the previous page are parsed, so an unchanged sheet costs a hash of
+    the page and a sheet with one cancellation costs one row's parse.
+    """
+
+    def __init__(self, course: str):
+        self.course = course
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.page_hash: Optional[bytes] = None
+        self.rows: Dict[bytes, Optional[tee_time_booker.TeeSheetRow]] = {}
+        self.index: Dict[str, tee_time_booker.TeeSheetRow] = {}
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def update(self, page_source: str, club: str):
+        """Apply a fetched page, returning (rows that became bookable, rows parsed)"""
+        page_hash = digest(page_source)
+        if page_hash == self.page_hash:
+            return [], 0
+        self.page_hash = page_hash
+
+        segments = ROW_PATTERN.findall(page_source)
+        if not segments:
+            # Rows built client side - rebuild them from the tee sheet data embedded in the page
+            page_source, _ = tee_time_booker.staticTeeSheet(page_source, club)
+            segments = ROW_PATTERN.findall(page_source or "")
+
+        rows, changed = {}, []
+        for segment in segments:
+            key = digest(segment)
+            if key in self.rows:
+                rows[key] = self.rows[key]
+                continue
+            row = next(iter(tee_time_booker.parseTeeSheet(f"<table>{segment}</table>", self.course).values()), None)
+            rows[key] = row
+            if row is not None:
+                changed.append(row)
+
+        previous = self.index
+        self.rows = rows
+        self.index = {row.time: row for row in rows.values() if row is not None}
+
+        freed = [row for row in changed if row.available and row.href
+                 and not (row.time in previous and previous[row.time].available)]
+        return freed, len(changed)
+
+
+@dataclass
+class WatchStats:
+    polls: int = 0
+    not_modified: int = 0
+    bytes: int = 0
+    cpu: float = 0.0
+    rows_parsed: int = 0
+    slots_freed: int = 0
+    booked: int = 0
+
+    def summary(self):
+        polls = max(self.polls, 1)
+        return (f"{self.polls} polls ({self.not_modified} not modified), "
+                f"{self.bytes / polls / 1024:.1f}KB and {self.cpu / polls * 1000:.2f}ms CPU per poll, "
+                f"{self.rows_parsed} rows parsed, {self.slots_freed} slots freed, {self.booked} booked")
+
+
+class WatchedSheet:
+    """Unfilled bookings for one club and date, and the sheets of every course they'll play"""
+
+    def __init__(self, club: str, tee_date: str):
+        self.club = club
+        self.tee_date = tee_date
+        self.bookings: Dict[int, dict] = {}
+        self.snapshots: Dict[str, SheetSnapshot] = {}
+        # Freed rows by href that a booking wants but couldn't book yet
+        self.pending: Dict[str, tee_time_booker.TeeSheetRow] = {}
+        self.interval = WATCH_MIN_INTERVAL
+        self.task: Optional[asyncio.Task] = None
+
+    def courses(self) -> List[str]:
+        courses = [course for booking in self.bookings.values() for course in Booking.booking_courses(booking)]
+        return list(dict.fromkeys(courses))
+
+    def still_free(self, rows) -> List[tee_time_booker.TeeSheetRow]:
+        """The current rows for the given ones, where the last poll still showed them bookable"""
+        current = (self.snapshots[row.course].index.get(row.time) for row in rows if row.course in self.snapshots)
+        return [row for row in current if row is not None and row.available and row.href]
+
+    def next_interval(self, changed: bool, throttled: bool) -> float:
+        if throttled:
+            self.interval = min(self.interval * 2, WATCH_MAX_INTERVAL)
+        elif changed:
+            self.interval = WATCH_MIN_INTERVAL
+        else:
+            self.interval = min(self.interval * WATCH_BACKOFF, WATCH_MAX_INTERVAL)
+        return self.interval * (1 + random.uniform(-WATCH_JITTER, WATCH_JITTER))
+
+
+class CancellationWatcher:
+    """Books unfilled bookings when their tee times are freed by cancellations
+
+    Bookings whose release burst failed are read from the job queue. Each (club, date)
+    they need gets a task that polls its courses' tee sheets with conditional requests
+    on an adaptive interval, diffs the rows against the last poll and, when a slot the
+    bookings would take becomes bookable, books it straight away on sessions that are
+    kept logged in. A booking made this way marks its job succeeded. A freed slot whose
+    booking fails for a passing reason (an error, rate limiting, an expired session) is
+    tried again on every poll until it's booked or the sheet shows it taken.
+
+    Runs on one event loop on a shared connection pool, so hundreds of sheets can be
+    watched from one process. Run one watcher per database: two would both try to book
+    the same freed slot.
+    """
+
+    def __init__(self, concurrency: int = WATCH_CONCURRENCY):
+        self.sheets: Dict[tuple, WatchedSheet] = {}
+        self.sessions: Dict[tuple, asyncio.Future] = {}
+        self.stats = WatchStats()
+        self.limit = asyncio.Semaphore(concurrency)
+        self.pool: Optional[brs_client.ConnectionPool] = None
+
+    def unfilled_bookings(self) -> List[dict]:
+        """Failed bookings whose tee date hasn't passed"""
+        today = date.today().strftime(release_rules.DATE_FORMAT)
+        bookings = Booking.QUEUE.unfilled(release_rules.earliest_release_at(date.today()), int(time_module.time()) + 1)
+        return [booking for booking in bookings if booking["date"] >= today]
+
+    def session(self, booking) -> asyncio.Future:
+        """The logged-in session for the booking's account, as a future shared by all its bookings
+
+        Logging in starts as soon as a booking is watched, so a freed slot is booked on a
+        session that's ready. Sessions that expire later are logged in again by fireSlots.
+        """
+        key = (booking["username"], booking["club"])
+        session = self.sessions.get(key)
+        if session is None or (session.done() and (session.cancelled() or session.exception() is not None)):
+            session = self.sessions[key] = asyncio.ensure_future(async_booker.prepare(
+                self.pool.session(), booking["username"], Booking.VAULT.password(booking["username"]), booking["club"]))
+        return session
+
+    async def refresh(self):
+        """Start watching new unfilled bookings and stop on filled, deleted or past ones"""
+        bookings = {booking["id"]: booking for booking in self.unfilled_bookings()}
+
+        for sheet in self.sheets.values():
+            for booking_id in [booking_id for booking_id in sheet.bookings if booking_id not in bookings]:
+                del sheet.bookings[booking_id]
+
+        for booking_id, booking in bookings.items():
+            sheet = self.sheets.setdefault((booking["club"], booking["date"]),
+                                           WatchedSheet(booking["club"], booking["date"]))
+            if booking_id not in sheet.bookings:
+                sheet.bookings[booking_id] = Booking.plan_booking(booking)
+                self.session(booking)
+
+        for key, sheet in list(self.sheets.items()):
+            if not sheet.bookings:
+                if sheet.task:
+                    sheet.task.cancel()
+                del self.sheets[key]
+            elif sheet.task is None:
+                sheet.task = asyncio.ensure_future(self.watch(sheet))
+
+        logger.info(f"Watching {sum(len(sheet.bookings) for sheet in self.sheets.values())} unfilled bookings "
+                    f"on {len(self.sheets)} tee sheets")
+
+    async def poll_course(self, sheet: WatchedSheet, course: str, prepared):
+        """Fetch one course's sheet if it changed, returning (rows that became bookable, throttled)"""
+        snapshot = sheet.snapshots.setdefault(course, SheetSnapshot(course))
+        url = tee_time_booker.teeSheetURL(sheet.club, sheet.tee_date, course)
+
+        try:
+            async with self.limit:
+                response = await brs_client.request(prepared.session, "GET", url,
+                                                    headers=snapshot.conditional_headers())
+        except brs_client.RequestError as e:
+            logger.warning(f"Could not poll {url}: {e}")
+            return [], True
+
+        self.stats.polls += 1
+        self.stats.bytes += len(response.content)
+        if response.status_code == 304:
+            self.stats.not_modified += 1
+            return [], False
+
+        outcome = brs_responses.classify(response)
+        if outcome is brs_responses.Outcome.SESSION_EXPIRED:
+            logger.info(f"Session for {prepared.username} expired while watching, logging in again")
+            await async_booker.login(prepared)
+            return [], False
+        if outcome is brs_responses.Outcome.RATE_LIMITED or response.status_code >= 400:
+            logger.warning(f"Polling {url} returned {response.status_code}, backing off")
+            return [], True
+
+        snapshot.etag = response.headers.get("ETag")
+        snapshot.last_modified = response.headers.get("Last-Modified")
+
+        start = time_module.thread_time()
+        with metrics.span("watchDiff"):
+            freed, parsed = snapshot.update(response.text, sheet.club)
+        self.stats.cpu += time_module.thread_time() - start
+        self.stats.rows_parsed += parsed
+        self.stats.slots_freed += len(freed)
+        return freed, False
+
+    async def poll(self, sheet: WatchedSheet):
+        """Poll every course of a sheet at once, returning (whether it changed, throttled)"""
+        booking = next(iter(sheet.bookings.values()))
+        prepared = await self.session(booking)
+        results = await asyncio.gather(*(self.poll_course(sheet, course, prepared) for course in sheet.courses()))
+
+        freed = [row for rows, _ in results for row in rows]
+        freed_hrefs = {row.href for row in freed}
+        retry = [row for row in sheet.still_free(sheet.pending.values()) if row.href not in freed_hrefs]
+        sheet.pending = {}
+        if freed or retry:
+            await self.book(sheet, freed, retry)
+        # Slots still waiting to be booked count as a change, so they're retried soon
+        return bool(freed or sheet.pending), any(throttled for _, throttled in results)
+
+    async def book(self, sheet: WatchedSheet, freed, retry=()):
+        """Give the freed slots out to the sheet's bookings and book them all at once
+
+        retry are slots freed on an earlier poll whose booking failed for a passing
+        reason. The slots of any booking that fails that way again are kept in
+        sheet.pending for the next poll.
+        """
+        rows = list(freed) + list(retry)
+        freed_index = tee_time_booker.mergeTeeSheets({row.time: row} for row in rows)
+        allocation = slot_allocation.allocate_slots(list(sheet.bookings.values()), freed_index,
+                                                    Booking.booking_preferences, tee_time_booker.MAX_CANDIDATES,
+                                                    Booking.booking_courses)
+        if freed:
+            logger.info(f"{len(freed)} slots freed on {sheet.club} {sheet.tee_date}: "
+                        f"{', '.join(f'{row.time} (course {row.course})' for row in freed)}")
+        if retry:
+            logger.info(f"Retrying {len(retry)} freed slots on {sheet.club} {sheet.tee_date}: "
+                        f"{', '.join(f'{row.time} (course {row.course})' for row in retry)}")
+
+        allocated = [(booking_id, slots) for booking_id, slots in allocation.items() if slots]
+        outcomes = await asyncio.gather(*(self.book_booking(sheet, sheet.bookings[booking_id], slots)
+                                          for booking_id, slots in allocated))
+
+        for (_, slots), outcome in zip(allocated, outcomes):
+            if outcome in RETRY_OUTCOMES:
+                sheet.pending.update((slot.href, slot) for slot in slots)
+
+    async def book_booking(self, sheet: WatchedSheet, booking, slots):
+        """Book one of slots for the booking, returning the outcome"""
+        record = metrics.RunRecord(booking["id"], booking["club"])
+        try:
+            with metrics.bind(record), metrics.span("watchBook"):
+                prepared = await self.session(booking)
+                response = await async_booker.fireSlots(prepared, slots, *booking["players"].split(","))
+            outcome = brs_responses.classify(response)
+        except Exception as e:
+            logger.error(f"Error booking freed slot for booking {booking['id']}: {e}")
+            return brs_responses.Outcome.ERROR
+        finally:
+            metrics.write_run_record(record)
+
+        logger.info(f"Freed slot for booking {booking['id']} ({booking['username']}): {outcome.name}")
+        if outcome is brs_responses.Outcome.SUCCESS:
+            self.stats.booked += 1
+            Booking.QUEUE.fill(booking["id"], outcome.value)
+            sheet.bookings.pop(booking["id"], None)
+        return outcome
+
+    async def watch(self, sheet: WatchedSheet):
+        # First poll straight away, a slot may already be free
+        delay = random.uniform(0, WATCH_JITTER * WATCH_MIN_INTERVAL)
+        while True:
+            await asyncio.sleep(delay)
+            if not sheet.bookings:
+                return
+            try:
+                changed, throttled = await self.poll(sheet)
+            except Exception as e:
+                logger.error(f"Error watching {sheet.club} {sheet.tee_date}: {e}")
+                changed, throttled = False, True
+            delay = sheet.next_interval(changed, throttled)
+
+    async def run(self, duration: Optional[float] = None):
+        """Watch until cancelled, or for duration seconds"""
+        deadline = time_module.monotonic() + duration if duration is not None else None
+        async with brs_client.ConnectionPool() as self.pool:
+            try:
+                while deadline is None or time_module.monotonic() < deadline:
+                    await self.refresh()
+                    wait = WATCH_REFRESH_SECONDS
+                    if deadline is not None:
+                        wait = min(wait, deadline - time_module.monotonic())
+                    await asyncio.sleep(max(wait, 0))
+                    logger.info(f"Cancellation watcher: {self.stats.summary()}")
+            finally:
+                tasks = [sheet.task for sheet in self.sheets.values() if sheet.task] + list(self.sessions.values())
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return self.stats
+
+
+def main(duration: Optional[float] = None):
+    """Run the cancellation watcher on its own event loop"""
+    logger.info(f"Cancellation watcher started at {datetime.now()}")
+    try:
+        return asyncio.run(CancellationWatcher().run(duration))
+    finally:
+        Booking.VAULT.forget()
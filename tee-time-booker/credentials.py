@@ -0,0 +1,141 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional
+
+import rsa
+
+logger = logging.getLogger(__name__)
+
+# Key-encryption key shared by every stored credential. Generated once on first use
+# and kept outside the database, so a copy of database.db alone can't be decrypted.
+KEY_PATH = os.getenv("VAULT_KEY_PATH", "vault.key")
+KEY_BITS = 2048
+
+
+class CredentialVault:
+    """Encrypted BRS passwords, stored once per account
+
+    Passwords are encrypted with a single persisted key when they're saved, which only
+    needs the public half and is cheap. Decryption is done in bulk by unlock() during
+    the pre-open phase; the plaintext is held in memory until forget() after firing.
+    """
+
+    def __init__(self, database, key_path: str = KEY_PATH):
+        self.db = database
+        self.key_path = key_path
+        self._keys = None
+        self._lock = threading.Lock()
+        self._unlocked: Dict[str, str] = {}
+        self._migrate_legacy_bookings()
+
+    def _load_keys(self):
+        with self._lock:
+            if self._keys is None:
+                private_key = self._read_key() if os.path.exists(self.key_path) else self._create_key()
+                # Password digests are keyed off the private key, so they can't be checked
+                # against guesses without the key file either
+                mac_key = hashlib.sha256(private_key.save_pkcs1()).digest()
+                self._keys = (rsa.PublicKey(private_key.n, private_key.e), private_key, mac_key)
+            return self._keys
+
+    def _read_key(self):
+        with open(self.key_path, "rb") as f:
+            return rsa.PrivateKey.load_pkcs1(f.read())
+
+    def _create_key(self):
+        """Generate and save the key, or load the one another process saved first"""
+        logger.info(f"Generating credential key at {self.key_path}")
+        _, private_key = rsa.newkeys(KEY_BITS)
+
+        # Written in full under a temporary name and then linked into place, so a process
+        # racing this one never reads half a key
+        temp_path = f"{self.key_path}.{os.getpid()}.tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(private_key.save_pkcs1())
+            os.link(temp_path, self.key_path)
+        except FileExistsError:
+            logger.info(f"Credential key at {self.key_path} was created by another process, using it")
+            private_key = self._read_key()
+        finally:
+            os.unlink(temp_path)
+
+        return private_key
+
+    def _digest(self, username: str, password: str) -> str:
+        _, _, mac_key = self._load_keys()
+        return hmac.new(mac_key, f"{username}\0{password}".encode(), hashlib.sha256).hexdigest()
+
+    def store(self, username: str, password: str):
+        """Encrypt and save an account's password, skipping the write if the stored one matches"""
+        digest = self._digest(username, password)
+        # Checked against the database rather than a cache, as another process may have
+        # saved a different password since
+        rows = self.db.execute_query("SELECT digest FROM credentials WHERE username = ?", (username,))
+        if rows and rows[0]["digest"] and hmac.compare_digest(rows[0]["digest"], digest):
+            return
+
+        public_key, _, _ = self._load_keys()
+        self.db.execute_update(
+            "INSERT INTO credentials (username, password, digest) VALUES (?, ?, ?) "
+            "ON CONFLICT(username) DO UPDATE SET password = excluded.password, digest = excluded.digest",
+            (username, rsa.encrypt(password.encode(), public_key).hex(), digest))
+
+        # Keep an unlocked copy in step with the new password
+        if username in self._unlocked:
+            self._unlocked[username] = password
+
+    def unlock(self, usernames: Iterable[str]):
+        """Decrypt the given accounts' passwords ahead of time"""
+        usernames = [username for username in set(usernames) if username not in self._unlocked]
+        if not usernames:
+            return
+
+        _, private_key, _ = self._load_keys()
+        placeholders = ",".join("?" * len(usernames))
+        rows = self.db.execute_query(
+            f"SELECT username, password FROM credentials WHERE username IN ({placeholders})", tuple(usernames))
+        for row in rows:
+            self._unlocked[row["username"]] = rsa.decrypt(bytes.fromhex(row["password"]), private_key).decode()
+
+        missing = set(usernames) - set(self._unlocked)
+        if missing:
+            logger.warning(f"No stored credentials for {', '.join(sorted(missing))}")
+
+    def password(self, username: str) -> Optional[str]:
+        """Return an account's password, decrypting it now if it wasn't unlocked"""
+        if username not in self._unlocked:
+            self.unlock([username])
+        return self._unlocked.get(username)
+
+    def forget(self):
+        """Drop every decrypted password from memory"""
+        self._unlocked.clear()
+
+    def _migrate_legacy_bookings(self):
+        """Move per-booking passwords and private keys into the vault and drop their columns"""
+        with self.db.get_connection() as conn:
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(bookings)")]
+            if "private_key" not in columns:
+                return
+
+            rows = conn.execute("SELECT id, username, password, private_key FROM bookings ORDER BY id").fetchall()
+
+        logger.info(f"Migrating {len(rows)} booking passwords into the credential vault")
+        for row in rows:
+            try:
+                password = rsa.decrypt(bytes.fromhex(row["password"]),
+                                       rsa.PrivateKey.load_pkcs1(row["private_key"].encode())).decode()
+                # Latest booking wins if an account's password changed between bookings
+                self.store(row["username"], password)
+            except (ValueError, rsa.DecryptionError) as e:
+                logger.error(f"Could not migrate the password for booking {row['id']}: {e}")
+
+        with self.db.get_connection() as conn:
+            conn.execute("ALTER TABLE bookings DROP COLUMN password")
+            conn.execute("ALTER TABLE bookings DROP COLUMN private_key")
+            conn.commit()
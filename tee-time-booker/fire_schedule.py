@@ -0,0 +1,107 @@
+import heapq
+import threading
+import time as time_module
+from typing import Dict, Iterable, Optional, Set
+
+
+class FireSchedule:
+    """Min-heap of the release instants the scheduler has to fire at
+
+    Each instant keeps the ids of the bookings that release at it, so a booking can be
+    added or removed without rebuilding the heap. Removing the last booking of an
+    instant leaves a stale heap entry, which is dropped when it reaches the top.
+
+    Safe to share between threads: the web UI adds and removes bookings while the
+    scheduler thread sleeps in wait_for_next(), and any change wakes it to look at the
+    heap again, so a booking added for an earlier instant is never waited past.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._instants: Dict[int, Set[int]] = {}
+        self._release_at: Dict[int, int] = {}
+        self._changed = threading.Condition()
+
+    def __len__(self):
+        with self._changed:
+            return len(self._instants)
+
+    def load(self, bookings: Iterable[dict]):
+        """Replace the schedule with bookings (rows with id and release_at)"""
+        with self._changed:
+            self._instants.clear()
+            self._release_at.clear()
+            for booking in bookings:
+                self._add(booking["id"], booking["release_at"])
+            self._heap = list(self._instants)
+            heapq.heapify(self._heap)
+            self._changed.notify_all()
+
+    def _add(self, booking_id, release_at):
+        self._remove(booking_id)
+        self._release_at[booking_id] = release_at
+        bookings = self._instants.setdefault(release_at, set())
+        bookings.add(booking_id)
+        return len(bookings) == 1
+
+    def _remove(self, booking_id):
+        release_at = self._release_at.pop(booking_id, None)
+        bookings = self._instants.get(release_at)
+        if bookings is not None:
+            bookings.discard(booking_id)
+            if not bookings:
+                del self._instants[release_at]
+
+    def add(self, booking_id: int, release_at: int):
+        """Schedule a booking, or move it to a new release instant"""
+        with self._changed:
+            if self._add(booking_id, release_at):
+                heapq.heappush(self._heap, release_at)
+            self._changed.notify_all()
+
+    def remove(self, booking_id: int):
+        """Unschedule a booking, e.g. when it's deleted"""
+        with self._changed:
+            self._remove(booking_id)
+            self._changed.notify_all()
+
+    def _peek(self) -> Optional[int]:
+        # Drop instants that were fired or lost their last booking
+        while self._heap and self._heap[0] not in self._instants:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def next(self) -> Optional[int]:
+        """The earliest release instant with bookings, or None"""
+        with self._changed:
+            return self._peek()
+
+    def pop(self, release_at: int) -> Set[int]:
+        """Take an instant off the schedule once it's been fired, returning its bookings"""
+        with self._changed:
+            bookings = self._instants.pop(release_at, set())
+            for booking_id in bookings:
+                del self._release_at[booking_id]
+            return bookings
+
+    def wait_for_next(self, lead: float, timeout: float) -> Optional[int]:
+        """Sleep until lead seconds before the earliest instant, returning that instant
+
+        Returns None if timeout seconds pass first. Any change to the schedule wakes the
+        wait to re-check the earliest instant, so nothing has to poll.
+        """
+        deadline = time_module.time() + timeout
+        with self._changed:
+            while True:
+                release_at = self._peek()
+                now = time_module.time()
+                if release_at is not None and now >= release_at - lead:
+                    return release_at
+                if now >= deadline:
+                    return None
+                wake = deadline if release_at is None else min(deadline, release_at - lead)
+                self._changed.wait(wake - now)
+
+
+# The schedule of this process, kept up to date by the web UI when the scheduler runs with it
+FIRES = FireSchedule()
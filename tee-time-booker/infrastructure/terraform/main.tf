@@ -4,7 +4,7 @@ resource "aws_lambda_function" "brs_booking_lambda" {
   function_name = "lambda-TeeBooker-${var.environment}-${var.short_region}"
   role          = aws_iam_role.lambda_exec.arn
   handler       = "tee_time_booker.lambda_handler"
-  runtime       = "python3.8"
+  runtime       = "python3.11"
   timeout       = 60
 
   environment {
@@ -0,0 +1,170 @@
+import logging
+import os
+import socket
+import threading
+import time as time_module
+from contextlib import contextmanager
+from enum import Enum
+from typing import Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed job stays with its worker without a renewal. Renewed every third of
+# this while the worker is alive, so it only runs out when the worker has died.
+LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+# Claims per job before it's given up, counting claims by workers that then died
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Jobs a worker claims at a time. Smaller batches spread the release burst over more
+# workers, larger ones let more bookings for the same sheet share a fetch. A worker only
+# claims its next batch once the last one is done, so anything past the first batch
+# fires late unless another worker takes it.
+BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "50"))
+
+
+class JobState(Enum):
+    QUEUED = "queued"
+    LEASED = "leased"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+def worker_id():
+    """Identifies this process among workers on every machine sharing the database"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """Durable queue of booking jobs in the bookings database
+
+    Every due booking gets one job. Workers claim a batch of queued jobs in a single
+    UPDATE, so two workers can never claim the same job, and hold them on a lease that
+    they keep renewing. A worker that dies stops renewing, its leases expire and its
+    jobs are claimed again by another worker, up to MAX_ATTEMPTS claims in all. That is
+    usually after the release's other jobs are done, so schedulers look for expired
+    leases between releases (see expired()).
+
+    Workers in other processes or on other machines only need the same database file;
+    SQLite's locking has to be reliable on whatever filesystem holds it.
+    """
+
+    def __init__(self, database):
+        self.db = database
+
+    def enqueue(self, bookings: Iterable[dict]) -> int:
+        """Add a job for each booking that doesn't have one yet, returning how many were added"""
+        with self.db.get_connection() as conn:
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO jobs (booking_id, release_at, updated_at) VALUES (?, ?, ?)",
+                [(booking["id"], booking["release_at"], time_module.time()) for booking in bookings])
+            conn.commit()
+            return cursor.rowcount
+
+    def claim(self, owner: str, release_from: int, release_to: int, limit: int = BATCH_SIZE) -> List[int]:
+        """Atomically lease up to limit claimable jobs releasing in [release_from, release_to)
+
+        Claimable means queued, or leased to a worker whose lease has run out. Returns
+        the claimed booking ids, ordered so bookings for the same club and date stay in
+        the same batch where possible.
+        """
+        now = time_module.time()
+        with self.db.get_connection() as conn:
+            # Jobs whose last worker died on their final attempt
+            expired = conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (JobState.FAILED.value, "Lease expired on the final attempt", now,
+                 JobState.LEASED.value, now, MAX_ATTEMPTS)).rowcount
+            if expired:
+                logger.warning(f"Gave up on {expired} jobs after {MAX_ATTEMPTS} attempts")
+
+            rows = conn.execute(
+                "UPDATE jobs SET state = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE booking_id IN ("
+                "    SELECT jobs.booking_id FROM jobs JOIN bookings ON bookings.id = jobs.booking_id"
+                "    WHERE jobs.release_at >= ? AND jobs.release_at < ?"
+                "      AND (jobs.state = ? OR (jobs.state = ? AND jobs.lease_expires < ?))"
+                "    ORDER BY jobs.release_at, bookings.club, bookings.date, jobs.booking_id LIMIT ?) "
+                "RETURNING booking_id, attempts",
+                (JobState.LEASED.value, owner, now + LEASE_SECONDS, now,
+                 release_from, release_to, JobState.QUEUED.value, JobState.LEASED.value, now, limit)).fetchall()
+            conn.commit()
+
+        for row in rows:
+            if row["attempts"] > 1:
+                logger.info(f"Reclaimed booking {row['booking_id']} from an expired lease (attempt {row['attempts']})")
+
+        return sorted(row["booking_id"] for row in rows)
+
+    def renew(self, owner: str, booking_ids: Iterable[int]) -> int:
+        """Extend this worker's leases, returning how many it still holds"""
+        booking_ids = list(booking_ids)
+        if not booking_ids:
+            return 0
+        placeholders = ",".join("?" * len(booking_ids))
+        return self.db.execute_update(
+            f"UPDATE jobs SET lease_expires = ?, updated_at = ? "
+            f"WHERE lease_owner = ? AND state = ? AND booking_id IN ({placeholders})",
+            (time_module.time() + LEASE_SECONDS, time_module.time(), owner, JobState.LEASED.value, *booking_ids))
+
+    def complete(self, owner: str, booking_id: int, success: bool, outcome=None, error=None) -> bool:
+        """Record a job's result, unless its lease has already passed to another worker"""
+        state = JobState.SUCCEEDED if success else JobState.FAILED
+        updated = self.db.execute_update(
+            "UPDATE jobs SET state = ?, outcome = ?, error = ?, lease_expires = NULL, updated_at = ? "
+            "WHERE booking_id = ? AND lease_owner = ? AND state = ?",
+            (state.value, outcome, error, time_module.time(), booking_id, owner, JobState.LEASED.value))
+        if not updated:
+            logger.warning(f"Lost the lease on booking {booking_id} before recording its result")
+        return bool(updated)
+
+    def expired(self, released_from: int, released_to: int) -> List[int]:
+        """Release instants in [released_from, released_to) with jobs whose lease has run out"""
+        rows = self.db.execute_query(
+            "SELECT DISTINCT release_at FROM jobs "
+            "WHERE state = ? AND release_at >= ? AND release_at < ? AND lease_expires < ? ORDER BY release_at",
+            (JobState.LEASED.value, released_from, released_to, time_module.time()))
+        return [row["release_at"] for row in rows]
+
+    def unfilled(self, released_from: int, released_to: int) -> List[dict]:
+        """Bookings whose job failed, released in [released_from, released_to)"""
+        return self.db.execute_query(
+            "SELECT bookings.* FROM jobs JOIN bookings ON bookings.id = jobs.booking_id "
+            "WHERE jobs.state = ? AND jobs.release_at >= ? AND jobs.release_at < ? ORDER BY bookings.id",
+            (JobState.FAILED.value, released_from, released_to))
+
+    def fill(self, booking_id: int, outcome=None) -> bool:
+        """Mark a failed job as succeeded after its booking was made later, e.g. on a cancellation"""
+        updated = self.db.execute_update(
+            "UPDATE jobs SET state = ?, outcome = ?, error = NULL, updated_at = ? WHERE booking_id = ? AND state = ?",
+            (JobState.SUCCEEDED.value, outcome, time_module.time(), booking_id, JobState.FAILED.value))
+        return bool(updated)
+
+    def purge(self, before: int) -> int:
+        """Delete jobs releasing before the given instant"""
+        return self.db.execute_update("DELETE FROM jobs WHERE release_at < ?", (before,))
+
+    @contextmanager
+    def leased(self, owner: str, booking_ids: Iterable[int]):
+        """Keep renewing the leases on booking_ids until the block exits"""
+        booking_ids = list(booking_ids)
+        stop = threading.Event()
+
+        def heartbeat():
+            try:
+                while not stop.wait(LEASE_SECONDS / 3):
+                    try:
+                        self.renew(owner, booking_ids)
+                    except Exception as e:
+                        logger.error(f"Could not renew job leases: {e}")
+            finally:
+                self.db.close()
+
+        thread = threading.Thread(target=heartbeat, daemon=True, name="JobLeases")
+        thread.start()
+        try:
+            yield booking_ids
+        finally:
+            stop.set()
+            thread.join()
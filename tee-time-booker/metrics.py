@@ -0,0 +1,162 @@
+import contextvars
+import inspect
+import json
+import logging
+import os
+import threading
+import time as time_module
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import wraps
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Each booking run appends one JSON line with all of its spans to this file
+TIMINGS_PATH = os.getenv("TIMINGS_PATH", "timings.jsonl")
+
+# Durations kept per stage for the quantiles on /metrics
+RECENT_SAMPLES = 1000
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+@dataclass
+class Span:
+    stage: str
+    start: float
+    duration: float
+    error: Optional[str] = None
+
+
+@dataclass
+class RunRecord:
+    """Timing record for one booking run, shared by the prepare and fire phases"""
+    booking_id: Optional[int] = None
+    club: Optional[str] = None
+    started_at: datetime = field(default_factory=datetime.now)
+    origin: float = field(default_factory=time_module.monotonic)
+    spans: List[Span] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def to_dict(self):
+        return {
+            "booking_id": self.booking_id,
+            "club": self.club,
+            "started_at": self.started_at.isoformat(),
+            "spans": [span.__dict__ for span in self.spans],
+        }
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def quantile(self, q):
+        samples = sorted(self.recent)
+        return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0.0
+
+
+class MetricsRegistry:
+    """In-process aggregate of span durations by (stage, club)"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, club, duration, error=False):
+        with self._lock:
+            stats = self._stats.setdefault((stage, club or ""), StageStats())
+            stats.count += 1
+            stats.errors += bool(error)
+            stats.total += duration
+            stats.recent.append(duration)
+
+    def prometheus(self):
+        """Render the aggregates in the Prometheus text format"""
+        lines = [
+            "# HELP booking_stage_seconds Duration of booking hot path stages",
+            "# TYPE booking_stage_seconds summary",
+        ]
+        errors = ["# HELP booking_stage_errors_total Booking stages that raised",
+                  "# TYPE booking_stage_errors_total counter"]
+
+        with self._lock:
+            for (stage, club), stats in sorted(self._stats.items()):
+                labels = f'stage="{stage}",club="{club}"'
+                for q in QUANTILES:
+                    lines.append(f'booking_stage_seconds{{{labels},quantile="{q}"}} {stats.quantile(q):.6f}')
+                lines.append(f"booking_stage_seconds_sum{{{labels}}} {stats.total:.6f}")
+                lines.append(f"booking_stage_seconds_count{{{labels}}} {stats.count}")
+                errors.append(f"booking_stage_errors_total{{{labels}}} {stats.errors}")
+
+        return "\n".join(lines + errors) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+_current_run = contextvars.ContextVar("current_run", default=None)
+
+
+@contextmanager
+def bind(record):
+    """Attach spans recorded in this context (and contexts copied from it) to record"""
+    token = _current_run.set(record)
+    try:
+        yield record
+    finally:
+        _current_run.reset(token)
+
+
+@contextmanager
+def span(stage):
+    """Time a stage on the monotonic clock, labelled with the current run's booking and club"""
+    start = time_module.monotonic()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record(stage, start, time_module.monotonic() - start, error)
+
+
+def record(stage, start, duration, error=None):
+    """Record a stage timed elsewhere, e.g. inside a library callback, as span() would"""
+    run = _current_run.get()
+    REGISTRY.record(stage, run.club if run else None, duration, error is not None)
+    if run is not None:
+        with run.lock:
+            run.spans.append(Span(stage, start - run.origin, duration, error))
+
+
+def timed(stage):
+    """Decorator form of span(), for plain and async functions"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_run_record(record, path=None):
+    """Append a run's spans to the timings file"""
+    try:
+        with open(path or TIMINGS_PATH, "a") as f:
+            f.write(json.dumps(record.to_dict()) + "\n")
+    except OSError as e:
+        logger.warning(f"Could not write timing record: {e}")
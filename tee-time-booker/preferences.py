@@ -0,0 +1,115 @@
+import json
+import re
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+TIME_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+COURSE_PATTERN = re.compile(r'^\d+$')
+
+
+@dataclass
+class TimeWindow:
+    """A preferred tee time, optionally widened to anything between earliest and latest"""
+    time: str
+    earliest: Optional[str] = None
+    latest: Optional[str] = None
+
+    def label(self):
+        if self.earliest or self.latest:
+            return f"{self.time} ({self.earliest or self.time}–{self.latest or self.time})"
+        return self.time
+
+
+def parse_time(value) -> Optional[str]:
+    """Normalise "7:05" to "07:05", returning None for anything that isn't a time"""
+    match = TIME_PATTERN.match((value or "").strip())
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        return None
+    return f"{int(match.group(1)):02d}:{match.group(2)}"
+
+
+def to_minutes(value):
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def from_minutes(value):
+    return f"{value // 60:02d}:{value % 60:02d}"
+
+
+def windows_from_form(times, earliest, latest) -> List[TimeWindow]:
+    """Build ranked windows from parallel form lists, raising ValueError on bad input"""
+    windows = []
+    for i, raw_time in enumerate(times):
+        if not (raw_time or "").strip():
+            continue
+        tee_time = parse_time(raw_time)
+        if tee_time is None:
+            raise ValueError(f"Invalid time: {raw_time}")
+
+        bounds = []
+        for values in (earliest, latest):
+            raw = values[i] if i < len(values) else ""
+            bound = parse_time(raw) if (raw or "").strip() else None
+            if (raw or "").strip() and bound is None:
+                raise ValueError(f"Invalid time: {raw}")
+            bounds.append(bound)
+
+        window = TimeWindow(tee_time, *bounds)
+        if to_minutes(window.earliest or tee_time) > to_minutes(tee_time) or \
+                to_minutes(window.latest or tee_time) < to_minutes(tee_time):
+            raise ValueError(f"{tee_time} must be between its earliest and latest times")
+        windows.append(window)
+
+    return windows
+
+
+def courses_from_form(value) -> List[str]:
+    """Parse a comma separated list of course numbers, best first, raising ValueError on bad input"""
+    courses = []
+    for course in (value or "").split(","):
+        course = course.strip()
+        if not course:
+            continue
+        if not COURSE_PATTERN.match(course) or int(course) < 1:
+            raise ValueError(f"Invalid course: {course}")
+        if str(int(course)) not in courses:
+            courses.append(str(int(course)))
+    return courses or ["1"]
+
+
+def windows_to_json(windows: List[TimeWindow]) -> str:
+    return json.dumps([asdict(window) for window in windows])
+
+
+def windows_from_booking(booking) -> List[TimeWindow]:
+    """A booking's ranked windows, falling back to its single time for older rows"""
+    if booking.get("time_windows"):
+        return [TimeWindow(**window) for window in json.loads(booking["time_windows"])]
+    return [TimeWindow(booking["time"])]
+
+
+def candidate_plan(windows: List[TimeWindow]) -> List[str]:
+    """Expand ranked windows into every acceptable tee time, best first
+
+    Each window contributes its preferred time, then the rest of its range ordered by
+    distance from the preferred time (earlier first on a tie), minute by minute so it
+    works whatever the club's tee interval is. At fire time the plan is walked in order
+    against the parsed sheet, so no ranking is left to do in the release window.
+    """
+    plan = []
+    seen = set()
+
+    for window in windows:
+        preferred = to_minutes(window.time)
+        earliest = to_minutes(window.earliest or window.time)
+        latest = to_minutes(window.latest or window.time)
+
+        for minutes in sorted(range(earliest, latest + 1), key=lambda m: (abs(m - preferred), m)):
+            tee_time = from_minutes(minutes)
+            if tee_time not in seen:
+                seen.add(tee_time)
+                plan.append(tee_time)
+
+    return plan
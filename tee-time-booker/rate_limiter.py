@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time as time_module
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requests per second each BRS host is sent to start with, and the bucket size that
+# lets a burst (e.g. every account's booking POST at the release) go out at once.
+# BRS_RATE_LIMIT=0 turns the limiter off.
+RATE_LIMIT = float(os.getenv("BRS_RATE_LIMIT", "50"))
+BURST = float(os.getenv("BRS_RATE_BURST", "50"))
+
+# The rate climbs towards BRS_RATE_LIMIT_MAX while the host answers normally, by about
+# one request per second for every second at full use, and halves (down to
+# MIN_RATE) on a 429 or 5xx. The burst halves with it and grows back to BRS_RATE_BURST
+# over BRS_RATE_BURST_RECOVERY seconds without a 429 or 5xx: slowly enough that a burst
+# the host turned away isn't tried again at the same release, but the limiter, which
+# lives as long as the process, is back to full strength by the next one.
+MAX_RATE = float(os.getenv("BRS_RATE_LIMIT_MAX", "200"))
+BURST_RECOVERY_SECONDS = float(os.getenv("BRS_RATE_BURST_RECOVERY", "600"))
+MIN_RATE = 1.0
+BACKOFF_FACTOR = 0.5
+
+# Requests that waited at least this long for the budget are logged
+QUEUE_LOG_SECONDS = 0.005
+
+# Booking POSTs go out ahead of the sheet and token fetches queued for the same host,
+# and connection warm-up pings (HEAD) after everything else
+BOOKING_PRIORITY = 0
+FETCH_PRIORITY = 1
+PING_PRIORITY = 2
+
+PRIORITIES = {"POST": BOOKING_PRIORITY, "HEAD": PING_PRIORITY}
+STAGES = {BOOKING_PRIORITY: "rateLimitBooking", FETCH_PRIORITY: "rateLimitFetch", PING_PRIORITY: "rateLimitPing"}
+
+
+def priority(method: str) -> int:
+    """Queue priority of a request, lowest first"""
+    return PRIORITIES.get(method.upper(), FETCH_PRIORITY)
+
+
+def throttled(status: int) -> bool:
+    """Whether a response status means the host wants us to slow down"""
+    return status == 429 or status >= 500
+
+
+class _Ticket:
+    """A request waiting for a token, woken by set() when it may have reached the front"""
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = asyncio.Event() if loop else threading.Event()
+
+    def set(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class TokenBucket:
+    """Request budget for one host, shared by every thread and event loop in the process
+
+    Requests wait in one queue in priority order, and only the request at the front
+    takes tokens, so a booking POST never waits behind fetches queued before it.
+    Responses feed back through observe(): a 429 or 5xx halves the rate and the
+    burst and empties the bucket, normal answers grow them back, and a Retry-After pauses the host for as long as
+    it asks. Responses to requests sent before the last cut don't cut the rate
+    again, since they were already on the wire when the host pushed back.
+    """
+
+    def __init__(self, host: str, rate: float = RATE_LIMIT, burst: float = BURST,
+                 max_rate: float = MAX_RATE, min_rate: float = MIN_RATE):
+        self.host = host
+        self.rate = rate
+        self.burst = self.max_burst = max(burst, 1.0)
+        self.max_rate = max(max_rate, rate)
+        self.min_rate = min(min_rate, rate)
+        self.tokens = self.burst
+        self.paused_until = 0.0
+        self.cut_at = 0.0
+        self.throttles = 0
+        self._updated = self._observed = time_module.monotonic()
+        self._waiting = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wake_front(self):
+        if self._waiting:
+            self._waiting[0][2].set()
+
+    def _take(self, ticket) -> Optional[float]:
+        """Take a token for ticket if it's at the front, else seconds until it could (None if behind others)"""
+        if self._waiting[0][2] is not ticket:
+            return None
+
+        now = time_module.monotonic()
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+
+        self.tokens -= 1
+        heapq.heappop(self._waiting)
+        self._wake_front()
+        return 0.0
+
+    def _enqueue(self, ticket, priority):
+        with self._lock:
+            heapq.heappush(self._waiting, (priority, next(self._order), ticket))
+            # The new ticket may have gone in front of one sleeping on the next token
+            self._wake_front()
+
+    def _leave(self, ticket):
+        with self._lock:
+            for i, (_, _, waiting) in enumerate(self._waiting):
+                if waiting is ticket:
+                    self._waiting.pop(i)
+                    heapq.heapify(self._waiting)
+                    self._wake_front()
+                    return
+
+    def acquire(self, priority: int = FETCH_PRIORITY) -> float:
+        """Block until a token is free for a request of this priority, returning the seconds waited"""
+        start = time_module.monotonic()
+        ticket = _Ticket()
+        self._enqueue(ticket, priority)
+        try:
+            while True:
+                with self._lock:
+                    ticket.event.clear()
+                    wait = self._take(ticket)
+                if wait == 0:
+                    return time_module.monotonic() - start
+                ticket.event.wait(wait)
+        except BaseException:
+            self._leave(ticket)
+            raise
+
+    async def acquire_async(self, priority: int = FETCH_PRIORITY) -> float:
+        """acquire() for coroutines, waiting without blocking the event loop"""
+        start = time_module.monotonic()
+        ticket = _Ticket(asyncio.get_running_loop())
+        self._enqueue(ticket, priority)
+        try:
+            while True:
+                with self._lock:
+                    ticket.event.clear()
+                    wait = self._take(ticket)
+                if wait == 0:
+                    return time_module.monotonic() - start
+                try:
+                    await asyncio.wait_for(ticket.event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._leave(ticket)
+            raise
+
+    def observe(self, status: int, retry_after: Optional[float] = None, sent: Optional[float] = None):
+        """Adjust the rate for a response with this status to a request sent at sent (monotonic)"""
+        with self._lock:
+            now = time_module.monotonic()
+            self._refill(now)
+            since, self._observed = self._observed, now
+
+            if not throttled(status):
+                self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+                self.burst = min(self.max_burst, self.burst + (now - since) * self.max_burst / BURST_RECOVERY_SECONDS)
+                return
+
+            self.throttles += 1
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if sent is None or sent >= self.cut_at:
+                self.rate = max(self.min_rate, self.rate * BACKOFF_FACTOR)
+                self.burst = max(1.0, self.burst * BACKOFF_FACTOR)
+                self.tokens = 0.0
+                self.cut_at = now
+                logger.warning(f"{self.host} answered {status}, backing off to {self.rate:.1f} requests/s "
+                               f"(burst {self.burst:.0f})"
+                               + (f" after a {retry_after:.1f}s pause" if retry_after else ""))
+            # The front request sleeps on a wait worked out at the old rate
+            self._wake_front()
+
+
+class RateLimiter:
+    """Token buckets by host, created on first use with the module's limits"""
+
+    def __init__(self, rate: float = RATE_LIMIT, burst: float = BURST, max_rate: float = MAX_RATE):
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url: str) -> Optional[TokenBucket]:
+        """The bucket for url's host, or None when limiting is off"""
+        if self.rate <= 0:
+            return None
+        host = urlparse(url).netloc
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(host, self.rate, self.burst, self.max_rate)
+            return bucket
+
+    def acquire(self, method: str, url: str) -> float:
+        """Wait for the budget of url's host, returning when the request was let through (monotonic)"""
+        bucket = self.bucket(url)
+        if bucket is not None:
+            self._queued(method, url, bucket, bucket.acquire(priority(method)))
+        return time_module.monotonic()
+
+    async def acquire_async(self, method: str, url: str) -> float:
+        """acquire() for coroutines"""
+        bucket = self.bucket(url)
+        if bucket is not None:
+            self._queued(method, url, bucket, await bucket.acquire_async(priority(method)))
+        return time_module.monotonic()
+
+    def observe(self, url: str, status: int, retry_after: Optional[float] = None, sent: Optional[float] = None):
+        """Feed a response back to url's host's budget"""
+        bucket = self.bucket(url)
+        if bucket is not None:
+            bucket.observe(status, retry_after, sent)
+
+    def warm_connections(self, url: str, wanted: int) -> int:
+        """How many of wanted connections to url's host are worth keeping warm: no more than its burst"""
+        bucket = self.bucket(url)
+        return wanted if bucket is None else max(1, min(wanted, int(bucket.burst)))
+
+    def refill_seconds(self, url: str, tokens: float) -> float:
+        """Seconds url's host's bucket takes to earn tokens back at its current rate, 0 when limiting is off"""
+        bucket = self.bucket(url)
+        return 0.0 if bucket is None else tokens / bucket.rate
+
+    @staticmethod
+    def _queued(method, url, bucket, waited):
+        metrics.record(STAGES[priority(method)], time_module.monotonic() - waited, waited)
+        if waited >= QUEUE_LOG_SECONDS:
+            logger.info(f"{method} {urlparse(url).path} queued {waited * 1000:.1f}ms for the {bucket.host} budget "
+                        f"({bucket.rate:.1f} requests/s)")
+
+
+# The limiter shared by every BRS request in this process
+LIMITER = RateLimiter()
@@ -0,0 +1,101 @@
+import logging
+import os
+import time as time_module
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Fire this many milliseconds before the server's release instant, to cover the time
+# the first request spends on the wire
+FIRE_LEAD_SECONDS = float(os.getenv("FIRE_LEAD_MS", "0")) / 1000
+
+# The last stretch before the release instant is spin-waited on the monotonic clock
+# because sleep() can overshoot by a scheduler tick or more
+SPIN_SECONDS = 0.005
+
+# Clock samples are spaced by a non-whole number of seconds so that they land at
+# different points within the server's second and narrow the offset down
+CALIBRATION_SAMPLES = 8
+CALIBRATION_INTERVAL = 0.137
+
+
+@dataclass
+class ClockOffset:
+    """Estimated server clock minus local clock, in seconds"""
+    offset: float = 0.0
+    uncertainty: float = 0.0
+    samples: int = 0
+    rtt: float = 0.0
+
+
+def estimate_offset(session, url, samples=CALIBRATION_SAMPLES, interval=CALIBRATION_INTERVAL):
+    """Estimate the offset to the server clock from the Date headers of repeated requests
+
+    The Date header only has one second resolution, but the server stamped it at some
+    point between sending and receiving, so each sample bounds the offset to
+    [date - received, date + 1 - sent). Intersecting the bounds across samples taken at
+    different sub-second phases narrows the estimate down to roughly the request RTT.
+    """
+    lower, upper = float("-inf"), float("inf")
+    rtts = []
+    midpoints = []
+
+    for i in range(samples):
+        if i:
+            time_module.sleep(interval)
+        try:
+            sent = time_module.time()
+            response = session.head(url, allow_redirects=False)
+            received = time_module.time()
+            server_date = parsedate_to_datetime(response.headers["Date"]).timestamp()
+        except (requests.exceptions.RequestException, KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Clock sample failed for {url}: {e}")
+            continue
+
+        rtts.append(received - sent)
+        midpoints.append(server_date + 0.5 - (sent + received) / 2)
+        lower = max(lower, server_date - received)
+        upper = min(upper, server_date + 1 - sent)
+
+    if not rtts:
+        logger.warning("No clock samples, assuming the local clock matches the server")
+        return ClockOffset()
+
+    if lower <= upper:
+        clock = ClockOffset((lower + upper) / 2, (upper - lower) / 2, len(rtts), min(rtts))
+    else:
+        # Bounds don't overlap (e.g. the server clock stepped), fall back to the median midpoint
+        midpoints.sort()
+        clock = ClockOffset(midpoints[len(midpoints) // 2], 0.5, len(rtts), min(rtts))
+
+    logger.info(f"Server clock offset {clock.offset * 1000:+.1f}ms ±{clock.uncertainty * 1000:.1f}ms "
+                f"from {clock.samples} samples, min RTT {clock.rtt * 1000:.1f}ms")
+    return clock
+
+
+def wait_for_release(release_datetime, clock=None, lead=None, spin=SPIN_SECONDS):
+    """Block until the server's release instant minus lead, returning the firing error in seconds
+
+    The target is converted to the monotonic clock once, so wall clock adjustments while
+    waiting don't move it. Most of the wait is slept, the last few milliseconds are spun.
+    """
+    clock = clock or ClockOffset()
+    lead = FIRE_LEAD_SECONDS if lead is None else lead
+
+    # The release instant is on the server's clock, convert it to ours
+    target_wall = release_datetime.timestamp() - clock.offset - lead
+    deadline = time_module.monotonic() + (target_wall - time_module.time())
+
+    while True:
+        remaining = deadline - time_module.monotonic()
+        if remaining <= spin:
+            break
+        time_module.sleep(min(remaining - spin, 60))
+
+    while time_module.monotonic() < deadline:
+        pass
+
+    return time_module.monotonic() - deadline
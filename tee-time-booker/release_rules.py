@@ -0,0 +1,94 @@
+import json
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Tee sheets open at this time, BOOKING_DAYS_AHEAD days before the tee time, in
+# RELEASE_TIMEZONE (the machine's local time when unset). Clubs not in CLUB_RELEASE_RULES
+# follow this rule.
+RELEASE_TIME = time.fromisoformat(os.getenv("RELEASE_TIME", "07:30"))
+BOOKING_DAYS_AHEAD = int(os.getenv("BOOKING_DAYS_AHEAD", "8"))
+RELEASE_TIMEZONE = os.getenv("RELEASE_TIMEZONE") or None
+
+# Clubs that release on their own rule, as JSON keyed by club, e.g.
+# {"myclub": {"days_ahead": 7, "time": "19:30", "timezone": "Europe/London"}}.
+# Fields left out fall back to the default rule.
+CLUB_RELEASE_RULES = os.getenv("CLUB_RELEASE_RULES", "{}")
+
+# Booking dates are stored the way BRS uses them in tee sheet URLs
+DATE_FORMAT = "%Y/%m/%d"
+
+
+@dataclass(frozen=True)
+class ReleaseRule:
+    """When a club's tee sheets open: days_ahead days before the tee date, at release_time in timezone"""
+    days_ahead: int = BOOKING_DAYS_AHEAD
+    release_time: time = RELEASE_TIME
+    timezone: Optional[str] = RELEASE_TIMEZONE
+
+    def release_datetime(self, booking_date) -> datetime:
+        """Return when the tee sheet for booking_date (a date or YYYY/MM/DD string) opens
+
+        Aware in the rule's timezone, so a release at 19:30 in London stays at 19:30
+        London time across DST changes whatever the machine's timezone. Naive local
+        time when the rule has no timezone.
+        """
+        if isinstance(booking_date, str):
+            booking_date = datetime.strptime(booking_date, DATE_FORMAT).date()
+        tzinfo = ZoneInfo(self.timezone) if self.timezone else None
+        return datetime.combine(booking_date - timedelta(days=self.days_ahead), self.release_time, tzinfo=tzinfo)
+
+    def release_at(self, booking_date) -> int:
+        """Release instant for booking_date as a sortable epoch timestamp, as stored in the database"""
+        return int(self.release_datetime(booking_date).timestamp())
+
+
+def parse_rules(value: str) -> Dict[str, ReleaseRule]:
+    """Parse CLUB_RELEASE_RULES, raising ValueError on anything that isn't a valid rule"""
+    rules = {}
+    for club, fields in json.loads(value or "{}").items():
+        try:
+            rule = ReleaseRule(days_ahead=int(fields.get("days_ahead", BOOKING_DAYS_AHEAD)),
+                               release_time=time.fromisoformat(fields["time"]) if "time" in fields else RELEASE_TIME,
+                               timezone=fields.get("timezone", RELEASE_TIMEZONE))
+            if rule.timezone:
+                ZoneInfo(rule.timezone)
+        except (AttributeError, TypeError, ValueError, ZoneInfoNotFoundError) as e:
+            raise ValueError(f"Invalid release rule for club {club}: {e}") from e
+        rules[club] = rule
+    return rules
+
+
+DEFAULT_RULE = ReleaseRule()
+CLUB_RULES = parse_rules(CLUB_RELEASE_RULES)
+
+
+def rule_for(club=None) -> ReleaseRule:
+    """The release rule for a club"""
+    return CLUB_RULES.get(club, DEFAULT_RULE)
+
+
+def release_datetime_for_booking(booking_date, club=None):
+    """Return when the club's tee sheet for booking_date (a date or YYYY/MM/DD string) opens"""
+    return rule_for(club).release_datetime(booking_date)
+
+
+def release_at(booking_date, club=None):
+    """Release instant of the club's tee sheet for booking_date as an epoch timestamp"""
+    return rule_for(club).release_at(booking_date)
+
+
+def earliest_release_at(booking_date):
+    """Release instant for booking_date under whichever rule opens it first
+
+    Every job releasing before this is for a tee date before booking_date, whatever its club.
+    """
+    return min(rule.release_at(booking_date) for rule in (DEFAULT_RULE, *CLUB_RULES.values()))
+
+
+def day_bounds(day=None):
+    """Epoch timestamps for the start of day and the start of the next day"""
+    start = datetime.combine(day or date.today(), time())
+    return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
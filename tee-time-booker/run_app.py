@@ -11,6 +11,10 @@ import logging
 from app import app
 import Booking
 
+# Run the booking scheduler inside this process. Turn off when bookings are handled by
+# separate worker.py processes, so the engine doesn't share the web UI's process.
+RUN_SCHEDULER = os.getenv("RUN_SCHEDULER", "1") == "1"
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -51,7 +55,10 @@ class ApplicationManager:
         
         try:
             # Start the booking scheduler
-            self.start_booking_scheduler()
+            if RUN_SCHEDULER:
+                self.start_booking_scheduler()
+            else:
+                logger.info("Booking scheduler disabled, bookings are left to worker.py")
             
             # Start Flask app
             logger.info("Starting Flask application...")
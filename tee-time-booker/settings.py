@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# .env keys imported into the store the first time it's used
+ENV_KEYS = {"BRS_USERNAME": "username", "CLUB_NAME": "club"}
+
+
+class SettingsStore:
+    """Account settings and the player roster, kept in the database and cached in memory
+
+    Reads are served from the cache and never touch the disk. Every write goes to the
+    database and drops the cache under one lock, so concurrent requests can't interleave
+    a stale read with a write. The cache belongs to this process, so writes made by
+    another process are only seen after a restart.
+    """
+
+    def __init__(self, database):
+        self.db = database
+        self._lock = threading.Lock()
+        self._settings: Optional[Dict[str, str]] = None
+        self._players: Optional[List[str]] = None
+
+    def _load(self):
+        if self._settings is None:
+            rows = self.db.execute_query("SELECT key, value FROM settings")
+            self._settings = {row["key"]: row["value"] for row in rows}
+        if self._players is None:
+            rows = self.db.execute_query("SELECT name FROM players ORDER BY id")
+            self._players = [row["name"] for row in rows]
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            self._load()
+            return self._settings.get(key, default)
+
+    def update(self, **values: str):
+        """Save settings, replacing any existing values"""
+        with self._lock:
+            with self.db.get_connection() as conn:
+                conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?) "
+                                 "ON CONFLICT(key) DO UPDATE SET value = excluded.value", list(values.items()))
+                conn.commit()
+            self._settings = None
+
+    def players(self) -> List[str]:
+        with self._lock:
+            self._load()
+            return list(self._players)
+
+    def add_player(self, name: str) -> bool:
+        """Add a player to the end of the roster, returning False if they're already on it"""
+        with self._lock:
+            added = self.db.execute_update("INSERT OR IGNORE INTO players (name) VALUES (?)", (name,))
+            self._players = None
+            return bool(added)
+
+    def remove_player(self, name: str) -> bool:
+        """Remove a player from the roster, returning False if they weren't on it"""
+        with self._lock:
+            removed = self.db.execute_update("DELETE FROM players WHERE name = ?", (name,))
+            self._players = None
+            return bool(removed)
+
+    def import_env(self, vault, environ=os.environ):
+        """Move the account and players from the environment (.env) into an empty store"""
+        if self.get("username") or self.players():
+            return
+
+        values = {key: environ[name] for name, key in ENV_KEYS.items() if environ.get(name)}
+        players = [player for player in environ.get("PLAYERS", "").split(",") if player]
+        if not values and not players:
+            return
+
+        logger.info("Importing account settings and players from the environment")
+        if values:
+            self.update(**values)
+        if values.get("username") and environ.get("BRS_PASSWORD"):
+            vault.store(values["username"], environ["BRS_PASSWORD"])
+        for player in players:
+            self.add_player(player)
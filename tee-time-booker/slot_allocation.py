@@ -0,0 +1,61 @@
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+import tee_time_booker
+
+logger = logging.getLogger(__name__)
+
+
+def group_bookings(bookings) -> Dict[Tuple[str, str], list]:
+    """Group bookings by (club, date) so each tee sheet is fetched once, keeping their order"""
+    groups = {}
+    for booking in bookings:
+        groups.setdefault((booking["club"], booking["date"]), []).append(booking)
+    return groups
+
+
+def booking_priority(booking):
+    """Bookings made first get first pick of the sheet"""
+    return booking["id"]
+
+
+def allocate_slots(bookings, tee_sheet_index, preferences: Callable[[dict], List[str]],
+                   max_candidates: Optional[int] = None,
+                   courses: Optional[Callable[[dict], List[str]]] = None) -> Dict[int, list]:
+    """Give every booking its own candidate slots so our bookings don't race each other
+
+    Slots are handed out in rounds: every booking gets its best free slot (in priority
+    order) before anyone gets a second one, and a slot only ever goes to one booking.
+    A booking stops claiming slots once it has max_candidates. With courses, a booking
+    only gets slots on its own courses, preferring them in the order given. Returns
+    booking id -> tee sheet rows (with their href and course) in that booking's
+    preference order.
+    """
+    ordered = sorted(bookings, key=booking_priority)
+    allocation = {booking["id"]: [] for booking in ordered}
+    claimed = set()
+
+    # Each booking's free slots, best first - a wide window or several courses can match many
+    wanted = {}
+    for booking in ordered:
+        rows = tee_time_booker.rankedRows(tee_sheet_index, preferences(booking), courses(booking) if courses else None)
+        wanted[booking["id"]] = iter(list(rows))
+
+    active = list(ordered)
+    while active:
+        for booking in list(active):
+            row = next((row for row in wanted[booking["id"]] if row.href not in claimed), None)
+            if row is None:
+                active.remove(booking)
+                continue
+
+            claimed.add(row.href)
+            allocation[booking["id"]].append(row)
+            if len(allocation[booking["id"]]) == max_candidates:
+                active.remove(booking)
+
+    for booking in ordered:
+        if not allocation[booking["id"]]:
+            logger.info(f"No free slots left for booking {booking['id']} after allocation")
+
+    return allocation
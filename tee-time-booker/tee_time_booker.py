@@ -1,60 +1,71 @@
+import html
+import json
 import logging
 import os
-from dotenv import load_dotenv
+import re
+import time as time_module
+from dataclasses import dataclass, field
+from typing import List, Optional
 import requests
 from datetime import datetime
-from bs4 import BeautifulSoup
-from selenium import webdriver
+from urllib.parse import urlparse
+import brs_capture
+import brs_responses
+import brs_transport
+import metrics
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# bs4, selenium (browser_pool) and dotenv are slow to import and only needed on some
+# paths, so they're imported where they're used to keep Lambda cold starts short.
+
+# Set logging to gauge when program should be scheduled to start. The log file is only
+# opened on the first write, and not at all on Lambda where the filesystem is read only.
+LOG_FILE = None if os.getenv('AWS_LAMBDA_FUNCTION_NAME') else os.getenv('BOOKING_LOG_FILE', 'logfile.log')
 
-# Set logging to gauge when program should be scheduled to start
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("logfile.log")
-    ]
+    handlers=[logging.StreamHandler()] + ([logging.FileHandler(LOG_FILE, delay=True)] if LOG_FILE else [])
 )
 
 
-# getPHPSessionID(), getOtherCookies(), getCSRFToken() are separately accessed to
-# store the necessary cookies for login from the various BRS Golf domains
-def getPHPSessionID(session, url):
-    
-    session.get(url)
-
-    # print('getPHPSessionID() Cookies *****************')
-    # print(session.cookies)
+# BRS sites - overridable so the booking flow can be pointed at a local stand-in
+BRS_URL = os.getenv('BRS_URL', 'https://brsgolf.com')
+BRS_MEMBERS_URL = os.getenv('BRS_MEMBERS_URL', 'https://members.brsgolf.com')
 
+# Seconds to wait for a booking POST to be confirmed before hedging to the next slot.
+# Unset means slots are tried strictly one after another (bookTeeTime).
+HEDGE_DELAY = float(os.environ['BOOKING_HEDGE_DELAY']) if os.getenv('BOOKING_HEDGE_DELAY') else None
 
-def getOtherCookies(session, url):
-    
-    session.get(url)
+# Most free slots a booking goes after. A wide time window can match a whole morning,
+# and every candidate costs a token fetch at fire time.
+MAX_CANDIDATES = int(os.getenv('BOOKING_MAX_CANDIDATES', '3'))
 
-    #print('getOtherCookies() Cookies *****************')
-    # print(session.cookies)
-    # print('\n')
+# Course booked when a booking doesn't name any. Clubs with several courses number them
+# from 1 in their tee sheet and booking URLs.
+DEFAULT_COURSE = '1'
 
-def getCSRFToken(session, url):
-    
-    
-    response = session.get(url)
+# When set, run() records every request and response (secrets redacted) to a new file in
+# this directory, for replaying offline with brs_capture.py
+CAPTURE_DIR = os.getenv('BOOKING_CAPTURE_DIR')
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-    csrf_token = soup.find('input', {'name': 'login_form[_token]'})['value']
-
-    #print('getOtherCookies() Cookies *****************')
-    # print(session.cookies)
-    #print('CSRF token: ' + csrf_token)
-    # print('\n')
 
-    return csrf_token
+# Raises TypeError if there's no login form on the page
+def loginFormToken(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    return soup.find('input', {'name': 'login_form[_token]'})['value']
 
 
-def getTimeSheet(session, csrf_token):
+# Login URL, headers and form fields for a club
+def loginRequest(club_name, username, password, csrf_token):
 
     # Perform the login and obtain the necessary authentication token or cookies
-    login_url = f'https://members.brsgolf.com/{club_name}/login'
+    login_url = f'{BRS_MEMBERS_URL}/{club_name}/login'
 
     payload = {
         'login_form[username]': username,
@@ -64,7 +75,7 @@ def getTimeSheet(session, csrf_token):
     }
 
     headers = {
-    'authority': 'members.brsgolf.com:',
+    'authority': f'{urlparse(BRS_MEMBERS_URL).netloc}:',
     'method': 'POST',
     'path': f'/{club_name}/login',
     'scheme': 'https',
@@ -73,236 +84,527 @@ def getTimeSheet(session, csrf_token):
     'accept-language': 'en-GB,en-US;q=0.9,en;q=0.8',
     'cache-control': 'max-age=0',
     'content-type': 'application/x-www-form-urlencoded',
-    'origin': 'https://members.brsgolf.com',
-    'referer': f'https://members.brsgolf.com/{club_name}/login'
+    'origin': BRS_MEMBERS_URL,
+    'referer': f'{BRS_MEMBERS_URL}/{club_name}/login'
     }
 
-    try:
-        response = session.post(login_url, headers=headers, data=payload)
-        response.raise_for_status()  # Raise an exception for 4xx and 5xx status codes
-    
-        # Check if the login was successful and retrieve the necessary authentication information
-        if response.status_code == 200:
-            print('<--- LOGIN SUCCESSFUL! --->')
-            # print('TEE TIME REFS......................')
-            # print(session.cookies)
-
-        else:
-            print('Login failed.')
-            print(response.status_code)
-            print(response.reason)
-            
-    except requests.exceptions.RequestException as e:
-        print('An error occurred during login:', e)
+    return login_url, headers, payload
+
 
 # Selenium webdriver is required to access token values and other identifiers that are generated
 # via Javascript and hiddden in the HTML page source. Other libraries could not render the Javascript
 # properly; hence, it was a last resort.
 #
-# The key value needed is a href for each booking slot that contains a dynamically generated token
-def getDynamicHTML(date):
-
-    url = f'https://members.brsgolf.com/{club_name}/tee-sheet/1/{date}'
-
-    # Create a new Chrome browser instance using Selenium
-    driver = webdriver.Chrome()
-
-    # Initial page load to pull down and align cookie domains
-    driver.get(url)
-
-    # delete the current cookies
-    driver.delete_all_cookies()
-
-    # Convert CookieJar to Selenium's dictionary format
-    cookies_dict = {}
-    
-    for cookie in session.cookies:
-        # Omit cookie expiry property if the cookie is a session cookie
-        if cookie.expires == None:
-            cookies_dict[cookie.name] = {
-                'name': cookie.name,
-                'value': cookie.value,
-                'path': cookie.path,
-                'domain': cookie.domain,
-                'secure': cookie.secure
-            }
-        else:
-            cookies_dict[cookie.name] = {
-                'name': cookie.name,
-                'value': cookie.value,
-                'path': cookie.path,
-                'domain': cookie.domain,
-                'secure': cookie.secure,
-                'expiry': cookie.expires
-            }
-
-        driver.add_cookie(cookies_dict[cookie.name])
-    
-    # Give time for all HTML to load, otherwise it is intermittently missed
-    driver.implicitly_wait(3)
-
-    # Navigate to the webpage using Selenium
-    driver.get(url)
-
-    # Get the page source after JavaScript execution
-    page_source = driver.page_source
-
-    # Close the browser
-    driver.quit()
+# The key value needed is a href for each booking slot that contains a dynamically generated token.
+# Browsers come from a pool that is launched and pointed at the club during the prepare phase, so
+# Chrome start-up isn't paid at the release time.
+@metrics.timed("getDynamicHTML")
+def getDynamicHTML(session, club_name, date, pool=None, course=DEFAULT_COURSE):
+
+    url = teeSheetURL(club_name, date, course)
+
+    import browser_pool
+
+    pool = pool or browser_pool.getPool()
+
+    start = time_module.monotonic()
+    page_source = browser_pool.fetchPageSource(pool, session, url)
+    brs_capture.record_page_source(url, page_source, start)
 
     return page_source
 
-def hrefParser(dynamic_html, tee_time_preferences):
+def teeSheetURL(club_name, date, course=DEFAULT_COURSE):
+    return f'{BRS_MEMBERS_URL}/{club_name}/tee-sheet/{course}/{date}'
 
-    soup = BeautifulSoup(dynamic_html, "html.parser")
 
-    # Find the all timesheet rows
-    tr_elements = soup.find_all("tr", class_="bg-white even:bg-grey-faded")
+# Fast path that skips the browser altogether. The tee sheet is fetched on the booking
+# session and used as is if the server rendered the booking links into the rows. Otherwise
+# the tee sheet data the page's Javascript builds its rows from (a JSON script block, or an
+# Inertia style data-page attribute) is read out of the page, and its tee times are written
+# back out as rows in the same markup hrefParser reads, booked or bookable as the data says.
+# Returns None when neither is found so the caller can fall back to getDynamicHTML.
+TEE_SHEET_ROW_CLASS = "bg-white even:bg-grey-faded"
 
-    # Initialise empty array and flag
-    available_tee_times_hrefs = []
-    tee_time_available = True
+EMBEDDED_SCRIPT = re.compile(r'<script\b[^>]*\btype=["\']application/json["\'][^>]*>(.*?)</script>', re.IGNORECASE | re.DOTALL)
+EMBEDDED_ATTRIBUTE = re.compile(r'\bdata-page="([^"]*)"', re.IGNORECASE)
 
-    for time in tee_time_preferences:
-        # Find <tr> elements containing tee times
-        for tr_element in tr_elements:
-            tee_time_available = True  # Reset tee_time_available for each tr_element
-            if time in tr_element.text:
-                # Multiple conditions in above did not work consistently.
-                # Div elements separated for filtering
-                div_elements = tr_element.find_all("div")
-                for div_element in div_elements:
-                    # All bookings with 1-4 players have '18 Holes' text added to first column
-                    if 'Holes' in div_element.text:
-                        tee_time_available = False
-                # If 'Holes' isn't in the table row then all 4 slots available
-                if tee_time_available:           
-                    # Find the anchor tag and extract its href value
-                    anchor_tag = tr_element.find('a')
-                    if anchor_tag and 'href' in anchor_tag.attrs:
-                        href_value = anchor_tag['href']
-                        available_tee_times_hrefs.append(href_value)
+# Keys a tee time in the embedded data may give its time, booking link and availability under
+EMBEDDED_TIME_KEYS = ('time', 'tee_time', 'teeTime')
+EMBEDDED_HREF_KEYS = ('url', 'href', 'booking_url', 'bookingUrl')
+EMBEDDED_AVAILABLE_KEYS = ('available', 'is_available', 'isAvailable', 'bookable')
 
-    # print('TEE TIME REFS......................')
-    # print(available_tee_times_hrefs)
 
-    return available_tee_times_hrefs
+def embeddedValue(entry, keys):
+    return next((entry[key] for key in keys if key in entry), None)
 
-def bookingSlotTokens(session, available_tee_times_hrefs):
 
-    tokens_array = []  # Create an empty array to store the tokens
+def embeddedObjects(data):
+    # Every JSON object in the document, however deeply nested
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            yield value
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(reversed(value))
 
-    for hrefs in available_tee_times_hrefs:
 
-        tokens_array_inner = []
-        url = f'https://members.brsgolf.com{hrefs}'
+# Tee time -> (bookable, href) for every tee time in the page's embedded tee sheet data. Only
+# entries that say whether they're available count, and only links to the club's booking
+# form are kept, so a tee time is bookable only when the data says so and links to it.
+def embeddedTeeTimes(page_source, club_name):
 
+    documents = EMBEDDED_SCRIPT.findall(page_source) + [html.unescape(value) for value in EMBEDDED_ATTRIBUTE.findall(page_source)]
+    booking_path = f'/{club_name}/bookings/book/'
+    tee_times = {}
+
+    for document in documents:
         try:
-            response = session.get(url)
-            response.raise_for_status()  # Raise an exception for 4xx and 5xx status codes
-
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-            token_1 = soup.find('input', {'name': 'member_booking_form[token]'})['value']     
-            token_2 = soup.find('input', {'name': 'member_booking_form[_token]'})['value']
-        
-            # Add the tokens to the array
-            tokens_array_inner.append(token_1)
-            tokens_array_inner.append(token_2)
-            tokens_array.append(tokens_array_inner)
-
-            # print('MEMBER TOKENS......................')
-            # print(tokens_array)
-        
-        except requests.exceptions.RequestException as e:
-            print(f"An error occurred while fetching tokens for {url}: {e}")
-
-    # Optionally, you may want to log the extracted tokens
-    logging.info("Tokens array: %s", tokens_array)
-    
-    return tokens_array
-
-
-def bookTeeTime(session, hrefs, tokens, player_1, player_2="", player_3="", player_4=""):
-    
-    i = 0
-    status_code = 0
-    response = None
-
-    logging.info("Reaching bookTeeTime while loop...")
-
-
-    # Tries to book initial time slot (href), if it fails, it then tries the 2nd, and so on.
-    # hrefs array can only be max length of three, so it will only try three times at most.
-    while status_code != 200 and i < len(hrefs):
-        split_date_time = hrefs[i].split('/')
-        time = split_date_time[-1]
-        date = split_date_time[-2]
-
-        url = f"https://members.brsgolf.com/{club_name}/bookings/store/1/{date}/{time}"
-
-        payload = {
-            f'member_booking_form[token]': {tokens[i][0]},
-            'member_booking_form[holes]': '18',
-            f'member_booking_form[player_1]': {player_1},
-            f'member_booking_form[player_2]': {player_2},
-            'member_booking_form[guest-rate-2]': '',
-            f'member_booking_form[player_3]': {player_3},
-            'member_booking_form[guest-rate-3]': '',
-            f'member_booking_form[player_4]': {player_4},
-            'member_booking_form[guest-rate-4]': '',
-            'member_booking_form[vendor-tx-code]': '',
-            f'member_booking_form[_token]': {tokens[i][1]}
-        }
+            data = json.loads(document)
+        except ValueError:
+            continue
 
-        # For whatever reason, a successful request requires an empty files array
-        files=[]
+        for entry in embeddedObjects(data):
+            available = embeddedValue(entry, EMBEDDED_AVAILABLE_KEYS)
+            time = normaliseTime(str(embeddedValue(entry, EMBEDDED_TIME_KEYS) or ''))
+            if not isinstance(available, bool) or time is None or time in tee_times:
+                continue
 
-        try:
+            href = embeddedValue(entry, EMBEDDED_HREF_KEYS)
+            href = urlparse(href).path if isinstance(href, str) else None
+            if href is not None and not href.startswith(booking_path):
+                href = None
+            tee_times[time] = (available and href is not None, href)
 
-            logging.info("Sending POST request for %s", url)
+    return tee_times
 
-            response = session.post(url, data=payload, files=files)
 
-            i += 1
-            status_code = response.status_code
+def embeddedRow(time, bookable, href):
+    if bookable:
+        return f'<tr class="{TEE_SHEET_ROW_CLASS}"><td>{time}</td><td><a href="{html.escape(href)}"></a></td></tr>'
+    # Booked rows carry the "18 Holes" text teeSheetRow reads as taken
+    return f'<tr class="{TEE_SHEET_ROW_CLASS}"><td>{time}<div>18 Holes</div></td></tr>'
 
-            # Optionally, log the response content for debugging
-            # print(response.status_code)
-            # print(response.content)
-        
-        except requests.exceptions.RequestException as e:
-            print(f"An error occurred during the booking attempt: {e}")
-            response = None
 
-    return response
-    
+# Reads a fetched tee sheet page without a browser. Returns the HTML to parse (the page
+# itself, or rows rebuilt from the embedded tee sheet data) or None, and whether the sheet
+# had tee times at all, which means it's there but not bookable yet.
+def staticTeeSheet(page_source, club_name):
 
-def run(username, password, club_name, tee_time_preferences, tee_time_date, player_1, player_2="", player_3="", player_4=""):
-    logging.info("Script started at: %s", datetime.now())
+    # Rows already rendered server side. This runs on the event loop for every course at
+    # release, so it uses lxml when it's there, like parseTeeSheet.
+    has_rows, has_links = teeSheetRows(page_source)
+    if has_links:
+        return page_source, True
+
+    # Rows built client side from data embedded in the page
+    tee_times = embeddedTeeTimes(page_source, club_name)
+    if any(bookable for bookable, _ in tee_times.values()):
+        rows = ''.join(embeddedRow(time, bookable, href) for time, (bookable, href) in tee_times.items())
+        return f'<table>{rows}</table>', True
+
+    return None, has_rows or bool(tee_times)
+
+
+# Whether a page has tee sheet rows, and whether any of them has a booking link
+def teeSheetRows(page_source):
+
+    if not page_source.strip():
+        return False, False
+
+    if lxml is not None:
+        document = lxml.html.fromstring(page_source)
+        rows = document.xpath('//tr[contains(concat(" ", normalize-space(@class), " "), " bg-white ")]')
+        return bool(rows), any(row.xpath('.//a[@href]') for row in rows)
+
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(page_source, 'html.parser')
+    return bool(soup.select('tr.bg-white')), bool(soup.select('tr.bg-white a[href]'))
+
+
+# Every booking slot on a BRS tee sheet takes up to four players
+SLOTS_PER_TEE_TIME = 4
+
+TIME_PATTERN = re.compile(r'(?<!\d)(\d{1,2}):(\d{2})')
+
+
+@dataclass
+class TeeSheetRow:
+    time: str
+    available: bool
+    free_slots: int
+    href: Optional[str] = None
+    course: str = DEFAULT_COURSE
+
+
+def normaliseTime(tee_time):
+    # "7:00" and "07:00" are the same tee time
+    match = TIME_PATTERN.search(tee_time)
+    if match:
+        return f'{int(match.group(1)):02d}:{match.group(2)}'
+    return None
+
+
+def teeSheetRow(tee_time, div_texts, href, course=DEFAULT_COURSE):
+    # All bookings with 1-4 players have '18 Holes' text added to first column, so a row
+    # is only available when it has no bookings at all. The sheet doesn't tell us how many
+    # players a part-booked row holds, so it counts as having no free slots.
+    available = not any('Holes' in text for text in div_texts)
+    return TeeSheetRow(tee_time, available, SLOTS_PER_TEE_TIME if available else 0, href, course)
+
+
+def parseTeeSheetLxml(dynamic_html, course=DEFAULT_COURSE):
+
+    document = lxml.html.fromstring(dynamic_html)
+    index = {}
+
+    for tr_element in document.xpath('//tr[contains(@class, "bg-white")]'):
+        cells = tr_element.xpath('./td')
+        tee_time = normaliseTime(cells[0].text_content() if cells else '') or normaliseTime(tr_element.text_content())
+        if tee_time is None or tee_time in index:
+            continue
+
+        anchor_tag = next(tr_element.iter('a'), None)
+        href = anchor_tag.get('href') if anchor_tag is not None else None
+        index[tee_time] = teeSheetRow(tee_time, (div.text_content() for div in tr_element.iter('div')), href, course)
+
+    return index
+
+
+def parseTeeSheetSoup(dynamic_html, course=DEFAULT_COURSE):
+
+    from bs4 import BeautifulSoup, SoupStrainer
+    soup = BeautifulSoup(dynamic_html, "html.parser", parse_only=SoupStrainer("tr"))
+    index = {}
+
+    for tr_element in soup.find_all("tr", class_="bg-white"):
+        cell = tr_element.find('td')
+        tee_time = normaliseTime(cell.get_text() if cell else '') or normaliseTime(tr_element.get_text())
+        if tee_time is None or tee_time in index:
+            continue
+
+        anchor_tag = tr_element.find('a')
+        href = anchor_tag.get('href') if anchor_tag else None
+        index[tee_time] = teeSheetRow(tee_time, (div.get_text() for div in tr_element.find_all('div')), href, course)
+
+    return index
+
+
+# The tee sheet is parsed once into an index of exact tee time -> row. lxml is used when
+# it's installed as it is several times faster than BeautifulSoup's html.parser.
+def parseTeeSheet(dynamic_html, course=DEFAULT_COURSE):
+
+    if lxml is not None:
+        return parseTeeSheetLxml(dynamic_html, course)
+
+    return parseTeeSheetSoup(dynamic_html, course)
+
+
+# Sheets for several courses are merged into one index of tee time -> that time's rows
+# on every course, in the order the courses were given
+def mergeTeeSheets(indexes):
+
+    merged = {}
+    for index in indexes:
+        for tee_time, row in index.items():
+            merged.setdefault(tee_time, []).append(row)
+
+    return merged
+
+
+def sheetRows(index, tee_time):
+    # Works on single course indexes and merged ones alike
+    rows = index.get(tee_time) or index.get(normaliseTime(tee_time))
+    if rows is None:
+        return []
+    return rows if isinstance(rows, list) else [rows]
+
+
+# Available rows for the preferred tee times as one ranked list: by tee time preference,
+# then by course preference when a time is free on more than one of the given courses
+def rankedRows(index, tee_time_preferences, courses=None):
+
+    for tee_time in tee_time_preferences:
+        rows = sheetRows(index, tee_time)
+        if courses:
+            rows = sorted((row for row in rows if row.course in courses), key=lambda row: courses.index(row.course))
+        for row in rows:
+            # If 'Holes' isn't in the table row then all 4 slots available
+            if row.available and row.href:
+                yield row
+
+
+# The free rows to book, best first. Each row carries the booking href and the course it's
+# on, which the booking POST goes to.
+@metrics.timed("hrefParser")
+def hrefParser(dynamic_html, tee_time_preferences, tee_sheet_index=None, max_candidates=None, courses=None):
+
+    index = tee_sheet_index if tee_sheet_index is not None else parseTeeSheet(dynamic_html)
+    max_candidates = MAX_CANDIDATES if max_candidates is None else max_candidates
+
+    available_tee_times = []
+
+    for row in rankedRows(index, tee_time_preferences, courses):
+        available_tee_times.append(row)
+        if len(available_tee_times) == max_candidates:
+            break
+
+    return available_tee_times
 
-    session = requests.Session()
 
-    # URLs
-    club_brs_url = f'https://brsgolf.com/{club_name}'
-    club_members_brs_url = f'https://members.brsgolf.com/'
-    club_login_brs_url = f'https://members.brsgolf.com/{club_name}/login'
+# Classifies a booking form response and pulls its two tokens out
+def slotFormTokens(response, url):
+
+    outcome = brs_responses.classify(response)
+    if outcome is not brs_responses.Outcome.SUCCESS:
+        return outcome, None, response
+
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(response.content, 'html.parser')
+    token_1 = soup.find('input', {'name': 'member_booking_form[token]'})
+    token_2 = soup.find('input', {'name': 'member_booking_form[_token]'})
+
+    if token_1 is None or token_2 is None:
+        logging.warning("No booking form tokens on %s", url)
+        return brs_responses.Outcome.ERROR, None, response
+
+    return outcome, [token_1['value'], token_2['value']], response
+
+
+# Store URL and form fields for booking the slot at href on course
+def bookingRequest(club_name, course, href, tokens, player_1, player_2="", player_3="", player_4=""):
+
+    # /{club}/bookings/book/{course}/{date}/{time}
+    split_date_time = href.split('/')
+    time = split_date_time[-1]
+    date = split_date_time[-2]
+
+    url = f"{BRS_MEMBERS_URL}/{club_name}/bookings/store/{course}/{date}/{time}"
+
+    payload = {
+        'member_booking_form[token]': tokens[0],
+        'member_booking_form[holes]': '18',
+        'member_booking_form[player_1]': player_1,
+        'member_booking_form[player_2]': player_2,
+        'member_booking_form[guest-rate-2]': '',
+        'member_booking_form[player_3]': player_3,
+        'member_booking_form[guest-rate-3]': '',
+        'member_booking_form[player_4]': player_4,
+        'member_booking_form[guest-rate-4]': '',
+        'member_booking_form[vendor-tx-code]': '',
+        'member_booking_form[_token]': tokens[1]
+    }
+
+    return url, payload
+
+
+@dataclass
+class SlotAttempt:
+    href: str
+    status_code: Optional[int] = None
+    outcome: Optional[brs_responses.Outcome] = None
+    latency: Optional[float] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class SubmissionReport:
+    winner: Optional[str] = None
+    response: Optional[requests.Response] = None
+    attempts: List[SlotAttempt] = field(default_factory=list)
+
+
+class PreparedSession:
+    """A logged-in BRS session that is ready to fire the booking at release time"""
+
+    def __init__(self, session, club_name, username, password):
+        self.session = session
+        self.club_name = club_name
+        self.username = username
+        self.password = password
+        self.logged_in = False
+
+
+# Blocking wrappers of the booking flow in async_booker, for callers without an event
+# loop such as the Lambda handler. The session is a requests session, so it can be kept
+# warm between invocations and across the wait for the release.
+def prepare(username, password, club_name):
+
+    # async_booker builds on this module, so it can't be imported at the top
+    import asyncio
+    import async_booker
+
+    session = brs_capture.watch(brs_transport.session())
+
+    return asyncio.run(async_booker.prepare(session, username, password, club_name))
+
+
+# Logs a prepared session in (again), e.g. when BRS expires it between prepare and fire
+def login(prepared):
+
+    import asyncio
+    import async_booker
+
+    return asyncio.run(async_booker.login(prepared))
+
+
+def fire(prepared, tee_time_preferences, tee_time_date, player_1, player_2="", player_3="", player_4="", hedge_delay=None, courses=None):
+
+    import asyncio
+    import async_booker
+
+    return asyncio.run(async_booker.fire(prepared, tee_time_preferences, tee_time_date, player_1, player_2, player_3,
+                                         player_4, hedge_delay=hedge_delay, courses=courses))
+
+
+# Blocking entry point for a single booking, run on the asyncio flow in async_booker
+def run(username, password, club_name, tee_time_preferences, tee_time_date, player_1, player_2="", player_3="", player_4="", courses=None, capture_dir=None):
+    logging.info("Script started at: %s", datetime.now())
 
     # Prefs
     # tee_time_preferences = ["12:50", "13:00", "20:00"]
     # tee_time_date = '2023/07/24'
 
-    getPHPSessionID(session, club_brs_url)
-    getOtherCookies(session, club_members_brs_url)
-    csrf_token = getCSRFToken(session, club_login_brs_url)
-    getTimeSheet(session, csrf_token)
-    dynamic_html = getDynamicHTML(tee_time_date)
-    available_tee_times_hrefs = hrefParser(dynamic_html, tee_time_preferences)
-    booking_tokens = bookingSlotTokens(session, available_tee_times_hrefs)
-    response = bookTeeTime(session, available_tee_times_hrefs, booking_tokens, player_1)
+    # async_booker builds on this module, so it can't be imported at the top
+    import asyncio
+    import async_booker
+
+    booking = async_booker.run(username, password, club_name, tee_time_preferences, tee_time_date,
+                               player_1, player_2, player_3, player_4, courses=courses)
+
+    capture_dir = capture_dir or CAPTURE_DIR
+    if not capture_dir:
+        return asyncio.run(booking)
+
+    capture = brs_capture.Capture({
+        'club': club_name,
+        'date': tee_time_date,
+        'preferences': list(tee_time_preferences),
+        'players': [player_1, player_2, player_3, player_4],
+        'courses': list(courses or [DEFAULT_COURSE]),
+    })
+    try:
+        with brs_capture.bind(capture):
+            return asyncio.run(booking)
+    finally:
+        path = capture.save(capture_dir)
+        logging.info("Captured %s requests to %s", len(capture.exchanges), path)
+
+
+
+# Lambda entry point. The booking comes from the event payload, falling back to the
+# function's environment for anything it leaves out:
+#
+#   {"username": "...", "password": "...", "club": "...", "date": "2023/08/02",
+#    "times": ["12:50", "07:00"], "players": ["3072", "3719"], "courses": ["1", "2"],
+#    "release_at": "2023-07-25T07:30:00"}
+#
+# times, players and courses may also be comma separated strings, and the environment can give the
+# date as a "2023/08/02": "12:50,07:00" entry. With release_at the handler logs in straight away and
+# fires at that instant. Config parsed from the environment and logged-in sessions are
+# kept at module level, so a warm container skips both.
+_lambda_config = None
+_warm_sessions = {}
+
+# Warm sessions older than this are logged in again rather than trusted, since an expired
+# session only shows up when the tee sheet comes back without booking links
+LAMBDA_SESSION_TTL = float(os.getenv('LAMBDA_SESSION_TTL', '600'))
+
+LAMBDA_DATE_KEY = re.compile(r'^\d{4}/\d{2}/\d{2}$')
+
+
+def lambdaConfig():
+
+    global _lambda_config
+
+    if _lambda_config is None:
+        env = os.environ
+        date_key = next((key for key in env if LAMBDA_DATE_KEY.match(key)), None)
+        _lambda_config = {
+            'username': env.get('BRS_USERNAME'),
+            'password': env.get('BRS_PASSWORD'),
+            'club': env.get('CLUB_NAME'),
+            'date': date_key,
+            'times': env.get(date_key) if date_key else None,
+            'players': [env[f'PLAYER_{i}'] for i in range(1, 5) if env.get(f'PLAYER_{i}')],
+            'courses': env.get('COURSES'),
+        }
+
+    return _lambda_config
+
 
-    return response
+def lambdaBooking(event):
 
+    booking = dict(lambdaConfig())
+    booking.update({key: value for key, value in (event or {}).items() if value is not None})
+
+    for key in ('times', 'players', 'courses'):
+        values = booking.get(key) or []
+        if isinstance(values, str):
+            values = [value.strip() for value in values.split(',') if value.strip()]
+        booking[key] = [str(value) for value in values]
+    booking['courses'] = booking['courses'] or [DEFAULT_COURSE]
+
+    missing = [key for key in ('username', 'password', 'club', 'date', 'times', 'players') if not booking.get(key)]
+    if missing:
+        raise ValueError(f"Booking is missing {', '.join(missing)}")
+
+    return booking
+
+
+def warmSession(username, password, club_name):
+
+    prepared, logged_in_at = _warm_sessions.get((username, club_name), (None, None))
+
+    if prepared is None or prepared.password != password:
+        prepared = prepare(username, password, club_name)
+    elif not prepared.logged_in or time_module.monotonic() - logged_in_at > LAMBDA_SESSION_TTL:
+        login(prepared)
+    else:
+        logging.info("Reusing warm session for %s", username)
+        return prepared
+
+    _warm_sessions[(username, club_name)] = (prepared, time_module.monotonic())
+    return prepared
+
+
+def lambda_handler(event, context):
+
+    try:
+        booking = lambdaBooking(event)
+    except ValueError as e:
+        logging.error("Invalid booking event: %s", e)
+        return {'statusCode': 400, 'booked': False, 'error': str(e)}
+
+    with metrics.bind(metrics.RunRecord(club=booking['club'])) as record:
+        prepared = warmSession(booking['username'], booking['password'], booking['club'])
+
+        if booking.get('release_at'):
+            import release_clock
+            release_at = datetime.fromisoformat(booking['release_at'])
+            # Connections kept warm until just before the release, so the fire requests
+            # skip DNS, TCP and TLS even if the login's connection has gone idle
+            with brs_transport.keptAlive(prepared.session, BRS_MEMBERS_URL, release_at.timestamp()):
+                firing_error = release_clock.wait_for_release(release_at)
+            logging.info("Fired %.3fms after target", firing_error * 1000)
+
+        fired = time_module.monotonic()
+        response = fire(prepared, booking['times'], booking['date'], *booking['players'][:4], courses=booking['courses'])
+
+    # timings.jsonl can't be written on Lambda, so the stages go to the log instead
+    outcome = brs_responses.classify(response)
+    logging.info("Lambda booking for %s on %s: %s", booking['username'], booking['date'], outcome.name)
+    for span in record.spans:
+        logging.info("Stage %s took %.1fms", span.stage, span.duration * 1000)
+    for timing in brs_transport.timings(prepared.session, BRS_MEMBERS_URL, since=fired):
+        logging.info("Fire request %s %s: %s", timing.method, timing.path, timing.describe())
+
+    return {
+        'statusCode': response.status_code if response is not None else None,
+        'booked': outcome is brs_responses.Outcome.SUCCESS,
+        'outcome': outcome.value,
+    }
 
 
 if __name__ == "__main__":
@@ -310,6 +612,7 @@ if __name__ == "__main__":
     logging.info("Script started at: %s", datetime.now())
 
     # Use environment vars to protect secrets
+    from dotenv import load_dotenv
     load_dotenv()
     username = os.environ['BRS_USERNAME']
     password = os.environ['BRS_PASSWORD']
@@ -319,22 +622,9 @@ if __name__ == "__main__":
     player_4 = os.environ['PLAYER_4']
     club_name = os.environ['CLUB_NAME']
 
-    session = requests.Session()
-
-    # URLs
-    club_brs_url = f'https://brsgolf.com/{club_name}'
-    club_members_brs_url = f'https://members.brsgolf.com/'
-    club_login_brs_url = f'https://members.brsgolf.com/{club_name}/login'
-
     # Prefs
     tee_time_preferences = ["12:50", "13:00", "20:00"]
     tee_time_date = '2023/07/24'
 
-    getPHPSessionID(session, club_brs_url)
-    getOtherCookies(session, club_members_brs_url)
-    csrf_token = getCSRFToken(session, club_login_brs_url)
-    getTimeSheet(session, csrf_token)
-    dynamic_html = getDynamicHTML(tee_time_date)
-    available_tee_times_hrefs = hrefParser(dynamic_html, tee_time_preferences)
-    booking_tokens = bookingSlotTokens(session, available_tee_times_hrefs)
-    response = bookTeeTime(session, available_tee_times_hrefs, booking_tokens, player_1)
\ No newline at end of file
+    response = run(username, password, club_name, tee_time_preferences, tee_time_date,
+                   player_1, player_2, player_3, player_4)
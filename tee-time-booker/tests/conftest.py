@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), "benchmarks"))
+
+# Booking and tee_time_booker write database.db, vault.key and logfile.log into the working
+# directory on import, so the tests run in a scratch one
+os.chdir(tempfile.mkdtemp(prefix="tee_time_booker_tests_"))
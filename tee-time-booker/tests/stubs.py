@@ -0,0 +1,39 @@
+"""Canned BRS responses and a blocking session that serves them, for tests that don't need mock_brs"""
+import requests
+
+TEE_SHEET_URL = "https://members.brsgolf.com/club/tee-sheet/1/2099/01/01"
+
+
+def response(status_code=200, text="", url=TEE_SHEET_URL, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = text.encode()
+    response.encoding = "utf-8"
+    response.url = url
+    response.headers.update(headers or {})
+    return response
+
+
+class StubSession:
+    """Answers each request with the next of its method's answers, repeating the last one
+
+    answers is a list for every request, or a dict keyed by method, or by method and a
+    part of the URL, to lists. An exception in a list is raised instead of answering.
+    """
+
+    def __init__(self, answers):
+        self.answers = answers if isinstance(answers, dict) else {None: answers}
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        key = next((key for key in self.answers if isinstance(key, tuple) and key[0] == method and key[1] in url),
+                   method if method in self.answers else None)
+        answers = self.answers[key]
+        answer = answers.pop(0) if len(answers) > 1 else answers[0]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def count(self, method):
+        return sum(request[0] == method for request in self.requests)
@@ -0,0 +1,105 @@
+import pytest
+
+import DB as DB_module
+import app as app_module
+import booking_display
+import preferences
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    database = DB_module.Database(str(tmp_path / "database.db"))
+    monkeypatch.setattr(app_module, "DB", database)
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def client(database):
+    return app_module.app.test_client()
+
+
+def add_booking(database, tee_date, tee_time, club="club", players="3072,3719"):
+    windows = [preferences.TimeWindow(tee_time)]
+    return database.execute_insert(
+        "INSERT INTO bookings (username, club, date, time, players, courses, release_at, time_windows, "
+        "formatted_date, day_name, time_label, backup_times) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ("member", club, tee_date, tee_time, players, "1", 0, preferences.windows_to_json(windows),
+         *booking_display.display_fields(tee_date, windows).values()))
+
+
+def test_bookings_are_listed_with_their_display_fields(client, database):
+    add_booking(database, "2099/01/02", "07:30")
+
+    [booking] = client.get("/api/bookings").get_json()["bookings"]
+
+    assert booking["players"] == ["3072", "3719"]
+    assert booking["courses"] == ["1"]
+    assert booking["formatted_date"] == "02/01/2099"
+    assert booking["day_name"] == "Friday"
+    assert booking["backup_times"] == []
+
+
+def test_pages_follow_the_cursor_in_date_and_time_order(client, database):
+    ids = [add_booking(database, tee_date, tee_time) for tee_date, tee_time in
+           [("2099/01/03", "07:00"), ("2099/01/01", "09:00"), ("2099/01/01", "08:00"),
+            ("2099/01/02", "07:30"), ("2099/01/01", "08:00")]]
+
+    pages, cursor = [], None
+    while True:
+        query = f"/api/bookings?limit=2&cursor={cursor}" if cursor else "/api/bookings?limit=2"
+        body = client.get(query).get_json()
+        pages.append([booking["id"] for booking in body["bookings"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert pages == [[ids[2], ids[4]], [ids[1], ids[3]], [ids[0]]]
+
+
+def test_last_full_page_has_no_cursor(client, database):
+    for tee_time in ("07:00", "07:10"):
+        add_booking(database, "2099/01/01", tee_time)
+
+    assert client.get("/api/bookings?limit=2").get_json()["next_cursor"] is None
+
+
+def test_bookings_are_filtered_by_date_and_club(client, database):
+    add_booking(database, "2099/01/01", "07:00")
+    inside = add_booking(database, "2099/01/02", "07:00")
+    add_booking(database, "2099/01/02", "07:00", club="other")
+    add_booking(database, "2099/01/03", "07:00")
+
+    body = client.get("/api/bookings?from=2099-01-02&to=2099-01-02&club=club").get_json()
+
+    assert [booking["id"] for booking in body["bookings"]] == [inside]
+
+
+@pytest.mark.parametrize("query", ["cursor=nonsense", "limit=0", "limit=many", "from=01/02/2099"])
+def test_invalid_parameters_are_rejected(client, query):
+    response = client.get(f"/api/bookings?{query}")
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_unchanged_bookings_are_answered_with_304(client, database):
+    add_booking(database, "2099/01/01", "07:00")
+    first = client.get("/api/bookings")
+
+    assert first.headers["Cache-Control"] == "no-cache"
+    assert client.get("/api/bookings", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert client.get("/api/bookings", headers={"If-Modified-Since": first.headers["Last-Modified"]}).status_code == 304
+
+
+def test_etag_changes_with_the_bookings_and_the_query(client, database):
+    add_booking(database, "2099/01/01", "07:00")
+    etag = client.get("/api/bookings").headers["ETag"]
+
+    other_query = client.get("/api/bookings?club=club", headers={"If-None-Match": etag})
+    assert other_query.status_code == 200 and other_query.headers["ETag"] != etag
+
+    add_booking(database, "2099/01/02", "07:00")
+    changed = client.get("/api/bookings", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert len(changed.get_json()["bookings"]) == 2
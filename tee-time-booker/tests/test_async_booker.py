@@ -0,0 +1,285 @@
+import asyncio
+import time as time_module
+
+import pytest
+import requests
+
+import async_booker
+import brs_responses
+import tee_time_booker
+from mock_brs import MockBRSConfig, MockBRSServer
+from tests.stubs import StubSession, response
+
+CLUB = "club"
+DATE = "2099/01/01"
+
+ROWS_WITH_LINKS = (f'<table><tr class="bg-white"><td>07:30</td>'
+                   f'<td><a href="/{CLUB}/bookings/book/1/20990101/0730"></a></td></tr></table>')
+ROWS_WITHOUT_LINKS = '<table><tr class="bg-white"><td>07:30</td><td></td></tr></table>'
+LOGIN_PAGE = '<form><input name="login_form[_token]" value="token"></form>'
+
+
+def policy(window=1.0):
+    return brs_responses.RetryPolicy(window=window, interval=0, jitter=0)
+
+
+def static_html(session, window=1.0):
+    return asyncio.run(async_booker.getStaticHTML(session, CLUB, DATE, policy(window)))
+
+
+def test_static_html_returns_rows_with_links():
+    session = StubSession([response(text=ROWS_WITH_LINKS)])
+
+    assert static_html(session) == (ROWS_WITH_LINKS, False)
+    assert len(session.requests) == 1
+
+
+def test_rows_without_links_are_polled_then_left_to_the_browser():
+    session = StubSession([response(text=ROWS_WITHOUT_LINKS)])
+
+    assert static_html(session) == (None, True)
+    assert len(session.requests) == async_booker.NOT_OPEN_SHEET_POLLS + 1
+
+
+def test_rows_that_get_links_while_polled_are_returned():
+    session = StubSession([response(text=ROWS_WITHOUT_LINKS), response(text=ROWS_WITH_LINKS)])
+
+    assert static_html(session) == (ROWS_WITH_LINKS, False)
+    assert len(session.requests) == 2
+
+
+def test_rows_without_links_past_the_deadline_are_left_to_the_browser():
+    session = StubSession([response(text=ROWS_WITHOUT_LINKS)])
+
+    assert static_html(session, window=0) == (None, True)
+    assert len(session.requests) == 1
+
+
+def test_login_page_is_not_left_to_the_browser():
+    session = StubSession([response(text=LOGIN_PAGE)])
+
+    assert static_html(session) == (None, False)
+
+
+def test_page_without_tee_sheet_is_left_to_the_browser():
+    session = StubSession([response(text="<div id='app'></div>")])
+
+    assert static_html(session) == (None, True)
+
+
+def test_client_errors_are_not_retried():
+    session = StubSession([response(404)])
+
+    assert static_html(session) == (None, False)
+    assert len(session.requests) == 1
+
+
+def test_rate_limits_and_server_errors_are_retried():
+    session = StubSession([response(429, headers={"Retry-After": "0"}), response(503),
+                           response(text=ROWS_WITH_LINKS)])
+
+    assert static_html(session) == (ROWS_WITH_LINKS, False)
+    assert len(session.requests) == 3
+
+
+def test_repeated_errors_give_up_without_the_browser():
+    session = StubSession([requests.exceptions.ConnectionError("reset")])
+
+    assert static_html(session) == (None, False)
+    assert len(session.requests) == brs_responses.RetryPolicy.max_errors
+
+
+def test_tee_sheet_falls_back_to_selenium_for_rows_without_links(monkeypatch):
+    session = StubSession([response(text=ROWS_WITHOUT_LINKS)])
+    dynamic = []
+
+    def getDynamicHTML(session, club_name, date, pool=None, course=tee_time_booker.DEFAULT_COURSE):
+        dynamic.append((club_name, date, course))
+        return ROWS_WITH_LINKS
+
+    monkeypatch.setattr(tee_time_booker, "getDynamicHTML", getDynamicHTML)
+
+    page_source = asyncio.run(async_booker.getTeeSheetHTML(session, CLUB, DATE, policy=policy()))
+
+    assert page_source == ROWS_WITH_LINKS
+    assert dynamic == [(CLUB, DATE, tee_time_booker.DEFAULT_COURSE)]
+
+
+SLOT = tee_time_booker.TeeSheetRow("07:30", True, 4, f"/{CLUB}/bookings/book/1/20990101/0730")
+NEXT_SLOT = tee_time_booker.TeeSheetRow("07:40", True, 4, f"/{CLUB}/bookings/book/2/20990101/0740", "2")
+TOKENS = ["token", "csrf"]
+PLAYERS = ("3072", "", "", "")
+
+FORM = ('<form><input name="member_booking_form[token]" value="token">'
+        '<input name="member_booking_form[_token]" value="csrf"></form>')
+CONFIRMED = "<html><body>Your booking has been confirmed</body></html>"
+NOT_OPEN = "Bookings for this date are not yet open"
+TAKEN = "Sorry, this tee time is no longer available"
+
+
+def submit(session, tokens=TOKENS, relogin=None, stop=None, slot=SLOT, **policy_args):
+    retry_policy = brs_responses.RetryPolicy(**{"window": 1.0, "interval": 0, "jitter": 0, **policy_args})
+    return asyncio.run(async_booker.submitSlot(session, CLUB, slot, tokens, PLAYERS, retry_policy, relogin, stop))
+
+
+def test_slot_is_posted_to_its_rows_course():
+    session = StubSession([response(text=CONFIRMED)])
+
+    outcome, _ = submit(session, slot=NEXT_SLOT)
+
+    method, url, kwargs = session.requests[0]
+    assert outcome is brs_responses.Outcome.SUCCESS
+    assert (method, url) == ("POST", f"{tee_time_booker.BRS_MEMBERS_URL}/{CLUB}/bookings/store/2/20990101/0740")
+    assert kwargs["data"]["member_booking_form[token]"] == "token"
+    assert kwargs["data"]["member_booking_form[player_1]"] == "3072"
+
+
+def test_slot_not_open_yet_is_retried_until_it_opens():
+    session = StubSession([response(403, NOT_OPEN), response(403, NOT_OPEN), response(text=CONFIRMED)])
+
+    outcome, _ = submit(session)
+
+    assert outcome is brs_responses.Outcome.SUCCESS
+    assert session.count("POST") == 3
+
+
+def test_slot_not_open_is_given_up_at_the_deadline():
+    session = StubSession([response(403, NOT_OPEN)])
+
+    outcome, _ = submit(session, window=0.05)
+
+    assert outcome is brs_responses.Outcome.NOT_OPEN
+    assert session.count("POST") > 1
+
+
+def test_taken_slot_is_given_up_straight_away():
+    session = StubSession([response(409, TAKEN)])
+
+    outcome, _ = submit(session)
+
+    assert outcome is brs_responses.Outcome.SLOT_TAKEN
+    assert session.count("POST") == 1
+
+
+def test_missing_tokens_are_fetched_first():
+    session = StubSession({"GET": [response(text=FORM)], "POST": [response(text=CONFIRMED)]})
+
+    outcome, _ = submit(session, tokens=None)
+
+    assert outcome is brs_responses.Outcome.SUCCESS
+    assert [request[0] for request in session.requests] == ["GET", "POST"]
+
+
+def test_rejected_tokens_are_fetched_again_up_to_max_errors():
+    session = StubSession({"GET": [response(text=FORM)], "POST": [response(400, "Invalid booking form token")]})
+
+    outcome, _ = submit(session, max_errors=2)
+
+    assert outcome is brs_responses.Outcome.ERROR
+    assert [request[0] for request in session.requests] == ["POST", "GET", "POST"]
+
+
+def test_expired_session_is_logged_in_again():
+    session = StubSession({"GET": [response(text=FORM)],
+                           "POST": [response(text=LOGIN_PAGE, url=f"{tee_time_booker.BRS_MEMBERS_URL}/{CLUB}/login"),
+                                    response(text=CONFIRMED)]})
+    relogins = []
+
+    async def relogin():
+        relogins.append(True)
+        return True
+
+    outcome, _ = submit(session, relogin=relogin)
+
+    assert outcome is brs_responses.Outcome.SUCCESS
+    assert relogins == [True]
+    assert [request[0] for request in session.requests] == ["POST", "GET", "POST"]
+
+
+def test_expired_session_is_given_up_once_relogins_are_used_up():
+    session = StubSession([response(419, "Page expired")])
+
+    async def relogin():
+        return True
+
+    outcome, _ = submit(session, relogin=relogin, max_relogins=0)
+
+    assert outcome is brs_responses.Outcome.SESSION_EXPIRED
+    assert session.count("POST") == 1
+
+
+def test_stopped_slot_posts_nothing():
+    session = StubSession([response(text=CONFIRMED)])
+
+    async def stopped():
+        stop = asyncio.Event()
+        stop.set()
+        policy = brs_responses.RetryPolicy(window=1.0)
+        return await async_booker.submitSlot(session, CLUB, SLOT, TOKENS, PLAYERS, policy, stop=stop)
+
+    assert asyncio.run(stopped()) == (brs_responses.Outcome.NOT_OPEN, None)
+    assert session.requests == []
+
+
+def test_next_slot_is_booked_when_the_best_is_taken():
+    session = StubSession({("POST", "/0730"): [response(409, TAKEN)], ("POST", "/0740"): [response(text=CONFIRMED)]})
+
+    booked = asyncio.run(async_booker.bookTeeTime(session, CLUB, [SLOT, NEXT_SLOT], [TOKENS, TOKENS], *PLAYERS,
+                                                  policy=brs_responses.RetryPolicy(window=1.0)))
+
+    assert brs_responses.classify(booked) is brs_responses.Outcome.SUCCESS
+    assert [url.rsplit("/", 1)[1] for _, url, _ in session.requests] == ["0730", "0740"]
+
+
+def test_hedged_slot_wins_and_stops_the_slot_still_retrying():
+    session = StubSession({("POST", "/0730"): [response(403, NOT_OPEN)], ("POST", "/0740"): [response(text=CONFIRMED)]})
+    policy = brs_responses.RetryPolicy(window=1.0, interval=0.01, jitter=0)
+
+    report = asyncio.run(async_booker.raceTeeTime(session, CLUB, [SLOT, NEXT_SLOT], [TOKENS, TOKENS], 0.02, *PLAYERS,
+                                                  policy=policy))
+
+    assert report.winner == NEXT_SLOT.href
+    assert brs_responses.classify(report.response) is brs_responses.Outcome.SUCCESS
+    assert session.count("POST") < 20
+    posts = len(session.requests)
+    asyncio.run(asyncio.sleep(0.05))
+    assert len(session.requests) == posts
+
+
+@pytest.fixture
+def brs(monkeypatch):
+    with MockBRSServer(MockBRSConfig(club=CLUB, courses=2)) as server:
+        monkeypatch.setattr(tee_time_booker, "BRS_URL", server.url)
+        monkeypatch.setattr(tee_time_booker, "BRS_MEMBERS_URL", server.url)
+        yield server
+
+
+def test_booking_run_books_the_best_free_slot(brs):
+    brs.book(DATE, "07:30", "someone else")
+
+    booked = asyncio.run(async_booker.run("member", "password", CLUB, ["07:30", "07:40"], DATE, "3072",
+                                          courses=["1", "2"]))
+
+    assert brs_responses.classify(booked) is brs_responses.Outcome.SUCCESS
+    assert brs.state.accounts["member"].slot == "07:30 (course 2)"
+
+
+def test_blocking_entry_points_book_on_a_requests_session(brs):
+    prepared = tee_time_booker.prepare("member", "password", CLUB)
+
+    booked = tee_time_booker.fire(prepared, ["08:00"], DATE, "3072")
+
+    assert prepared.logged_in
+    assert isinstance(prepared.session, requests.Session)
+    assert brs_responses.classify(booked) is brs_responses.Outcome.SUCCESS
+    assert brs.state.accounts["member"].slot == "08:00"
+
+
+def test_slot_fired_before_the_release_is_booked_once_it_opens(brs):
+    prepared = tee_time_booker.prepare("member", "password", CLUB)
+    brs.config.release_at = time_module.time() + 0.2
+
+    booked = asyncio.run(async_booker.fireSlots(prepared, [SLOT], "3072"))
+
+    assert brs_responses.classify(booked) is brs_responses.Outcome.SUCCESS
+    assert brs.state.accounts["member"].first_post >= 0
@@ -0,0 +1,82 @@
+import time as time_module
+from email.utils import formatdate
+
+import pytest
+
+import brs_responses
+from brs_responses import Outcome
+from tests.stubs import response
+
+BOOKING_URL = "https://members.brsgolf.com/club/bookings/store/1/20990101/0730"
+
+
+@pytest.mark.parametrize("status_code, text, url, headers, outcome", [
+    (200, "Your booking has been confirmed", BOOKING_URL, {}, Outcome.SUCCESS),
+    (403, "Bookings for this date are not yet open", BOOKING_URL, {}, Outcome.NOT_OPEN),
+    (200, "Bookings open at 19:30", BOOKING_URL, {}, Outcome.NOT_OPEN),
+    (409, "", BOOKING_URL, {}, Outcome.SLOT_TAKEN),
+    (200, "Sorry, this tee time is no longer available", BOOKING_URL, {}, Outcome.SLOT_TAKEN),
+    (200, '<input name="login_form[_token]">', BOOKING_URL, {}, Outcome.SESSION_EXPIRED),
+    (200, "", "https://members.brsgolf.com/club/login", {}, Outcome.SESSION_EXPIRED),
+    (419, "Page expired", BOOKING_URL, {}, Outcome.SESSION_EXPIRED),
+    (429, "", BOOKING_URL, {}, Outcome.RATE_LIMITED),
+    (503, "", BOOKING_URL, {"Retry-After": "1"}, Outcome.RATE_LIMITED),
+    (503, "", BOOKING_URL, {}, Outcome.ERROR),
+    (400, "Invalid booking form token", BOOKING_URL, {}, Outcome.ERROR),
+])
+def test_classify(status_code, text, url, headers, outcome):
+    assert brs_responses.classify(response(status_code, text, url, headers)) is outcome
+
+
+def test_no_response_is_an_error():
+    assert brs_responses.classify(None) is Outcome.ERROR
+
+
+def test_retry_after_reads_seconds_and_dates():
+    assert brs_responses.retry_after(response(429, headers={"Retry-After": "2.5"})) == 2.5
+    assert brs_responses.retry_after(response(429, headers={"Retry-After": "-1"})) == 0.0
+    assert brs_responses.retry_after(response(429, headers={"Retry-After": "soon"})) is None
+    assert brs_responses.retry_after(response(429)) is None
+    assert brs_responses.retry_after(None) is None
+
+    later = brs_responses.retry_after(response(429, headers={"Retry-After": formatdate(time_module.time() + 30,
+                                                                                       usegmt=True)}))
+    assert 28 < later <= 30
+
+
+def test_not_open_is_retried_on_a_jittered_interval():
+    policy = brs_responses.RetryPolicy(window=10, interval=0.02, jitter=0.02)
+
+    delays = [policy.delay(Outcome.NOT_OPEN) for _ in range(20)]
+
+    assert all(0.02 <= delay <= 0.04 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_errors_are_given_up_after_max_errors():
+    policy = brs_responses.RetryPolicy(window=10, max_errors=3)
+
+    assert policy.delay(Outcome.ERROR, errors=2) is not None
+    assert policy.delay(Outcome.ERROR, errors=3) is None
+
+
+def test_rate_limits_back_off_or_wait_as_asked():
+    policy = brs_responses.RetryPolicy(window=10)
+
+    assert policy.delay(Outcome.RATE_LIMITED, errors=1) == brs_responses.RATE_LIMIT_BACKOFF * 2
+    assert policy.delay(Outcome.RATE_LIMITED, errors=10) == brs_responses.RATE_LIMIT_MAX_BACKOFF
+    assert policy.delay(Outcome.RATE_LIMITED, response(429, headers={"Retry-After": "3"})) == 3.0
+
+
+def test_nothing_is_retried_past_the_deadline():
+    assert brs_responses.RetryPolicy(window=0).delay(Outcome.NOT_OPEN) is None
+
+    policy = brs_responses.RetryPolicy(window=1)
+    assert policy.delay(Outcome.RATE_LIMITED, response(429, headers={"Retry-After": "5"})) is None
+
+
+def test_relogins_are_counted_once_per_claim():
+    policy = brs_responses.RetryPolicy(max_relogins=2)
+
+    assert [policy.claim_relogin() for _ in range(3)] == [True, True, False]
+    assert policy.relogins == 2
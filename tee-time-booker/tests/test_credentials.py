@@ -0,0 +1,119 @@
+import os
+
+import pytest
+import rsa
+
+import DB as DB_module
+import credentials
+
+
+@pytest.fixture(autouse=True)
+def small_keys(monkeypatch):
+    # Key strength doesn't matter here, and 2048 bit keys take a while to generate
+    monkeypatch.setattr(credentials, "KEY_BITS", 512)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = DB_module.Database(str(tmp_path / "database.db"))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def key_path(tmp_path):
+    return str(tmp_path / "vault.key")
+
+
+def stored(database, username):
+    rows = database.execute_query("SELECT * FROM credentials WHERE username = ?", (username,))
+    return rows[0] if rows else None
+
+
+def test_passwords_are_stored_encrypted(database, key_path):
+    vault = credentials.CredentialVault(database, key_path)
+    vault.store("member", "secret")
+
+    row = stored(database, "member")
+    assert "secret" not in row["password"] and "secret" not in row["digest"]
+    assert oct(os.stat(key_path).st_mode & 0o777) == "0o600"
+
+    vault.unlock(["member"])
+    assert vault.password("member") == "secret"
+
+
+def test_password_decrypts_on_demand_and_forget_drops_it(database, key_path):
+    credentials.CredentialVault(database, key_path).store("member", "secret")
+    vault = credentials.CredentialVault(database, key_path)
+
+    assert vault.password("member") == "secret"
+    assert vault.password("nobody") is None
+
+    vault.forget()
+    database.execute_update("DELETE FROM credentials")
+    assert vault.password("member") is None
+
+
+def test_storing_an_unchanged_password_skips_the_write(database, key_path):
+    vault = credentials.CredentialVault(database, key_path)
+    vault.store("member", "secret")
+    ciphertext = stored(database, "member")["password"]
+
+    vault.store("member", "secret")
+    assert stored(database, "member")["password"] == ciphertext
+
+    vault.store("member", "changed")
+    assert stored(database, "member")["password"] != ciphertext
+
+
+def test_new_password_replaces_the_unlocked_one(database, key_path):
+    vault = credentials.CredentialVault(database, key_path)
+    vault.store("member", "secret")
+    vault.unlock(["member"])
+
+    vault.store("member", "changed")
+
+    assert vault.password("member") == "changed"
+
+
+def test_password_changed_by_another_process_is_written_back(database, key_path):
+    ours = credentials.CredentialVault(database, key_path)
+    theirs = credentials.CredentialVault(database, key_path)
+    ours.store("member", "secret")
+    theirs.store("member", "changed")
+
+    ours.store("member", "secret")
+
+    assert credentials.CredentialVault(database, key_path).password("member") == "secret"
+
+
+def test_key_created_by_another_process_first_is_used(database, key_path, monkeypatch):
+    first = credentials.CredentialVault(database, key_path)
+    first.store("member", "secret")
+
+    # Both saw no key file, the other process linked its key into place first
+    monkeypatch.setattr(credentials.os.path, "exists", lambda path: False)
+    second = credentials.CredentialVault(database, key_path)
+
+    assert second.password("member") == "secret"
+    assert not [name for name in os.listdir(os.path.dirname(key_path)) if name.endswith(".tmp")]
+
+
+def test_legacy_booking_passwords_are_migrated(database, key_path):
+    with database.get_connection() as conn:
+        conn.execute("ALTER TABLE bookings ADD COLUMN password TEXT")
+        conn.execute("ALTER TABLE bookings ADD COLUMN private_key TEXT")
+        conn.commit()
+    for password in ("old", "latest"):
+        public_key, private_key = rsa.newkeys(512)
+        database.execute_insert(
+            "INSERT INTO bookings (username, club, date, time, players, password, private_key) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ("member", "club", "2100/01/08", "07:30", "1", rsa.encrypt(password.encode(), public_key).hex(),
+             private_key.save_pkcs1().decode()))
+
+    vault = credentials.CredentialVault(database, key_path)
+
+    assert vault.password("member") == "latest"
+    columns = [row["name"] for row in database.execute_query("PRAGMA table_info(bookings)")]
+    assert "password" not in columns and "private_key" not in columns
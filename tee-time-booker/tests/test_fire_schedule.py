@@ -0,0 +1,78 @@
+import threading
+import time as time_module
+
+import fire_schedule
+
+
+def schedule(*bookings):
+    fires = fire_schedule.FireSchedule()
+    fires.load([{"id": booking_id, "release_at": release_at} for booking_id, release_at in bookings])
+    return fires
+
+
+def test_earliest_instant_comes_first():
+    fires = schedule((1, 300), (2, 100), (3, 200), (4, 100))
+
+    assert fires.next() == 100
+    assert len(fires) == 3
+    assert fires.pop(100) == {2, 4}
+    assert fires.next() == 200
+
+
+def test_moving_or_removing_bookings_updates_the_next_instant():
+    fires = schedule((1, 100), (2, 200))
+
+    fires.add(1, 300)
+    assert fires.next() == 200
+
+    fires.add(3, 50)
+    assert fires.next() == 50
+
+    fires.remove(3)
+    fires.remove(2)
+    assert fires.next() == 300
+    assert fires.pop(300) == {1}
+    assert fires.next() is None
+
+
+def test_popped_instant_is_not_fired_again_until_it_gets_new_bookings():
+    fires = schedule((1, 100))
+    fires.pop(100)
+
+    assert fires.pop(100) == set()
+    assert fires.next() is None
+
+    fires.add(2, 100)
+    assert fires.next() == 100
+
+
+def test_load_replaces_the_schedule():
+    fires = schedule((1, 100))
+
+    fires.load([{"id": 2, "release_at": 200}])
+
+    assert fires.next() == 200
+    assert fires.pop(100) == set()
+
+
+def test_wait_returns_lead_seconds_before_the_instant():
+    release_at = time_module.time() + 0.2
+    fires = schedule((1, release_at))
+
+    assert fires.wait_for_next(lead=0.15, timeout=5) == release_at
+    assert time_module.time() < release_at
+
+
+def test_wait_times_out_without_instants():
+    start = time_module.monotonic()
+
+    assert fire_schedule.FireSchedule().wait_for_next(lead=0, timeout=0.05) is None
+    assert time_module.monotonic() - start >= 0.05
+
+
+def test_earlier_booking_wakes_the_wait():
+    fires = schedule((1, time_module.time() + 60))
+    soon = time_module.time() + 0.05
+    threading.Timer(0.02, fires.add, (2, soon)).start()
+
+    assert fires.wait_for_next(lead=0, timeout=5) == soon
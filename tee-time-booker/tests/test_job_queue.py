@@ -0,0 +1,154 @@
+import time as time_module
+from datetime import datetime
+
+import pytest
+
+import Booking
+import DB as DB_module
+import job_queue
+from job_queue import JobState
+
+RELEASE_AT = 4102444800
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = DB_module.Database(str(tmp_path / "database.db"))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def queue(database):
+    return job_queue.JobQueue(database)
+
+
+def add_bookings(database, count, release_at=RELEASE_AT, club="club"):
+    return [{"id": database.execute_insert(
+        "INSERT INTO bookings (username, club, date, time, players, release_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (f"member{i}", club, "2100/01/08", "07:30", "1,2", release_at)), "release_at": release_at}
+        for i in range(count)]
+
+
+def job(database, booking_id):
+    return database.execute_query("SELECT * FROM jobs WHERE booking_id = ?", (booking_id,))[0]
+
+
+def expire_leases(database):
+    database.execute_update("UPDATE jobs SET lease_expires = ? WHERE state = ?",
+                            (time_module.time() - 1, JobState.LEASED.value))
+
+
+def test_enqueue_adds_one_job_per_booking(database, queue):
+    bookings = add_bookings(database, 3)
+
+    assert queue.enqueue(bookings) == 3
+    assert queue.enqueue(bookings) == 0
+
+
+def test_claims_never_share_a_job(database, queue):
+    bookings = add_bookings(database, 5)
+    queue.enqueue(bookings)
+
+    first = queue.claim("a", RELEASE_AT, RELEASE_AT + 1, limit=3)
+    second = queue.claim("b", RELEASE_AT, RELEASE_AT + 1, limit=3)
+
+    assert len(first) == 3 and len(second) == 2
+    assert sorted(first + second) == [booking["id"] for booking in bookings]
+    assert queue.claim("c", RELEASE_AT, RELEASE_AT + 1) == []
+
+
+def test_claim_only_takes_jobs_in_the_release_range(database, queue):
+    queue.enqueue(add_bookings(database, 1) + add_bookings(database, 1, release_at=RELEASE_AT + 60))
+
+    assert len(queue.claim("a", RELEASE_AT, RELEASE_AT + 1)) == 1
+    assert queue.claim("a", RELEASE_AT, RELEASE_AT + 1) == []
+
+
+def test_complete_records_the_result(database, queue):
+    bookings = add_bookings(database, 2)
+    queue.enqueue(bookings)
+    first, second = queue.claim("a", RELEASE_AT, RELEASE_AT + 1)
+
+    assert queue.complete("a", first, True, "SUCCESS")
+    assert queue.complete("a", second, False, "SLOT_TAKEN", "No slot")
+
+    assert job(database, first)["state"] == JobState.SUCCEEDED.value
+    assert job(database, second)["state"] == JobState.FAILED.value
+    assert [booking["id"] for booking in queue.unfilled(RELEASE_AT, RELEASE_AT + 1)] == [second]
+
+
+def test_renew_keeps_a_lease_from_expiring(database, queue):
+    queue.enqueue(add_bookings(database, 1))
+    booking_ids = queue.claim("a", RELEASE_AT, RELEASE_AT + 1)
+    expire_leases(database)
+
+    assert queue.renew("a", booking_ids) == 1
+    assert queue.renew("b", booking_ids) == 0
+    assert queue.expired(RELEASE_AT, RELEASE_AT + 1) == []
+    assert queue.claim("b", RELEASE_AT, RELEASE_AT + 1) == []
+
+
+def test_abandoned_lease_is_reclaimed(database, queue):
+    queue.enqueue(add_bookings(database, 1))
+    [booking_id] = queue.claim("dead", RELEASE_AT, RELEASE_AT + 1)
+    expire_leases(database)
+
+    assert queue.expired(RELEASE_AT, RELEASE_AT + 1) == [RELEASE_AT]
+    assert queue.claim("alive", RELEASE_AT, RELEASE_AT + 1) == [booking_id]
+    assert job(database, booking_id)["attempts"] == 2
+
+    # The dead worker's late result no longer counts
+    assert not queue.complete("dead", booking_id, True)
+    assert queue.complete("alive", booking_id, True)
+
+
+def test_abandoned_lease_on_the_last_attempt_fails(database, queue):
+    queue.enqueue(add_bookings(database, 1))
+    for attempt in range(job_queue.MAX_ATTEMPTS):
+        [booking_id] = queue.claim(f"dead{attempt}", RELEASE_AT, RELEASE_AT + 1)
+        expire_leases(database)
+
+    assert queue.claim("alive", RELEASE_AT, RELEASE_AT + 1) == []
+    assert job(database, booking_id)["state"] == JobState.FAILED.value
+    assert queue.expired(RELEASE_AT, RELEASE_AT + 1) == []
+    assert [booking["id"] for booking in queue.unfilled(RELEASE_AT, RELEASE_AT + 1)] == [booking_id]
+
+
+def test_fill_marks_a_failed_job_succeeded(database, queue):
+    queue.enqueue(add_bookings(database, 1))
+    [booking_id] = queue.claim("a", RELEASE_AT, RELEASE_AT + 1)
+    queue.complete("a", booking_id, False)
+
+    assert queue.fill(booking_id, "SUCCESS")
+    assert not queue.fill(booking_id, "SUCCESS")
+    assert job(database, booking_id)["state"] == JobState.SUCCEEDED.value
+
+
+def test_scheduler_books_jobs_abandoned_mid_release(database, queue, monkeypatch):
+    release_at = int(time_module.time()) - 120
+    bookings = add_bookings(database, 3, release_at=release_at)
+    queue.enqueue(bookings)
+    fired = []
+
+    async def process_bookings_async(bookings, release_datetime, max_workers=None):
+        fired.extend(booking["id"] for booking in bookings)
+        return [Booking.BookingOutcome(booking["id"], booking["username"], success=True) for booking in bookings]
+
+    monkeypatch.setattr(Booking, "DB", database)
+    monkeypatch.setattr(Booking, "QUEUE", queue)
+    monkeypatch.setattr(Booking, "process_bookings_async", process_bookings_async)
+    monkeypatch.setattr(Booking.release_rules, "day_bounds", lambda day=None: (release_at - 60, release_at + 60))
+
+    # A worker claims the release's jobs and dies holding them, the others settle what they had
+    abandoned = queue.claim("dead", release_at, release_at + 1, limit=2)
+    assert Booking.process_bookings(datetime.fromtimestamp(release_at))[0].booking_id not in abandoned
+
+    Booking.reclaim_expired_jobs()
+    assert sorted(fired) == [bookings[2]["id"]]
+
+    expire_leases(database)
+    Booking.reclaim_expired_jobs()
+
+    assert sorted(fired) == sorted(booking["id"] for booking in bookings)
+    assert all(job(database, booking["id"])["state"] == JobState.SUCCEEDED.value for booking in bookings)
@@ -0,0 +1,48 @@
+import pytest
+
+import tee_time_booker
+
+EVENT = {"username": "member", "password": "secret", "club": "club", "date": "2099/01/01"}
+
+
+@pytest.fixture(autouse=True)
+def lambda_config(monkeypatch):
+    monkeypatch.setattr(tee_time_booker, "_lambda_config", {})
+
+
+def test_comma_separated_fields_are_split():
+    booking = tee_time_booker.lambdaBooking({**EVENT, "times": "12:50, 07:00", "players": "3072,3719, 3291",
+                                             "courses": "2,1"})
+
+    assert booking["times"] == ["12:50", "07:00"]
+    assert booking["players"] == ["3072", "3719", "3291"]
+    assert booking["courses"] == ["2", "1"]
+
+
+def test_list_fields_are_kept_as_strings():
+    booking = tee_time_booker.lambdaBooking({**EVENT, "times": ["07:00"], "players": [3072, 3719]})
+
+    assert booking["players"] == ["3072", "3719"]
+    assert booking["courses"] == [tee_time_booker.DEFAULT_COURSE]
+
+
+def test_event_falls_back_to_the_environment_config(monkeypatch):
+    monkeypatch.setattr(tee_time_booker, "_lambda_config", {**EVENT, "times": "07:00", "players": ["3072"]})
+
+    booking = tee_time_booker.lambdaBooking({"times": "08:00"})
+
+    assert booking["username"] == "member"
+    assert booking["times"] == ["08:00"]
+    assert booking["players"] == ["3072"]
+
+
+def test_booking_without_players_is_rejected():
+    with pytest.raises(ValueError, match="players"):
+        tee_time_booker.lambdaBooking({**EVENT, "times": "07:00", "players": " , "})
+
+
+def test_invalid_event_is_a_bad_request():
+    response = tee_time_booker.lambda_handler({**EVENT, "times": ""}, None)
+
+    assert response["statusCode"] == 400
+    assert not response["booked"]
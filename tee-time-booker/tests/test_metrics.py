@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+import metrics
+
+
+def test_span_lands_on_the_bound_run():
+    with metrics.bind(metrics.RunRecord(1, "club")) as record:
+        with metrics.span("stage"):
+            pass
+
+    assert [span.stage for span in record.spans] == ["stage"]
+    assert record.spans[0].error is None
+
+
+def test_span_records_the_error_and_reraises():
+    with metrics.bind(metrics.RunRecord(1, "club")) as record:
+        with pytest.raises(ValueError):
+            with metrics.span("stage"):
+                raise ValueError("bad")
+
+    assert record.spans[0].error == "ValueError: bad"
+
+
+def test_spans_on_worker_threads_and_tasks_land_on_the_callers_run():
+    @metrics.timed("threaded")
+    def threaded():
+        pass
+
+    @metrics.timed("awaited")
+    async def awaited():
+        await asyncio.to_thread(threaded)
+
+    async def run(record):
+        with metrics.bind(record):
+            await asyncio.gather(awaited(), awaited())
+
+    record = metrics.RunRecord(1, "club")
+    asyncio.run(run(record))
+
+    assert sorted(span.stage for span in record.spans) == ["awaited", "awaited", "threaded", "threaded"]
+
+
+def test_registry_renders_prometheus_summaries():
+    registry = metrics.MetricsRegistry()
+    registry.record("stage", "club", 0.5)
+    registry.record("stage", "club", 1.5, error=True)
+
+    text = registry.prometheus()
+
+    assert 'booking_stage_seconds_count{stage="stage",club="club"} 2' in text
+    assert 'booking_stage_seconds_sum{stage="stage",club="club"} 2.000000' in text
+    assert 'booking_stage_errors_total{stage="stage",club="club"} 1' in text
@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time as time_module
+
+import pytest
+
+import rate_limiter
+from rate_limiter import BOOKING_PRIORITY, FETCH_PRIORITY, PING_PRIORITY, RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time_module", clock)
+    return clock
+
+
+def test_requests_are_prioritised_by_method():
+    assert rate_limiter.priority("post") == BOOKING_PRIORITY
+    assert rate_limiter.priority("GET") == FETCH_PRIORITY
+    assert rate_limiter.priority("HEAD") == PING_PRIORITY
+
+
+@pytest.mark.parametrize("status, throttled", [(200, False), (304, False), (404, False), (429, True), (500, True),
+                                               (503, True)])
+def test_throttled(status, throttled):
+    assert rate_limiter.throttled(status) is throttled
+
+
+def test_burst_goes_out_at_once_then_the_rate_applies():
+    bucket = TokenBucket("host", rate=50, burst=5)
+
+    waits = [bucket.acquire() for _ in range(7)]
+
+    assert max(waits[:5]) < 0.005
+    assert sum(waits[5:]) >= 0.03
+
+
+def test_booking_posts_go_ahead_of_queued_fetches():
+    bucket = TokenBucket("host", rate=20, burst=1)
+    bucket.acquire()
+    order = []
+
+    def request(priority, name):
+        bucket.acquire(priority)
+        order.append(name)
+
+    fetch = threading.Thread(target=request, args=(FETCH_PRIORITY, "fetch"))
+    post = threading.Thread(target=request, args=(BOOKING_PRIORITY, "post"))
+    fetch.start()
+    time_module.sleep(0.01)
+    post.start()
+    fetch.join()
+    post.join()
+
+    assert order == ["post", "fetch"]
+
+
+def test_coroutines_wait_without_blocking_the_loop():
+    bucket = TokenBucket("host", rate=50, burst=1)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.002)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        waits = await asyncio.gather(*(bucket.acquire_async() for _ in range(3)))
+        ticker.cancel()
+        return waits, ticks
+
+    waits, ticks = asyncio.run(run())
+
+    assert max(waits) >= 0.03
+    assert ticks >= 5
+
+
+def test_throttling_halves_the_rate_and_burst_and_empties_the_bucket(clock):
+    bucket = TokenBucket("host", rate=40, burst=20)
+
+    bucket.observe(429, sent=clock.now)
+
+    assert (bucket.rate, bucket.burst, bucket.tokens) == (20, 10, 0)
+    assert bucket.throttles == 1
+
+
+def test_responses_already_on_the_wire_dont_cut_again(clock):
+    bucket = TokenBucket("host", rate=40, burst=20)
+    sent = clock.now
+    clock.now += 0.01
+
+    bucket.observe(503, sent=sent)
+    bucket.observe(503, sent=sent)
+
+    assert bucket.rate == 20
+    assert bucket.throttles == 2
+
+
+def test_rate_never_drops_below_the_minimum(clock):
+    bucket = TokenBucket("host", rate=2, burst=2)
+
+    for _ in range(5):
+        clock.now += 1
+        bucket.observe(429, sent=clock.now)
+
+    assert bucket.rate == rate_limiter.MIN_RATE
+    assert bucket.burst == 1
+
+
+def test_retry_after_pauses_the_host(clock):
+    bucket = TokenBucket("host", rate=40, burst=20)
+
+    bucket.observe(429, retry_after=2.0, sent=clock.now)
+
+    assert bucket.paused_until == clock.now + 2.0
+
+
+def test_normal_answers_grow_the_rate_up_to_the_maximum(clock):
+    bucket = TokenBucket("host", rate=10, burst=10, max_rate=11)
+
+    bucket.observe(200)
+    assert bucket.rate == pytest.approx(10.1)
+
+    for _ in range(100):
+        bucket.observe(200)
+    assert bucket.rate == 11
+
+
+def test_burst_recovers_over_the_recovery_window(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "BURST_RECOVERY_SECONDS", 100)
+    bucket = TokenBucket("host", rate=40, burst=20)
+    bucket.observe(429, sent=clock.now)
+
+    clock.now += 25
+    bucket.observe(200)
+    assert bucket.burst == pytest.approx(15)
+
+    clock.now += 1000
+    bucket.observe(200)
+    assert bucket.burst == 20
+
+
+def test_limiter_keeps_a_bucket_per_host():
+    limiter = RateLimiter(rate=10, burst=3)
+
+    assert limiter.bucket("https://members.brsgolf.com/a") is limiter.bucket("https://members.brsgolf.com/b")
+    assert limiter.bucket("https://members.brsgolf.com/") is not limiter.bucket("https://brsgolf.com/")
+    assert limiter.warm_connections("https://brsgolf.com/", 10) == 3
+    assert limiter.refill_seconds("https://brsgolf.com/", 5) == 0.5
+
+
+def test_limiter_off_lets_everything_through():
+    limiter = RateLimiter(rate=0)
+
+    assert limiter.bucket("https://brsgolf.com/") is None
+    assert limiter.warm_connections("https://brsgolf.com/", 10) == 10
+    assert limiter.refill_seconds("https://brsgolf.com/", 5) == 0.0
+    start = time_module.monotonic()
+    for _ in range(100):
+        limiter.acquire("POST", "https://brsgolf.com/")
+    assert time_module.monotonic() - start < 0.05
@@ -0,0 +1,96 @@
+from datetime import datetime
+from email.utils import formatdate
+
+import pytest
+
+import brs_transport
+import rate_limiter
+import release_clock
+from mock_brs import MockBRSConfig, MockBRSServer
+
+
+class FakeClock:
+    """Stands in for the time module, moving only when slept or when a request takes its round trip"""
+
+    def __init__(self, now=1_000_000.25):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class DateSession:
+    """Answers HEADs with the Date a server offset from the fake clock would stamp mid round trip"""
+
+    def __init__(self, clock, offset, rtt=0.02):
+        self.clock = clock
+        self.offset = offset
+        self.rtt = rtt
+        self.heads = 0
+
+    def head(self, url, **kwargs):
+        self.heads += 1
+        self.clock.sleep(self.rtt / 2)
+        date = formatdate(int(self.clock.now + self.offset), usegmt=True)
+        self.clock.sleep(self.rtt / 2)
+        return type("Response", (), {"headers": {"Date": date}})()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(release_clock, "time_module", clock)
+    return clock
+
+
+@pytest.mark.parametrize("offset", [0.0, 2.3, -0.75])
+def test_offset_is_narrowed_to_the_round_trip(clock, offset):
+    session = DateSession(clock, offset)
+
+    estimate = release_clock.estimate_offset(session, "https://members.brsgolf.com/")
+
+    assert session.heads == release_clock.CALIBRATION_SAMPLES
+    assert estimate.samples == release_clock.CALIBRATION_SAMPLES
+    assert abs(estimate.offset - offset) <= estimate.uncertainty + 1e-9
+    assert estimate.uncertainty < 0.25
+
+
+def test_no_samples_assumes_the_local_clock(clock):
+    class BrokenSession:
+        def head(self, url, **kwargs):
+            return type("Response", (), {"headers": {}})()
+
+    assert release_clock.estimate_offset(BrokenSession(), "https://members.brsgolf.com/") == release_clock.ClockOffset()
+
+
+def test_release_in_the_past_fires_straight_away():
+    release = datetime.fromtimestamp(datetime.now().timestamp() - 1)
+
+    assert release_clock.wait_for_release(release) >= 0
+
+
+def test_calibration_heads_count_against_the_request_budget(monkeypatch):
+    class RecordingLimiter:
+        def __init__(self):
+            self.acquired = []
+            self.observed = []
+
+        def acquire(self, method, url):
+            self.acquired.append(method)
+            return 0.0
+
+        def observe(self, url, status, retry_after=None, sent=None):
+            self.observed.append(status)
+
+    limiter = RecordingLimiter()
+    monkeypatch.setattr(rate_limiter, "LIMITER", limiter)
+
+    with MockBRSServer(MockBRSConfig()) as server, brs_transport.session() as session:
+        estimate = release_clock.estimate_offset(session, f"{server.url}/", samples=2, interval=0.01)
+
+    assert estimate.samples == 2
+    assert limiter.acquired == ["HEAD", "HEAD"]
+    assert len(limiter.observed) == 2
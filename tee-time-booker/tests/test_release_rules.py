@@ -0,0 +1,56 @@
+from datetime import date, datetime, time, timezone
+
+import pytest
+
+import release_rules
+from release_rules import ReleaseRule
+
+
+def test_release_is_days_ahead_of_the_tee_date_at_the_release_time():
+    rule = ReleaseRule(days_ahead=7, release_time=time(19, 30), timezone=None)
+
+    assert rule.release_datetime("2099/01/08") == datetime(2099, 1, 1, 19, 30)
+    assert rule.release_datetime(date(2099, 1, 8)) == datetime(2099, 1, 1, 19, 30)
+    assert rule.release_at("2099/01/08") == int(datetime(2099, 1, 1, 19, 30).timestamp())
+
+
+def test_release_stays_at_the_clubs_wall_clock_time_across_dst():
+    rule = ReleaseRule(days_ahead=7, release_time=time(19, 30), timezone="Europe/London")
+
+    winter = datetime.fromtimestamp(rule.release_at("2099/01/08"), timezone.utc)
+    summer = datetime.fromtimestamp(rule.release_at("2099/07/08"), timezone.utc)
+
+    assert (winter.hour, winter.minute) == (19, 30)
+    assert (summer.hour, summer.minute) == (18, 30)
+
+
+def test_club_rules_fall_back_to_the_default_rule():
+    rules = release_rules.parse_rules('{"early": {"days_ahead": 14}, "late": {"time": "19:30", "timezone": "UTC"}}')
+
+    assert rules["early"] == ReleaseRule(days_ahead=14)
+    assert rules["late"] == ReleaseRule(release_time=time(19, 30), timezone="UTC")
+    assert release_rules.parse_rules("") == {}
+
+
+@pytest.mark.parametrize("value", ['{"club": {"days_ahead": "soon"}}', '{"club": {"time": "7pm"}}',
+                                   '{"club": {"timezone": "Nowhere/Special"}}', '{"club": []}'])
+def test_invalid_club_rules_are_rejected(value):
+    with pytest.raises(ValueError, match="club"):
+        release_rules.parse_rules(value)
+
+
+def test_bookings_use_their_clubs_rule(monkeypatch):
+    early = ReleaseRule(days_ahead=release_rules.DEFAULT_RULE.days_ahead + 7)
+    monkeypatch.setattr(release_rules, "CLUB_RULES", {"early": early})
+
+    assert release_rules.rule_for("early") is early
+    assert release_rules.rule_for("other") is release_rules.DEFAULT_RULE
+    assert release_rules.release_at("2099/01/31", "early") == early.release_at("2099/01/31")
+    assert release_rules.earliest_release_at("2099/01/31") == early.release_at("2099/01/31")
+
+
+def test_day_bounds_cover_one_local_day():
+    start, end = release_rules.day_bounds(date(2099, 1, 1))
+
+    assert datetime.fromtimestamp(start) == datetime(2099, 1, 1)
+    assert datetime.fromtimestamp(end) == datetime(2099, 1, 2)
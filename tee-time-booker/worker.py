@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Standalone booking worker
+
+Runs the booking scheduler on its own, outside the Flask process. Any number of
+workers can run at once, as processes on one machine or on several machines sharing
+database.db: each claims its own batch of due bookings from the job queue, and
+bookings held by a worker that dies are picked up again by the others.
+
+With --watch it runs the cancellation watcher instead, booking bookings that failed
+at release when their tee times are freed later in the week.
+
+Usage: python worker.py [--once | --watch] [--batch-size 50] [--concurrency 32]
+"""
+import argparse
+import logging
+
+import Booking
+import cancellation_watcher
+import job_queue
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="process the bookings of the next release today and exit")
+    parser.add_argument("--watch", action="store_true", help="watch for cancellations for unfilled bookings")
+    parser.add_argument("--batch-size", type=int, default=job_queue.BATCH_SIZE, help="jobs claimed per batch")
+    parser.add_argument("--concurrency", type=int, default=Booking.MAX_CONCURRENT_BOOKINGS,
+                        help="bookings in flight at once")
+    args = parser.parse_args()
+
+    job_queue.BATCH_SIZE = args.batch_size
+    Booking.MAX_CONCURRENT_BOOKINGS = args.concurrency
+    logger.info(f"Booking worker {Booking.WORKER_ID} started")
+
+    if args.watch:
+        cancellation_watcher.main()
+    elif args.once:
+        outcomes = Booking.process_bookings()
+        logger.info(f"Worker {Booking.WORKER_ID} processed {len(outcomes)} bookings, "
+                    f"{sum(outcome.success for outcome in outcomes)} succeeded")
+    else:
+        Booking.main()
+
+
+if __name__ == "__main__":
+    main()